@@ -0,0 +1,67 @@
+"""
+Gunicorn configuration for production serving.
+
+    gunicorn -c gunicorn.conf.py todo_project.wsgi:application
+
+Every setting can be overridden from the environment (GUNICORN_*).
+Worker classes:
+- gthread (default): processes x threads; good for this mostly I/O- and
+  SQLite-bound app
+- sync: one request per process
+- gevent: needs ``pip install gevent``
+- uvicorn.workers.UvicornWorker: needs ``pip install uvicorn`` and the ASGI
+  app, ``todo_project.asgi:application``
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+
+# CPU-scaled; SQLite serializes writes, so more workers mostly help reads
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '1000'))  # gevent only
+
+# Load Django once in the master; workers share its memory copy-on-write
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True') == 'True'
+
+# Recycle workers to bound slow memory growth; jitter avoids all restarting at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+
+# Idle keep-alive seconds, so the SPA's bursts of calls reuse a connection
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+
+# Heartbeat files on tmpfs so a slow disk cannot get workers killed
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def when_ready(server):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'todo_project.settings')
+    from django.conf import settings
+    if workers > 1 and settings.THROTTLE_ENABLED and settings.THROTTLE_STORE == 'local':
+        server.log.warning(
+            "THROTTLE_STORE='local' with %d workers: each worker keeps its own buckets, "
+            "so clients get up to %dx THROTTLE_RATES. Set REDIS_URL to share them.",
+            workers, workers,
+        )
+
+
+def post_fork(server, worker):
+    # Never share a database connection opened in the master with a worker
+    from django.db import connections
+    connections.close_all()
+
+
+def worker_exit(server, worker):
+    # Write out buffered completed toggles before the worker goes away
+    from tasks.write_buffer import buffer
+    buffer.flush()
@@ -0,0 +1,126 @@
+"""
+Simple HTTP load test for comparing serving setups.
+
+Logs in once, then runs concurrent clients against a mix of read
+endpoints for a fixed time and reports throughput and latency. Only the
+standard library is used, so it runs anywhere the app does.
+
+Example, runserver vs gunicorn on the same data:
+
+    python manage.py runserver 8000 --noreload
+    python loadtest.py --url http://127.0.0.1:8000 --username bench_user0 --password bench-password-123
+
+    gunicorn -c gunicorn.conf.py todo_project.wsgi:application
+    python loadtest.py --url http://127.0.0.1:8000 --username bench_user0 --password bench-password-123
+"""
+import argparse
+import http.client
+import json
+import math
+import threading
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_PATHS = [
+    '/api/tasks/?date={today}',
+    '/api/defaults/',
+    '/api/weekly-tasks/',
+    '/api/auth/me',
+    '/static/js/app.js',
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(pct / 100 * len(ordered))) - 1]
+
+
+def login(url, username, password):
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    body = json.dumps({'username': username, 'password': password})
+    conn.request('POST', '/api/auth/login', body, {'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    data = json.loads(response.read() or b'{}')
+    if response.status != 200:
+        raise SystemExit(f'login failed ({response.status}): {data}')
+    return data['token']
+
+
+def worker(url, token, paths, deadline, results, lock):
+    parts = urlsplit(url)
+    # One keep-alive connection per client, like a browser tab
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    headers = {'Authorization': f'Bearer {token}', 'Accept-Encoding': 'gzip, br'}
+    latencies, errors, received, i = [], 0, 0, 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            received += len(response.read())
+            if response.status >= 400:
+                errors += 1
+            if response.getheader('Connection', '').lower() == 'close':
+                conn.close()
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - started)
+    conn.close()
+    with lock:
+        results['latencies'] += latencies
+        results['errors'] += errors
+        results['bytes'] += received
+
+
+def run(url, token, paths, concurrency, duration):
+    results = {'latencies': [], 'errors': 0, 'bytes': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=worker, args=(url, token, paths, deadline, results, lock))
+        for _ in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies = results['latencies']
+    return {
+        'concurrency': concurrency,
+        'duration_s': duration,
+        'requests': len(latencies),
+        'requests_per_s': round(len(latencies) / duration, 1),
+        'errors': results['errors'],
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        'kb_received': round(results['bytes'] / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL of the running server')
+    parser.add_argument('--username', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32],
+                        help='Concurrent clients; several values run one after another')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per concurrency level')
+    parser.add_argument('--path', action='append', dest='paths',
+                        help='Path to request (repeatable); {today} is replaced with the current date')
+    args = parser.parse_args()
+
+    today = time.strftime('%Y-%m-%d')
+    paths = [p.format(today=today) for p in (args.paths or DEFAULT_PATHS)]
+    token = login(args.url, args.username, args.password)
+    report = [run(args.url, token, paths, c, args.duration) for c in args.concurrency]
+    print(json.dumps({'url': args.url, 'paths': paths, 'runs': report}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,26 @@ function getToken() {
 
 let useServer = false
 
+// Run several API calls in one round trip via /api/batch. Calls are sent in
+// chunks of BATCH_LIMIT (the server's MAX_BATCH_REQUESTS); returns one
+// {status, body} per call, in order.
+const BATCH_LIMIT = 50
+async function apiBatch(requests, atomic = false){
+  const token = getToken()
+  const responses = []
+  for(let i = 0; i < requests.length; i += BATCH_LIMIT){
+    const r = await fetch('/api/batch', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', 'Authorization': 'Bearer ' + token },
+      body: JSON.stringify({ requests: requests.slice(i, i + BATCH_LIMIT), atomic })
+    })
+    if(!r.ok) throw new Error(`batch failed: ${r.status}`)
+    const data = await r.json()
+    responses.push(...data.responses)
+  }
+  return responses
+}
+
 // Tabs support: two independent lists (personal, work) - migrate legacy names
 const savedTab = localStorage.getItem('todo.currentTab')
 const DEFAULT_TAB = 'personal'
@@ -412,12 +432,9 @@ async function clearCompletedWeekly() {
   if (!token) return
   const toDelete = weeklyTasks.filter(t => t.tab === currentTab && t.completed)
   try {
-    await Promise.all(toDelete.map(task => 
-      fetch(`/api/weekly-tasks/${task.id}/`, {
-        method: 'DELETE',
-        headers: { 'Authorization': 'Bearer ' + token }
-      })
-    ))
+    if (toDelete.length) {
+      await apiBatch(toDelete.map(task => ({ method: 'DELETE', path: `/api/weekly-tasks/${task.id}/` })))
+    }
     await loadWeeklyTasks()
   } catch(e) { console.error(e) }
 }
@@ -427,12 +444,9 @@ async function clearCompletedMonthly() {
   if (!token) return
   const toDelete = monthlyTasks.filter(t => t.tab === currentTab && t.completed)
   try {
-    await Promise.all(toDelete.map(task => 
-      fetch(`/api/monthly-tasks/${task.id}/`, {
-        method: 'DELETE',
-        headers: { 'Authorization': 'Bearer ' + token }
-      })
-    ))
+    if (toDelete.length) {
+      await apiBatch(toDelete.map(task => ({ method: 'DELETE', path: `/api/monthly-tasks/${task.id}/` })))
+    }
     await loadMonthlyTasks()
   } catch(e) { console.error(e) }
 }
@@ -442,12 +456,9 @@ async function clearCompletedYearly() {
   if (!token) return
   const toDelete = yearlyTasks.filter(t => t.completed)
   try {
-    await Promise.all(toDelete.map(task => 
-      fetch(`/api/yearly-tasks/${task.id}/`, {
-        method: 'DELETE',
-        headers: { 'Authorization': 'Bearer ' + token }
-      })
-    ))
+    if (toDelete.length) {
+      await apiBatch(toDelete.map(task => ({ method: 'DELETE', path: `/api/yearly-tasks/${task.id}/` })))
+    }
     await loadYearlyTasks()
   } catch(e) { console.error(e) }
 }
@@ -756,27 +767,18 @@ async function applyDefaultsForDates(dates){
   const token = getToken()
   if(useServer && token){
     try {
-      const res = await fetch('/api/defaults/apply/', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-          'Authorization': `Bearer ${token}`
-        },
-        body: JSON.stringify({ dates: dates, tab: currentTab })
-      })
-      if(res.ok){
-        const result = await res.json()
-        if(result.created > 0){
-          // Fetch updated tasks from server
-          const tasksRes = await fetch('/api/tasks/', {
-            headers: { 'Authorization': `Bearer ${token}` }
-          })
-          if(tasksRes.ok){
-            tasks = await tasksRes.json()
-            const STORAGE_KEY = getUserStorageKey('todo.tasks.v1')
-            localStorage.setItem(STORAGE_KEY, JSON.stringify(tasks))
-            return true
-          }
+      // Apply and re-fetch the tasks in one round trip
+      const [res, tasksRes] = await apiBatch([
+        { method: 'POST', path: '/api/defaults/apply/', body: { dates: dates, tab: currentTab } },
+        { method: 'GET', path: '/api/tasks/' }
+      ])
+      if(res.status < 400){
+        const result = res.body
+        if(result.created > 0 && tasksRes.status < 400){
+          tasks = tasksRes.body
+          const STORAGE_KEY = getUserStorageKey('todo.tasks.v1')
+          localStorage.setItem(STORAGE_KEY, JSON.stringify(tasks))
+          return true
         }
         return result.created > 0
       }
@@ -1016,8 +1018,8 @@ function updateAuthUI(){
     const displayName = user.first_name || user.username || 'User'
     authArea.innerHTML = `<span class="who">👤 ${displayName}</span> <button class="logout" id="btn-logout">Logout</button>`
     const btn = document.getElementById('btn-logout')
-    if(btn) btn.addEventListener('click', () => {
-      window.auth.clearToken();
+    if(btn) btn.addEventListener('click', async () => {
+      await window.auth.logout();
       updateAuthUI();
       // After logout, redirect to login so the app enforces authentication
       window.location.href = '/login.html'
@@ -15,10 +15,64 @@ function getToken(){
 
 function clearToken(){ 
   localStorage.removeItem('todo.auth.token')
+  localStorage.removeItem('todo.auth.refresh')
   // Clear cookie by setting it to expire
   document.cookie = 'auth_token=; expires=Thu, 01 Jan 1970 00:00:00 UTC; path=/;'
 }
 
+// Access tokens are short-lived; renew them with the refresh token
+const nativeFetch = window.fetch.bind(window)
+let refreshing = null
+
+function refreshToken(){
+  // Concurrent 401s share one refresh call (each refresh rotates the refresh token)
+  if(!refreshing){
+    const refresh = localStorage.getItem('todo.auth.refresh')
+    refreshing = (refresh ? nativeFetch('/api/auth/refresh', {
+      method: 'POST',
+      headers: {'Content-Type':'application/json'},
+      body: JSON.stringify({ refresh })
+    }).then(res => res.ok ? res.json() : null) : Promise.resolve(null))
+      .then(data => {
+        if(!data || !data.access) return null
+        saveToken(data.access)
+        document.cookie = `auth_token=${data.access}; path=/; SameSite=Lax`
+        if(data.refresh) localStorage.setItem('todo.auth.refresh', data.refresh)
+        return data.access
+      })
+      .catch(() => null)
+      .finally(() => { refreshing = null })
+  }
+  return refreshing
+}
+
+// Retry an API call once with a renewed access token when it gets a 401
+window.fetch = async function(input, init){
+  const res = await nativeFetch(input, init)
+  const url = typeof input === 'string' ? input : input.url
+  if(res.status !== 401 || !url.includes('/api/') || url.includes('/api/auth/')) return res
+  const headers = new Headers((init && init.headers) || {})
+  if(!headers.has('Authorization')) return res
+  const access = await refreshToken()
+  if(!access) return res
+  headers.set('Authorization', 'Bearer ' + access)
+  return nativeFetch(input, Object.assign({}, init, { headers }))
+}
+
+async function logout(){
+  // Revoke server-side, then forget the tokens locally whatever the outcome
+  const token = getToken()
+  const refresh = localStorage.getItem('todo.auth.refresh')
+  try{
+    await nativeFetch('/api/auth/logout', {
+      method: 'POST',
+      headers: Object.assign({'Content-Type':'application/json'}, token ? {'Authorization': 'Bearer ' + token} : {}),
+      body: JSON.stringify({ refresh })
+    })
+  }catch(e){}
+  clearToken()
+}
+
 async function postJson(url, body){
   const res = await fetch(url, { method: 'POST', headers: {'Content-Type':'application/json'}, body: JSON.stringify(body) })
   return res
@@ -52,5 +106,5 @@ function getUser(){
   return { username: p.username, userId: p.user_id, first_name: p.first_name || '' }
 }
 
-window.auth = { getToken, saveToken, clearToken, parseJwt, getUser, getCookie }
+window.auth = { getToken, saveToken, clearToken, refreshToken, logout, parseJwt, getUser, getCookie }
 
@@ -1,11 +1,177 @@
-from django.contrib import admin
+from urllib.parse import urlencode
+
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth import get_user_model
-from .models import Task, DefaultTask, WeeklyTask, MonthlyTask, YearlyTask
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.http import HttpResponse, QueryDict
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from .models import CompletionHistory, Job, Task, DefaultTask, WeeklyTask, MonthlyTask, YearlyTask, RequestProfile
+from . import avatars, sharding
+from .purge import purge_user
 
 User = get_user_model()
 
 
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never runs a full COUNT(*) over large tables.
+    Counts at most COUNT_LIMIT rows exactly; past that it uses the query
+    planner's row estimate on PostgreSQL and the limit elsewhere.
+    """
+    COUNT_LIMIT = 10000
+    
+    @cached_property
+    def count(self):
+        queryset = self.object_list.order_by()
+        count = queryset[:self.COUNT_LIMIT + 1].count()
+        if count > self.COUNT_LIMIT:
+            count = max(count, self.estimate(queryset))
+        return count
+    
+    @staticmethod
+    def estimate(queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return 0
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class UserAutocompleteFilter(admin.SimpleListFilter):
+    """
+    User filter that only renders the selected user. Other users are found
+    through a search box backed by the admin autocomplete endpoint, so the
+    sidebar does not list every account.
+    """
+    title = 'user'
+    parameter_name = 'user'
+    template = 'admin/tasks/user_autocomplete_filter.html'
+    
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        self.autocomplete_url = '{}?{}'.format(
+            reverse('admin:autocomplete'),
+            urlencode({
+                'app_label': model._meta.app_label,
+                'model_name': model._meta.model_name,
+                'field_name': 'user',
+            }),
+        )
+    
+    def lookups(self, request, model_admin):
+        value = self.value()
+        if value and value.isdigit():
+            username = User.objects.filter(pk=value).values_list('username', flat=True).first()
+            if username:
+                return [(value, username)]
+        return []
+    
+    def has_output(self):
+        return True
+    
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value and value.isdigit():
+            return queryset.filter(user_id=value)
+        return queryset
+    
+    def choices(self, changelist):
+        self.query_template = changelist.get_query_string({self.parameter_name: '__user__'})
+        return super().choices(changelist)
+
+
+class ScalableAdminMixin:
+    """
+    Changelist settings for tables with millions of rows: joined users in
+    one query, capped/estimated counts, an autocomplete user filter and a
+    title prefix search that can use the title index instead of
+    LIKE '%x%' scans across joins. With DB_SHARDS set, the pages show one
+    shard at a time (see ``shard_user``).
+    """
+    list_select_related = ['user']
+    list_per_page = 50
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # Newest first straight from the primary key, no sort over the table
+    ordering = ['-pk']
+    autocomplete_fields = ['user']
+    search_fields = ['title']
+    search_help_text = 'Titles starting with the search term (case-sensitive)'
+    
+    def shard_user(self, request):
+        """
+        The user whose shard the views read and write with DB_SHARDS set:
+        the one selected in the user filter (kept in ``_changelist_filters``
+        on change pages), else the signed-in user.
+        """
+        value = request.GET.get('user') or QueryDict(request.GET.get('_changelist_filters', '')).get('user')
+        if value and value.isdigit():
+            user = User.objects.filter(pk=value).first()
+            if user is not None:
+                return user
+        return request.user
+    
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        if sharding.enabled():
+            # Bound here: changelist rows are only fetched while the template renders
+            qs = qs.using(sharding.db_for_user(self.shard_user(request))).prefetch_related('user')
+        return qs
+    
+    def get_list_select_related(self, request):
+        related = super().get_list_select_related(request)
+        if sharding.enabled():
+            # The users table is not on the shards; users are prefetched instead
+            return [name for name in related if name != 'user']
+        return related
+    
+    # Unhinted queries and the views' transactions go to the same shard
+    def changelist_view(self, request, extra_context=None):
+        with sharding.use_user(self.shard_user(request)):
+            return super().changelist_view(request, extra_context)
+    
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        with sharding.use_user(self.shard_user(request)):
+            return super().changeform_view(request, object_id, form_url, extra_context)
+    
+    def delete_view(self, request, object_id, extra_context=None):
+        with sharding.use_user(self.shard_user(request)):
+            return super().delete_view(request, object_id, extra_context)
+    
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        condition = Q()
+        for field in self.search_fields:
+            condition |= self._prefix(field, term)
+        return queryset.filter(condition), False
+    
+    def _prefix(self, field, term):
+        # A range on the raw column is answered from the B-tree index
+        bounds = {'gte': term, 'lt': term + '\U0010ffff'}
+        relation, _, column = field.rpartition('__')
+        if not relation:
+            return Q(**{f'{field}__{op}': value for op, value in bounds.items()})
+        # Matching related rows first, then IN on the indexed foreign key
+        # rather than a join the OR would have to scan
+        related = self.model._meta.get_field(relation).related_model
+        matches = related.objects.filter(**{f'{column}__{op}': value for op, value in bounds.items()})
+        return Q(**{f'{relation}__in': matches.values('pk')})
+
+
 @admin.register(User)
 class CustomUserAdmin(UserAdmin):
     """Admin for the custom user model with extended fields."""
@@ -24,20 +190,55 @@ class CustomUserAdmin(UserAdmin):
     )
     
     readonly_fields = ['created_at', 'updated_at']
+    actions = ['purge_selected']
+    
+    def save_model(self, request, obj, form, change):
+        """Pictures uploaded here are cleaned and thumbnailed like API uploads."""
+        upload = form.cleaned_data.get('profile_picture') if 'profile_picture' in form.changed_data else None
+        if upload is not None:
+            obj.profile_picture = form.initial.get('profile_picture')
+        super().save_model(request, obj, form, change)
+        if upload is False:
+            avatars.remove(obj)
+        elif upload:
+            try:
+                avatars.store(obj, upload)
+            except avatars.InvalidImage as exc:
+                self.message_user(request, f'Profile picture not changed: {exc}', messages.ERROR)
+    
+    @admin.action(permissions=['delete'], description='Delete selected users and their data (fast)')
+    def purge_selected(self, request, queryset):
+        """
+        Chunked deletes instead of the ORM cascade, which loads every
+        related row (also to list them on the usual confirmation page).
+        """
+        if request.POST.get('post'):
+            for user in queryset:
+                counts, seconds = purge_user(user)
+                self.message_user(request, f'Deleted {user.username} and {sum(counts.values())} rows in {seconds:.1f}s')
+            return None
+        return TemplateResponse(request, 'admin/tasks/purge_confirmation.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Delete users and their data',
+            'opts': self.model._meta,
+            'users': queryset,
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        })
 
 
 @admin.register(Task)
-class TaskAdmin(admin.ModelAdmin):
+class TaskAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['title', 'date', 'completed', 'tab', 'user', 'created_at']
-    list_filter = ['completed', 'tab', 'date', 'user']
-    search_fields = ['title', 'user__username', 'user__email']
-    date_hierarchy = 'date'
+    list_filter = ['completed', 'tab', 'date', UserAutocompleteFilter]
     list_editable = ['completed']
-    readonly_fields = ['created_at', 'last_modified']
+    list_select_related = ['user', 'title_ref']
+    readonly_fields = ['title_ref', 'created_at', 'last_modified']
+    # Unmodified default-task copies keep their text in title_ref
+    search_fields = ['custom_title', 'title_ref__title']
     
     fieldsets = (
         ('Task Information', {
-            'fields': ('user', 'title', 'completed', 'date', 'tab')
+            'fields': ('user', 'custom_title', 'title_ref', 'completed', 'date', 'tab')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'last_modified'),
@@ -50,18 +251,45 @@ class TaskAdmin(admin.ModelAdmin):
         if request.user.is_superuser:
             return qs
         return qs.filter(user=request.user)
+    
+    # Keep the completion history in step with edits made here
+    def save_model(self, request, obj, form, change):
+        initial = form.initial
+        before = (initial.get('user', obj.user_id), initial.get('tab', obj.tab), initial.get('date', obj.date))
+        super().save_model(request, obj, form, change)
+        days = {(obj.user_id, obj.tab, obj.date)}
+        if change:
+            days.add(before)
+        CompletionHistory.refresh_tasks(days, using=obj._state.db)
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        CompletionHistory.refresh_days(obj.user_id, obj.tab, [obj.date], using=obj._state.db)
+    
+    def delete_queryset(self, request, queryset):
+        days = set(queryset.values_list('user_id', 'tab', 'date'))
+        super().delete_queryset(request, queryset)
+        CompletionHistory.refresh_tasks(days, using=queryset.db)
 
 
 @admin.register(DefaultTask)
-class DefaultTaskAdmin(admin.ModelAdmin):
-    list_display = ['title', 'weekday', 'tab', 'user', 'get_weekday_display']
-    list_filter = ['weekday', 'tab', 'user']
-    search_fields = ['title', 'user__username', 'user__email']
+class DefaultTaskAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ['title', 'weekday', 'frequency', 'tab', 'user', 'get_weekday_display']
+    list_filter = ['weekday', 'frequency', 'tab', UserAutocompleteFilter]
+    ordering = ['weekday', 'title']
+    readonly_fields = ['last_date']
     
     fieldsets = (
         ('Default Task Information', {
             'fields': ('user', 'weekday', 'title', 'tab')
         }),
+        ('Recurrence', {
+            'fields': (
+                'frequency', 'interval', 'weekdays', 'month_day', 'nth_weekday',
+                'start_date', 'until', 'count', 'last_date',
+            ),
+            'classes': ('collapse',)
+        }),
     )
     
     def get_queryset(self, request):
@@ -72,11 +300,9 @@ class DefaultTaskAdmin(admin.ModelAdmin):
 
 
 @admin.register(WeeklyTask)
-class WeeklyTaskAdmin(admin.ModelAdmin):
+class WeeklyTaskAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['title', 'week_start_date', 'week_end_date', 'completed', 'tab', 'user', 'created_at']
-    list_filter = ['completed', 'tab', 'week_start_date', 'user']
-    search_fields = ['title', 'user__username', 'user__email']
-    date_hierarchy = 'week_start_date'
+    list_filter = ['completed', 'tab', 'week_start_date', UserAutocompleteFilter]
     list_editable = ['completed']
     readonly_fields = ['created_at', 'last_modified', 'week_end_date']
     
@@ -98,10 +324,9 @@ class WeeklyTaskAdmin(admin.ModelAdmin):
 
 
 @admin.register(MonthlyTask)
-class MonthlyTaskAdmin(admin.ModelAdmin):
+class MonthlyTaskAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['title', 'month', 'year', 'completed', 'priority', 'tab', 'user', 'created_at']
-    list_filter = ['completed', 'priority', 'tab', 'month', 'year', 'user']
-    search_fields = ['title', 'user__username', 'user__email']
+    list_filter = ['completed', 'priority', 'tab', 'month', 'year', UserAutocompleteFilter]
     list_editable = ['completed', 'priority']
     readonly_fields = ['created_at', 'last_modified']
     
@@ -123,10 +348,9 @@ class MonthlyTaskAdmin(admin.ModelAdmin):
 
 
 @admin.register(YearlyTask)
-class YearlyTaskAdmin(admin.ModelAdmin):
+class YearlyTaskAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['title', 'year', 'quarter', 'completed', 'user', 'created_at']
-    list_filter = ['completed', 'quarter', 'year', 'user']
-    search_fields = ['title', 'user__username', 'user__email']
+    list_filter = ['completed', 'quarter', 'year', UserAutocompleteFilter]
     list_editable = ['completed', 'quarter']
     readonly_fields = ['created_at', 'last_modified']
     
@@ -146,3 +370,55 @@ class YearlyTaskAdmin(admin.ModelAdmin):
             return qs
         return qs.filter(user=request.user)
 
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'status', 'user', 'attempts', 'progress_done', 'progress_total', 'created_at', 'finished_at']
+    list_filter = ['status', 'kind']
+    list_select_related = ['user']
+    ordering = ['-pk']
+    autocomplete_fields = ['user']
+    readonly_fields = ['created_at', 'finished_at', 'locked_by', 'locked_at']
+    actions = ['requeue']
+    
+    @admin.action(description='Run again')
+    def requeue(self, request, queryset):
+        queryset.update(status=Job.QUEUED, run_after=timezone.now(), attempts=0, error='', locked_by='')
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ['method', 'path', 'status_code', 'duration_ms', 'trigger', 'user', 'created_at', 'download_link']
+    list_filter = ['trigger', 'method', 'status_code']
+    search_fields = ['path']
+    list_select_related = ['user']
+    ordering = ['-pk']
+    readonly_fields = ['user', 'method', 'path', 'status_code', 'duration_ms', 'trigger', 'created_at', 'download_link', 'summary']
+    exclude = ['stats']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def get_urls(self):
+        return [
+            path(
+                '<int:pk>/download/',
+                self.admin_site.admin_view(self.download_view),
+                name='tasks_requestprofile_download',
+            ),
+        ] + super().get_urls()
+    
+    def download_view(self, request, pk):
+        """Serve the raw pstats file for snakeviz/flameprof/gprof2dot."""
+        if not self.has_view_permission(request):
+            return HttpResponse(status=403)
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        response = HttpResponse(bytes(profile.stats), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="profile-{profile.pk}.prof"'
+        return response
+    
+    @admin.display(description='pstats')
+    def download_link(self, obj):
+        url = reverse('admin:tasks_requestprofile_download', args=[obj.pk])
+        return format_html('<a href="{}">Download</a>', url)
+
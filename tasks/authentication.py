@@ -0,0 +1,135 @@
+"""
+JWT authentication with access-token revocation.
+
+Access tokens are short-lived and normally checked by signature alone.
+Logging out revokes the current access token by its ``jti`` until the
+token would have expired anyway. Refresh tokens are revoked through
+simplejwt's token blacklist, which is only consulted on the (rare)
+refresh call.
+
+Revocation must reach every worker. JWT_REVOCATION_STORE selects how:
+
+- 'cache' (with REDIS_URL or DEBUG): revoked ids are kept in the
+  JWT_REVOCATION_CACHE cache, one cache lookup per request;
+- 'db': revoked ids are saved as RevokedToken rows and mirrored in each
+  process. A worker reads the rows revoked since its last read at most
+  every JWT_REVOCATION_POLL seconds, so requests normally cost no query
+  and a logout reaches the other workers within that delay.
+"""
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from . import sharding
+from .models import RevokedToken
+
+KEY_PREFIX = 'jwt-revoked:'
+
+
+class CacheRevocationStore:
+    """Revoked ids in the Django cache."""
+
+    def _cache(self):
+        return caches[settings.JWT_REVOCATION_CACHE]
+
+    def revoke(self, jti, expires_at, remaining):
+        self._cache().set(KEY_PREFIX + jti, True, timeout=remaining)
+
+    def is_revoked(self, jti):
+        return self._cache().get(KEY_PREFIX + jti, False)
+
+    def clear(self):
+        self._cache().clear()
+
+
+class DatabaseRevocationStore:
+    """RevokedToken rows mirrored in process memory."""
+
+    # Rows are read again for this long after their revocation, so one
+    # committed late (a slow write lock) is not missed
+    OVERLAP = timedelta(minutes=1)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revoked = {}  # jti -> expiry timestamp
+        self._polled = None  # time.monotonic() of the last read
+        self._since = None  # revoked_at lower bound of the next read
+
+    def revoke(self, jti, expires_at, remaining):
+        now = datetime.now(timezone.utc)
+        RevokedToken.objects.filter(expires_at__lte=now).delete()
+        RevokedToken.objects.get_or_create(jti=jti, defaults={'expires_at': expires_at})
+        with self._lock:
+            self._revoked[jti] = expires_at.timestamp()
+
+    def is_revoked(self, jti):
+        now = time.monotonic()
+        with self._lock:
+            due = self._polled is None or now - self._polled >= settings.JWT_REVOCATION_POLL
+            if due:
+                # Other threads go on with the current set meanwhile
+                self._polled = now
+        if due:
+            self._poll()
+        return jti in self._revoked
+
+    def _poll(self):
+        now = datetime.now(timezone.utc)
+        rows = RevokedToken.objects.filter(expires_at__gt=now)
+        if self._since is not None:
+            rows = rows.filter(revoked_at__gte=self._since)
+        rows = list(rows.values_list('jti', 'expires_at'))
+        with self._lock:
+            self._revoked = {jti: expiry for jti, expiry in self._revoked.items() if expiry > now.timestamp()}
+            self._revoked.update((jti, expires_at.timestamp()) for jti, expires_at in rows)
+            self._since = now - self.OVERLAP
+
+    def clear(self):
+        with self._lock:
+            self._revoked = {}
+            self._polled = self._since = None
+
+
+_stores = {'cache': CacheRevocationStore(), 'db': DatabaseRevocationStore()}
+
+
+def get_store():
+    return _stores[settings.JWT_REVOCATION_STORE]
+
+
+def revoke(token):
+    """Revoke a validated access token until its expiry."""
+    expires_at = datetime.fromtimestamp(token['exp'], timezone.utc)
+    remaining = token['exp'] - int(datetime.now(timezone.utc).timestamp())
+    if remaining > 0:
+        get_store().revoke(token['jti'], expires_at, remaining)
+
+
+def is_revoked(token):
+    return get_store().is_revoked(token.get('jti', ''))
+
+
+class RevocationCheckingJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that also rejects revoked access tokens and routes
+    the request's task queries to the user's shard.
+    """
+
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if is_revoked(token):
+            raise InvalidToken({
+                'detail': 'Token has been revoked',
+                'messages': [],
+            })
+        return token
+
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        sharding.activate(user)
+        return user
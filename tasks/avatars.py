@@ -0,0 +1,252 @@
+"""
+Profile picture uploads and avatar thumbnails.
+
+``POST /api/auth/me/avatar`` streams the upload to a temporary file in
+64 KB chunks (UploadHandler), so a large photo is never held in memory;
+files over AVATAR_MAX_BYTES are dropped while they stream in. ``store``
+then decodes the picture in the request. Only JPEG, PNG, WebP and GIF
+are accepted, and pictures over AVATAR_MAX_PIXELS are refused before
+they are decoded. JPEGs are decoded at a reduced scale when that is
+still larger than AVATAR_SOURCE_SIZE. The picture is turned upright from
+its EXIF orientation, scaled to at most AVATAR_SOURCE_SIZE and re-encoded
+without any metadata (EXIF and GPS, comments, ICC profiles). This clean
+copy is saved as ``profiles/<user id>/<hash>.jpg`` (``.png`` with
+transparency), named by a hash of its content.
+
+Once the upload commits, ``pool`` makes square thumbnails of each
+AVATAR_SIZES size, in WebP and JPEG, under ``avatars/<user id>/``. The
+user's ``avatar_hash`` is set last, so ``urls`` keeps pointing at the
+previous thumbnails until the new ones exist. Thumbnail URLs contain the
+content hash and never change content, so ``views.avatar`` serves them
+with a one-year immutable Cache-Control: an avatar is downloaded once
+per browser, a few KB, and not requested again.
+
+AVATAR_WORKERS threads make thumbnails (Pillow releases the GIL while it
+resizes and encodes). With 0 they are made in the request, after commit.
+``manage.py rebuild_avatars`` makes missing thumbnails, for example after
+a restart lost queued work or after AVATAR_SIZES changed.
+"""
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+from django.db import connections, router, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger('tasks.avatars')
+
+FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF')
+THUMBNAIL_FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}), 'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True})}
+CONTENT_TYPES = {'webp': 'image/webp', 'jpg': 'image/jpeg'}
+THUMBNAIL_NAME = re.compile(r'^(?P<hash>[0-9a-f]{16})-(?P<size>\d+)\.(?P<ext>webp|jpg)$')
+SOURCE_NAME = re.compile(r'^profiles/(?P<user>\d+)/(?P<hash>[0-9a-f]{16})\.(jpg|png)$')
+
+
+class InvalidImage(ValueError):
+    """The upload is not a picture this pipeline accepts."""
+
+
+class UploadHandler(TemporaryFileUploadHandler):
+    """Streams uploads to a temporary file; skips files larger than AVATAR_MAX_BYTES."""
+
+    too_large = False
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.AVATAR_MAX_BYTES:
+            self.too_large = True
+            raise SkipFile()  # The parser deletes the partial file
+        return super().receive_data_chunk(raw_data, start)
+
+
+def _open(upload):
+    try:
+        path = upload.temporary_file_path()
+    except AttributeError:
+        path = upload
+    try:
+        # Reads the header only; the pixels are decoded in _clean
+        image = Image.open(path, formats=FORMATS)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as exc:
+        raise InvalidImage('not a JPEG, PNG, WebP or GIF picture') from exc
+    if image.width * image.height > settings.AVATAR_MAX_PIXELS:
+        raise InvalidImage(f'pictures may have at most {settings.AVATAR_MAX_PIXELS} pixels')
+    return image
+
+
+def _clean(image):
+    """The upright picture, at most AVATAR_SOURCE_SIZE, encoded without metadata."""
+    size = settings.AVATAR_SOURCE_SIZE
+    alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    # JPEG only: decode at 1/2, 1/4 or 1/8 scale, never below ``size``
+    image.draft('RGB', (size, size))
+    try:
+        image = ImageOps.exif_transpose(image).convert('RGBA' if alpha else 'RGB')
+    except (OSError, SyntaxError) as exc:  # Truncated or corrupt pixel data
+        raise InvalidImage('the picture is damaged') from exc
+    image.thumbnail((size, size), Image.Resampling.LANCZOS)
+    # Encoders copy some of these (comments, ICC profiles) into the output
+    image.info = {}
+    out = io.BytesIO()
+    if alpha:
+        image.save(out, 'PNG', optimize=True)
+        return out.getvalue(), 'png'
+    image.save(out, 'JPEG', quality=90)
+    return out.getvalue(), 'jpg'
+
+
+def store(user, upload):
+    """
+    Clean ``upload`` (an uploaded file or a path) and make it ``user``'s
+    profile picture. Thumbnails are made once the transaction commits.
+    Returns the new content hash. Raises InvalidImage.
+    """
+    with _open(upload) as image:
+        content, ext = _clean(image)
+    digest = hashlib.sha256(content).hexdigest()[:16]
+    name = f'profiles/{user.pk}/{digest}.{ext}'
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(content))
+    User = get_user_model()
+    User.objects.filter(pk=user.pk).update(profile_picture=name)
+    user.profile_picture.name = name
+    transaction.on_commit(partial(pool.submit, user.pk, name), using=router.db_for_write(User))
+    return digest
+
+
+def remove(user):
+    """Clear ``user``'s profile picture; the files go once the transaction commits."""
+    User = get_user_model()
+    User.objects.filter(pk=user.pk).update(profile_picture='', avatar_hash='')
+    user.profile_picture.name = ''
+    user.avatar_hash = ''
+    transaction.on_commit(partial(_delete_unused, user.pk), using=router.db_for_write(User))
+
+
+def thumbnail_name(user_id, digest, size, ext):
+    return f'avatars/{user_id}/{digest}-{size}.{ext}'
+
+
+def urls(user, digest=None):
+    """
+    ``{size: {'webp': url, 'jpeg': url}}`` for ``user``'s current
+    thumbnails (or those of ``digest``), or None without a picture.
+    """
+    digest = digest or user.avatar_hash
+    if not digest:
+        return None
+    base = settings.MEDIA_URL
+    return {
+        str(size): {
+            'webp': f'{base}{thumbnail_name(user.pk, digest, size, "webp")}',
+            'jpeg': f'{base}{thumbnail_name(user.pk, digest, size, "jpg")}',
+        }
+        for size in settings.AVATAR_SIZES
+    }
+
+
+def make_thumbnails(user_id, name):
+    """
+    Write the thumbnails of the profile picture ``name`` and, if it is
+    still ``user_id``'s picture, serve them. Returns whether it was.
+    """
+    digest = SOURCE_NAME.match(name).group('hash')
+    with default_storage.open(name) as f:
+        source = Image.open(f)
+        source.load()
+    for size in settings.AVATAR_SIZES:
+        thumbnail = ImageOps.fit(source, (size, size), Image.Resampling.LANCZOS)
+        for ext, (format, options) in THUMBNAIL_FORMATS.items():
+            path = thumbnail_name(user_id, digest, size, ext)
+            if default_storage.exists(path):
+                continue
+            image = thumbnail
+            if format == 'JPEG' and image.mode == 'RGBA':
+                image = Image.new('RGB', image.size, 'white')
+                image.paste(thumbnail, mask=thumbnail.getchannel('A'))
+            out = io.BytesIO()
+            image.save(out, format, **options)
+            default_storage.save(path, ContentFile(out.getvalue()))
+    # Only if no newer upload replaced the picture meanwhile
+    current = get_user_model().objects.filter(pk=user_id, profile_picture=name).update(avatar_hash=digest)
+    _delete_unused(user_id)
+    return bool(current)
+
+
+def _delete_unused(user_id):
+    """Delete ``user_id``'s pictures and thumbnails that are neither served nor pending."""
+    row = get_user_model().objects.filter(pk=user_id).values_list('profile_picture', 'avatar_hash').first()
+    keep = set()
+    if row:
+        picture, avatar_hash = row
+        match = SOURCE_NAME.match(picture or '')
+        keep = {avatar_hash, match and match.group('hash')}
+    for directory in (f'profiles/{user_id}', f'avatars/{user_id}'):
+        try:
+            _, files = default_storage.listdir(directory)
+        except FileNotFoundError:
+            continue
+        for file in files:
+            if file.split('.')[0].split('-')[0] not in keep:
+                default_storage.delete(f'{directory}/{file}')
+
+
+class ThumbnailPool:
+    """
+    Threads that make thumbnails after uploads commit.
+
+    The executor is created on first use and dropped in forked children,
+    like hashers.HashingPool.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def submit(self, user_id, name):
+        if settings.AVATAR_WORKERS <= 0:
+            return self._run(user_id, name)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=settings.AVATAR_WORKERS, thread_name_prefix='avatars')
+            executor = self._executor
+        return executor.submit(self._run, user_id, name, threaded=True)
+
+    def _run(self, user_id, name, threaded=False):
+        try:
+            return make_thumbnails(user_id, name)
+        except Exception:
+            # rebuild_avatars makes them later
+            logger.exception('thumbnails of %s failed', name)
+        finally:
+            if threaded:
+                connections.close_all()
+
+    def reset(self):
+        """Wait for queued thumbnails and shut the executor down."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+pool = ThumbnailPool()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=pool.__init__)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def _user_deleted(sender, instance, using, **kwargs):
+    transaction.on_commit(partial(_delete_unused, instance.pk), using=using)
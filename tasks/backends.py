@@ -0,0 +1,52 @@
+"""
+Authentication backend that verifies passwords on the hashing pool.
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+from . import hashers
+
+
+class PooledModelBackend(ModelBackend):
+    """
+    ModelBackend with password checks on ``hashers.pool``.
+
+    The user lookup and any rehash write stay on the request thread (and
+    its database connection); only hashing is handed to the pool. Raises
+    PasswordHashingBusy when the pool is saturated.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # Hash anyway so unknown usernames take as long as wrong passwords
+            hashers.make_password(password)
+            return None
+
+        correct, must_update = hashers.check_password(password, user.password)
+        if not correct or not self.user_can_authenticate(user):
+            return None
+        if must_update:
+            user.password = hashers.make_password(password)
+            user.save(update_fields=['password'])
+        return user
+
+
+def create_user(username, password, email='', **extra_fields):
+    """``User.objects.create_user`` with the password hashed on the pool."""
+    UserModel = get_user_model()
+    manager = UserModel._default_manager
+    user = UserModel(
+        username=UserModel.normalize_username(username),
+        email=manager.normalize_email(email),
+        **extra_fields,
+    )
+    user.password = hashers.make_password(password)
+    user.save(using=manager.db)
+    return user
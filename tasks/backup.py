@@ -0,0 +1,186 @@
+"""
+Online snapshots of the SQLite databases.
+
+Copying ``data/db.sqlite3`` while the app runs can tear the copy, and
+locking the file for the whole copy stalls writers. ``snapshot`` uses
+SQLite's online backup API instead. It copies ``pages`` pages per step.
+The source is locked only while a step runs, and the snapshot pauses
+between steps so queued writers get in. A write from another connection
+restarts the copy, and the copy is consistent as of the step that
+finishes it. If writes keep restarting it, it is copied in a single step.
+
+Each snapshot is checked with ``PRAGMA quick_check``, gzipped, and
+written with a ``.sha256`` file in ``sha256sum`` format. Only the newest
+``keep`` snapshots of each database are kept. ``restore`` checks a
+snapshot and writes it back over a database with the same API.
+"""
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+SUFFIX = '.sqlite3.gz'
+CHUNK = 1024 * 1024
+
+
+class BackupError(Exception):
+    """A snapshot could not be made, or failed its checks."""
+
+
+def _quick_check(connection):
+    result = connection.execute('PRAGMA quick_check').fetchone()[0]
+    if result != 'ok':
+        raise BackupError(f'quick_check failed: {result}')
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _copy(source, target, pages, pause, max_restarts, stats):
+    """Back up connection ``source`` into ``target`` in steps of ``pages``, adding up ``stats``."""
+    resumed = time.perf_counter()
+
+    def progress(status, remaining, total):
+        nonlocal resumed
+        stats['steps'] += 1
+        if status in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED):
+            # A writer had the lock; SQLite waits ``pause`` and retries the step
+            stats['busy'] += 1
+            resumed = time.perf_counter() + pause
+            return
+        # Time since the last pause is the step, which held the source lock
+        held = time.perf_counter() - resumed
+        stats['hold'] += held
+        stats['max_hold'] = max(stats['max_hold'], held)
+        # A step that copied pages but left as many to go started over
+        if stats['remaining'] is not None and remaining >= stats['remaining']:
+            stats['restarts'] += 1
+            if stats['restarts'] > max_restarts:
+                raise _TooManyRestarts
+        stats['remaining'] = remaining
+        if remaining and pause:
+            time.sleep(pause)
+        resumed = time.perf_counter()
+
+    stats['remaining'] = None
+    source.backup(target, pages=pages, progress=progress, sleep=pause)
+
+
+def snapshot(database, directory, label, pages=256, pause=0.005, keep=7, max_restarts=3):
+    """
+    Write a checked, gzipped snapshot of the SQLite file ``database`` to
+    ``directory`` as ``<label>-<timestamp>.sqlite3.gz`` and rotate old ones.
+    Returns a dict of figures for the report.
+    
+    Writes that keep restarting the copy would starve it, so after
+    ``max_restarts`` restarts the database is copied in a single step.
+    """
+    if not os.path.isfile(database):
+        raise BackupError(f'no database file at {database}')
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"{label}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}{SUFFIX}"
+    path = directory / name
+
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory(dir=directory) as scratch:
+        copy_path = os.path.join(scratch, 'copy.sqlite3')
+        # No busy timeout: a step that meets a writer returns at once and is
+        # retried after the pause, instead of waiting inside the step
+        source = sqlite3.connect(database, timeout=0)
+        copy = sqlite3.connect(copy_path)
+        stats = {'steps': 0, 'busy': 0, 'restarts': 0, 'max_hold': 0.0, 'hold': 0.0, 'single_step': False}
+        try:
+            try:
+                _copy(source, copy, pages, pause, max_restarts, stats)
+            except _TooManyRestarts:
+                stats['single_step'] = True
+                _copy(source, copy, -1, 0, 0, stats)
+            copied = time.perf_counter() - started
+            _quick_check(copy)
+        finally:
+            copy.close()
+            source.close()
+        size = os.path.getsize(copy_path)
+
+        # Written under a temporary name, so a partial snapshot never looks complete
+        partial = directory / (name + '.part')
+        with open(copy_path, 'rb') as f, gzip.open(partial, 'wb', compresslevel=6) as out:
+            shutil.copyfileobj(f, out, CHUNK)
+    checksum = _sha256(partial)
+    os.replace(partial, path)
+    Path(f'{path}.sha256').write_text(f'{checksum}  {name}\n')
+
+    del stats['remaining']
+    return dict(
+        stats,
+        path=path,
+        size=size,
+        compressed=path.stat().st_size,
+        seconds=time.perf_counter() - started,
+        copy_seconds=copied,
+        removed=rotate(directory, label, keep),
+    )
+
+
+def snapshots(directory, label):
+    """Snapshots of ``label`` in ``directory``, oldest first."""
+    return sorted(Path(directory).glob(f'{label}-*{SUFFIX}'))
+
+
+def rotate(directory, label, keep):
+    """Delete all but the newest ``keep`` snapshots of ``label``; return the deleted paths."""
+    removed = snapshots(directory, label)[:-keep] if keep > 0 else []
+    for path in removed:
+        path.unlink()
+        Path(f'{path}.sha256').unlink(missing_ok=True)
+    return removed
+
+
+def verify(path):
+    """Raise BackupError unless ``path`` matches its .sha256 file."""
+    path = Path(path)
+    try:
+        expected = Path(f'{path}.sha256').read_text().split()[0]
+    except (OSError, IndexError):
+        raise BackupError(f'no checksum file for {path.name}')
+    if _sha256(path) != expected:
+        raise BackupError(f'{path.name} does not match its checksum')
+
+
+def restore(path, database, pages=-1):
+    """
+    Check the snapshot ``path`` and write it over the SQLite file
+    ``database``. Returns the database size in bytes.
+    """
+    verify(path)
+    with tempfile.TemporaryDirectory(dir=Path(path).parent) as scratch:
+        copy_path = os.path.join(scratch, 'restore.sqlite3')
+        try:
+            with gzip.open(path, 'rb') as f, open(copy_path, 'wb') as out:
+                shutil.copyfileobj(f, out, CHUNK)
+        except (OSError, EOFError) as exc:
+            raise BackupError(f'cannot decompress {Path(path).name}: {exc}')
+        copy = sqlite3.connect(copy_path)
+        target = sqlite3.connect(database)
+        try:
+            _quick_check(copy)
+            copy.backup(target, pages=pages)
+        finally:
+            target.close()
+            copy.close()
+        return os.path.getsize(copy_path)
@@ -0,0 +1,108 @@
+"""
+In-process execution of batched API calls (``POST /api/batch``).
+
+Each sub-request is built as a WSGI request copied from the batch
+request. It is resolved against the URLconf and passed straight to the
+view, without middleware. The sub-requests reuse the batch request's
+authenticated user, so the JWT is decoded once per batch rather than
+once per call. Throttles and permissions still run in each view. A call
+that raises gets a 500 entry and the batch goes on (unless atomic).
+Sub-requests of an atomic batch are marked ``in_atomic_batch``, so views
+write at once instead of deferring work past the batch's transaction.
+"""
+import io
+import json
+import logging
+
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import Http404
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger('tasks.batch')
+
+METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+# Never batched: logins and token calls, and batches themselves
+EXCLUDED_PREFIXES = ('/api/auth/', '/api/batch')
+
+# Request-specific WSGI keys that are not inherited by sub-requests
+_OWN_KEYS = ('REQUEST_METHOD', 'PATH_INFO', 'QUERY_STRING', 'CONTENT_TYPE', 'CONTENT_LENGTH', 'wsgi.input')
+
+
+class BatchRolledBack(Exception):
+    """Raised inside an atomic batch to roll it back after a failed call."""
+
+    def __init__(self, responses):
+        super().__init__('batch rolled back')
+        self.responses = responses
+
+
+def _error(status_code, message):
+    return {'status': status_code, 'body': {'error': message}}
+
+
+def build_request(parent, method, path, body, atomic=False):
+    path, _, query = path.partition('?')
+    payload = b'' if body is None else json.dumps(body).encode()
+    environ = {key: value for key, value in parent.META.items() if key not in _OWN_KEYS}
+    environ.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(payload)),
+        'wsgi.input': io.BytesIO(payload),
+    })
+    request = WSGIRequest(environ)
+    # DRF authenticates requests carrying these with the given user/token as is
+    request._force_auth_user = parent.user
+    request._force_auth_token = parent.auth
+    request.in_atomic_batch = atomic
+    return request
+
+
+def execute(parent, item, atomic=False):
+    """Run one ``{"method", "path", "body"}`` item and return ``{"status", "body"}``."""
+    if not isinstance(item, dict):
+        return _error(400, 'each request must be an object')
+    method = str(item.get('method', 'GET')).upper()
+    path = item.get('path')
+    if method not in METHODS:
+        return _error(400, f'method must be one of {", ".join(METHODS)}')
+    if not isinstance(path, str) or not path.startswith('/api/') or path.startswith(EXCLUDED_PREFIXES):
+        return _error(400, 'path must be an /api/ route other than auth and batch')
+
+    request = build_request(parent, method, path, item.get('body'), atomic)
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return _error(404, 'not found')
+    request.resolver_match = match
+
+    try:
+        response = match.func(request, *match.args, **match.kwargs)
+    except Http404:
+        return _error(404, 'not found')
+    except Exception:
+        # One failing call must not lose the other calls' responses; an
+        # atomic batch stops here and is rolled back by the caller
+        logger.exception('batched %s %s failed', method, path)
+        return _error(500, 'internal server error')
+    if hasattr(response, 'render'):
+        response.render()
+    content = response.content
+    if content and response.get('Content-Type', '').startswith('application/json'):
+        content = json.loads(content)
+    else:
+        content = content.decode('utf-8', 'replace') or None
+    return {'status': response.status_code, 'body': content}
+
+
+def execute_all(parent, items, atomic=False):
+    """Run ``items`` in order; an atomic batch stops at the first failure."""
+    responses = []
+    for item in items:
+        responses.append(execute(parent, item, atomic))
+        if atomic and responses[-1]['status'] >= 400:
+            break
+    return responses
@@ -0,0 +1,467 @@
+"""
+Benchmark helpers: a synthetic data generator and timed API scenarios.
+
+Used by the ``generate_bench_data`` and ``run_benchmarks`` management
+commands. All generated users share the ``bench_`` username prefix so the
+data can be recreated or removed without touching real accounts.
+"""
+import math
+import random
+import statistics
+import threading
+import time
+from contextlib import ExitStack
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import DatabaseError, connections
+from django.db.models import Count, Q
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import sharding
+from .models import CompletionHistory, Task, DefaultTask
+
+User = get_user_model()
+
+BENCH_PREFIX = 'bench_'
+BENCH_PASSWORD = 'bench-password-123'
+
+TITLES = [
+    'Morning run', 'Read 20 pages', 'Inbox zero', 'Team standup',
+    'Review pull requests', 'Plan tomorrow', 'Water the plants',
+    'Write weekly report', 'Call family', 'Stretching', 'Meditate',
+    'Groceries', 'Pay bills', 'Study Spanish', 'Code review', 'Deploy',
+]
+
+
+def _bulk_create(model, objs, batch_size=None):
+    """bulk_create ``objs`` on their users' task databases."""
+    by_db = {}
+    for obj in objs:
+        by_db.setdefault(sharding.db_for_user(obj.user), []).append(obj)
+    for db, group in by_db.items():
+        model.objects.using(db).bulk_create(group, batch_size=batch_size)
+    return len(objs)
+
+
+def generate_dataset(users=10, days=365, tasks_per_day=5, templates=10,
+                     end_date=None, seed=0, batch_size=5000):
+    """
+    Create ``users`` benchmark users with ``days`` days of tasks each,
+    ending at ``end_date`` (default: today), plus ``templates`` default
+    task templates per user. Existing benchmark users are replaced.
+
+    Returns a dict describing the generated dataset.
+    """
+    rng = random.Random(seed)
+    end_date = end_date or date.today()
+    start_date = end_date - timedelta(days=days - 1)
+
+    User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+
+    password = make_password(BENCH_PASSWORD)
+    bench_users = User.objects.bulk_create([
+        User(
+            username=f'{BENCH_PREFIX}user{i}',
+            email=f'{BENCH_PREFIX}user{i}@example.com',
+            first_name='Bench',
+            last_name=f'User {i}',
+            password=password,
+        )
+        for i in range(users)
+    ])
+    # bulk_create only returns primary keys on some backends
+    bench_users = list(User.objects.filter(username__startswith=BENCH_PREFIX).order_by('id'))
+
+    defaults = []
+    for user in bench_users:
+        seen = set()
+        for _ in range(templates):
+            key = (rng.randrange(7), rng.choice(TITLES), rng.choice(['personal', 'work']))
+            if key not in seen:
+                seen.add(key)
+                defaults.append(DefaultTask(user=user, weekday=key[0], title=key[1], tab=key[2]))
+    _bulk_create(DefaultTask, defaults, batch_size=batch_size)
+
+    total_tasks = 0
+    batch = []
+    for user in bench_users:
+        for offset in range(days):
+            day = start_date + timedelta(days=offset)
+            for n in range(tasks_per_day):
+                batch.append(Task(
+                    user=user,
+                    title=f'{rng.choice(TITLES)} #{n}',
+                    date=day,
+                    tab='personal' if n % 2 == 0 else 'work',
+                    completed=rng.random() < 0.6,
+                ))
+            if len(batch) >= batch_size:
+                total_tasks += _bulk_create(Task, batch)
+                batch = []
+    if batch:
+        total_tasks += _bulk_create(Task, batch)
+    for db in ['default'] + sharding.aliases():
+        CompletionHistory.rebuild([user.pk for user in bench_users], using=db)
+
+    # Refresh planner statistics so plans match a long-running database
+    for db in ['default'] + sharding.aliases():
+        with connections[db].cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    return {
+        'users': len(bench_users),
+        'days': days,
+        'tasks': total_tasks,
+        'templates': len(defaults),
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+    }
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class Scenario:
+    """
+    A named, repeatable operation.
+
+    ``run`` performs the measured work and returns the number of rows it
+    touched (used for rows/s). ``setup`` runs before each iteration and is
+    excluded from the timings.
+    """
+
+    def __init__(self, name, run, setup=None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+
+    def measure(self, iterations):
+        latencies = []
+        queries = []
+        rows = 0
+        for _ in range(iterations):
+            if self.setup:
+                self.setup()
+            # Every alias, so queries on task shards are counted too
+            with ExitStack() as stack:
+                captures = [stack.enter_context(CaptureQueriesContext(c)) for c in connections.all()]
+                started = time.perf_counter()
+                rows += self.run() or 0
+                latencies.append(time.perf_counter() - started)
+            queries.append(sum(len(ctx.captured_queries) for ctx in captures))
+
+        total = sum(latencies)
+        return {
+            'iterations': iterations,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+            'queries': max(queries),
+            'rows': rows,
+            'rows_per_s': round(rows / total, 1) if total else None,
+        }
+
+
+def _api_client(user):
+    client = APIClient()
+    token = RefreshToken.for_user(user).access_token
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+    return client
+
+
+def _expect(response, status_code=200):
+    if response.status_code != status_code:
+        raise RuntimeError(f'unexpected {response.status_code}: {response.content[:200]!r}')
+    return response
+
+
+def build_scenarios(sync_size=5000, apply_dates=42):
+    """Build the standard scenario list against the generated dataset."""
+    bench_users = list(User.objects.filter(username__startswith=BENCH_PREFIX).order_by('id')[:2])
+    if not bench_users:
+        raise RuntimeError('no benchmark data, run generate_bench_data first')
+    user = bench_users[0]
+    # Destructive scenarios get their own user so the read dataset stays stable
+    scratch = bench_users[-1]
+    client = _api_client(user)
+    scratch_client = _api_client(scratch)
+
+    latest = user.tasks.order_by('-date').values_list('date', flat=True).first()
+    latest = latest or date.today()
+
+    def list_tasks():
+        return len(_expect(client.get('/api/tasks/')).data)
+
+    def filter_by_date():
+        return len(_expect(client.get(f'/api/tasks/?date={latest.isoformat()}&tab=personal')).data)
+
+    def search():
+        return len(_expect(client.get('/api/search?q=review&page_size=50')).data['results'])
+
+    def streak():
+        _expect(client.get(f'/api/tasks/streak/?date={latest.isoformat()}'))
+        return 1
+
+    def calendar():
+        return len(_expect(client.get(f'/api/tasks/calendar/?year={latest.year}')).data['days'])
+
+    apply_start = latest + timedelta(days=1)
+    apply_range = [apply_start + timedelta(days=i) for i in range(apply_dates)]
+
+    def reset_apply():
+        scratch.tasks.filter(date__in=apply_range).delete()
+
+    def apply_defaults():
+        response = scratch_client.post('/api/defaults/apply/', {
+            'dates': [d.isoformat() for d in apply_range],
+            'tab': 'personal',
+        }, format='json')
+        return _expect(response).data['created']
+
+    sync_payload = [
+        {
+            'title': f'{TITLES[i % len(TITLES)]} #{i}',
+            'date': (latest - timedelta(days=i % 365)).isoformat(),
+            'tab': 'personal' if i % 2 == 0 else 'work',
+            'completed': i % 3 == 0,
+        }
+        for i in range(sync_size)
+    ]
+
+    def sync():
+        response = scratch_client.post('/api/tasks/sync/', sync_payload, format='json')
+        return _expect(response).data['count']
+
+    old_date = latest - timedelta(days=800)
+
+    def seed_old_tasks():
+        _bulk_create(Task, [
+            Task(user=scratch, title=f'Old task {i}', date=old_date - timedelta(days=i % 30))
+            for i in range(500)
+        ])
+
+    def cleanup():
+        return _expect(scratch_client.post('/api/tasks/cleanup/', {'days': 365}, format='json')).data['deleted']
+
+    login_client = APIClient()
+
+    def login():
+        response = login_client.post('/api/auth/login', {
+            'username': user.username,
+            'password': BENCH_PASSWORD,
+        }, format='json')
+        _expect(response)
+        return 1
+
+    admin, _ = User.objects.get_or_create(
+        username=f'{BENCH_PREFIX}admin',
+        defaults={
+            'email': f'{BENCH_PREFIX}admin@example.com',
+            'is_staff': True,
+            'is_superuser': True,
+        },
+    )
+    admin_client = Client()
+    admin_client.force_login(admin)
+
+    def admin_changelist():
+        _expect(admin_client.get('/admin/tasks/task/'))
+        return 100
+
+    return [
+        Scenario('list', list_tasks),
+        Scenario('date_filter', filter_by_date),
+        Scenario('search', search),
+        Scenario('streak', streak),
+        Scenario('calendar', calendar),
+        Scenario('defaults_apply_42_dates', apply_defaults, setup=reset_apply),
+        Scenario(f'sync_{sync_size}', sync),
+        Scenario('cleanup', cleanup, setup=seed_old_tasks),
+        Scenario('login', login),
+        Scenario('admin_changelist', admin_changelist),
+    ]
+
+
+def query_plans():
+    """
+    Return the query plan of each hot query against the benchmark data,
+    for comparing index changes before and after a migration.
+    """
+    user = User.objects.filter(username__startswith=BENCH_PREFIX).order_by('id').first()
+    if user is None:
+        raise RuntimeError('no benchmark data, run generate_bench_data first')
+    latest = user.tasks.order_by('-date').values_list('date', flat=True).first()
+    latest = latest or date.today()
+    week = [latest - timedelta(days=i) for i in range(42)]
+
+    queries = {
+        'list': user.tasks.order_by('-created_at'),
+        'date_filter': user.tasks.filter(date=latest, tab='personal').order_by('-created_at'),
+        'incomplete': user.tasks.filter(completed=False, date__gte=latest - timedelta(days=30)),
+        'heatmap': user.tasks.filter(date__gte=latest - timedelta(days=365), date__lte=latest)
+            .order_by('date').values('date').annotate(total=Count('id'), done=Count('id', filter=Q(completed=True))),
+        'apply_existing': user.tasks.filter(tab='personal', date__in=week).values_list('date', 'custom_title', 'title_ref_id'),
+        'apply_templates': user.default_tasks.filter(tab='personal').values_list('weekday', 'title'),
+    }
+    return {name: queryset.explain().splitlines() for name, queryset in queries.items()}
+
+
+def login_contention(duration=5.0, login_threads=4):
+    """
+    Measure login throughput and what it does to task reads.
+
+    A reader thread times date-filtered task lists for ``duration`` seconds
+    alone, then again while ``login_threads`` threads log in back to back.
+    Logins rejected because the hashing pool is full (503) are counted
+    separately.
+    """
+    user = User.objects.filter(username__startswith=BENCH_PREFIX).order_by('id').first()
+    if user is None:
+        raise RuntimeError('no benchmark data, run generate_bench_data first')
+    latest = user.tasks.order_by('-date').values_list('date', flat=True).first()
+    read_path = f'/api/tasks/?date={(latest or date.today()).isoformat()}&tab=personal'
+    token = str(RefreshToken.for_user(user).access_token)
+
+    def in_thread(target, *args):
+        def run():
+            try:
+                target(*args)
+            finally:
+                connections.close_all()
+        return threading.Thread(target=run)
+
+    def read(stop, latencies):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        while not stop.is_set():
+            started = time.perf_counter()
+            _expect(client.get(read_path))
+            latencies.append(time.perf_counter() - started)
+
+    counts = {'ok': 0, 'busy': 0}
+    counts_lock = threading.Lock()
+
+    def log_in(stop):
+        client = APIClient()
+        while not stop.is_set():
+            response = client.post('/api/auth/login', {
+                'username': user.username,
+                'password': BENCH_PASSWORD,
+            }, format='json')
+            key = 'busy' if response.status_code == 503 else 'ok'
+            if key == 'ok':
+                _expect(response)
+            with counts_lock:
+                counts[key] += 1
+
+    def timed_reads(with_logins):
+        stop = threading.Event()
+        latencies = []
+        threads = [in_thread(read, stop, latencies)]
+        if with_logins:
+            threads += [in_thread(log_in, stop) for _ in range(login_threads)]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return latencies
+
+    idle = timed_reads(False)
+    loaded = timed_reads(True)
+    return {
+        'hasher': settings.PASSWORD_HASHER,
+        'hash_workers': settings.PASSWORD_HASH_WORKERS,
+        'login_threads': login_threads,
+        'duration_s': duration,
+        'logins_per_s': round(counts['ok'] / duration, 1),
+        'busy_per_s': round(counts['busy'] / duration, 1),
+        'read_p50_ms_idle': round(percentile(idle, 50) * 1000, 3),
+        'read_p99_ms_idle': round(percentile(idle, 99) * 1000, 3),
+        'read_p50_ms_under_login_load': round(percentile(loaded, 50) * 1000, 3),
+        'read_p99_ms_under_login_load': round(percentile(loaded, 99) * 1000, 3),
+    }
+
+
+def write_contention(duration=5.0, writer_threads=4):
+    """
+    Measure task-create throughput with ``writer_threads`` benchmark users
+    writing at once, one thread each. With DB_SHARDS set, users on
+    different shards write to different files; compare against a run
+    without sharding. Rows created here are deleted afterwards.
+    """
+    users = list(User.objects.filter(username__startswith=BENCH_PREFIX, is_staff=False).order_by('id')[:writer_threads])
+    if len(users) < writer_threads:
+        raise RuntimeError(f'need {writer_threads} benchmark users, run generate_bench_data --users {writer_threads}')
+    title = 'Write contention'
+    latencies = []
+    errors = []
+
+    def write(user, stop):
+        client = _api_client(user)
+        try:
+            n = 0
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    response = client.post('/api/tasks/', {
+                        'title': f'{title} {n}',
+                        'date': date.today().isoformat(),
+                    }, format='json')
+                except DatabaseError as exc:
+                    # Counted, so a failing writer shows in the report rather than as 0 writes/s
+                    errors.append(type(exc).__name__)
+                    continue
+                if response.status_code == 201:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors.append(response.status_code)
+                n += 1
+        finally:
+            connections.close_all()
+
+    stop = threading.Event()
+    threads = [threading.Thread(target=write, args=(user, stop)) for user in users]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    for user in users:
+        user.tasks.filter(custom_title__startswith=title).delete()
+    return {
+        'shards': settings.DB_SHARDS,
+        'writers_per_database': sorted(
+            (db, sum(1 for u in users if sharding.db_for_user(u) == db))
+            for db in {sharding.db_for_user(u) for u in users}
+        ),
+        'writer_threads': writer_threads,
+        'duration_s': duration,
+        'writes_per_s': round(len(latencies) / duration, 1),
+        'errors': len(errors),
+        'write_p50_ms': round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        'write_p99_ms': round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+    }
+
+
+def run_scenarios(scenarios, iterations=20, only=None):
+    """Run each scenario and return a ``{name: stats}`` mapping."""
+    results = {}
+    for scenario in scenarios:
+        if only and scenario.name not in only:
+            continue
+        results[scenario.name] = scenario.measure(iterations)
+    return results
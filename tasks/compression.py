@@ -0,0 +1,78 @@
+"""
+Response compression for API responses.
+
+CompressionMiddleware compresses ``/api/`` responses of at least
+``API_COMPRESSION_MIN_BYTES``. It uses Brotli when the client accepts it
+and the ``brotli`` package is installed, and gzip otherwise. Auth
+endpoints are never compressed: their responses carry tokens, and
+compressing secrets alongside request data is what BREACH-style attacks
+exploit. HTML pages are left alone for the same reason (CSRF tokens).
+
+Static files are compressed ahead of time instead (WhiteNoise's
+CompressedManifestStaticFilesStorage at ``collectstatic``).
+"""
+import gzip
+import re
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # Optional; gzip only without it
+    brotli = None
+
+_ENCODING = re.compile(r'\s*([a-z*]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?')
+
+
+def accepted_encodings(header):
+    """Encodings from an Accept-Encoding header, minus those with q=0."""
+    accepted = set()
+    for part in header.lower().split(','):
+        match = _ENCODING.match(part)
+        if match and float(match.group(2) or 1) > 0:
+            accepted.add(match.group(1))
+    return accepted
+
+
+def compress(content, encoding):
+    if encoding == 'br':
+        return brotli.compress(content, quality=settings.API_COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(content, compresslevel=settings.API_COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """Brotli/gzip for API responses above a size threshold."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not request.path.startswith('/api/') or request.path.startswith('/api/auth/'):
+            return response
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if len(response.content) < settings.API_COMPRESSION_MIN_BYTES:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is not None and 'br' in accepted:
+            encoding = 'br'
+        elif 'gzip' in accepted:
+            encoding = 'gzip'
+        else:
+            return response
+
+        compressed = compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # The bytes differ per encoding, so a strong ETag must not be shared
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
@@ -0,0 +1,141 @@
+"""
+Password hashing off the request path.
+
+Password hashes are deliberately slow. To stop a burst of logins from
+using every CPU, they are computed on a small bounded thread pool, not
+inline in each request thread. ``hashlib`` releases the GIL while it
+runs PBKDF2 and scrypt (and argon2-cffi does the same), so other
+requests keep being served. Once the pool and its backlog are full, new
+work fails fast with PasswordHashingBusy (HTTP 503 with ``Retry-After``),
+so requests do not queue up behind it.
+
+The hasher profile is chosen with ``PASSWORD_HASHER`` (pbkdf2, scrypt
+or argon2) and its cost parameters in settings. Every profile still
+verifies the others' hashes. A stored hash that was made with another
+algorithm, or with different costs, is upgraded on the next successful
+login (see backends.PooledModelBackend).
+
+Pool size: ``PASSWORD_HASH_WORKERS``. Pending work allowed beyond that:
+``PASSWORD_HASH_BACKLOG``.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class TunedPBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """PBKDF2-SHA256 with ``PBKDF2_ITERATIONS`` rounds."""
+
+    @property
+    def iterations(self):
+        return settings.PBKDF2_ITERATIONS
+
+
+class TunedScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    """scrypt with ``SCRYPT_WORK_FACTOR`` / ``SCRYPT_BLOCK_SIZE`` / ``SCRYPT_PARALLELISM``."""
+
+    @property
+    def work_factor(self):
+        return settings.SCRYPT_WORK_FACTOR
+
+    @property
+    def block_size(self):
+        return settings.SCRYPT_BLOCK_SIZE
+
+    @property
+    def parallelism(self):
+        return settings.SCRYPT_PARALLELISM
+
+
+class TunedArgon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """Argon2id with ``ARGON2_TIME_COST`` / ``ARGON2_MEMORY_COST`` (KiB) / ``ARGON2_PARALLELISM``. Needs argon2-cffi."""
+
+    @property
+    def time_cost(self):
+        return settings.ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.ARGON2_PARALLELISM
+
+
+class PasswordHashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many concurrent sign-ins, retry shortly.'
+    default_code = 'password_hashing_busy'
+
+    def __init__(self, detail=None, code=None, wait=1):
+        super().__init__(detail, code)
+        self.wait = wait
+
+
+class HashingPool:
+    """
+    A bounded executor for password hashing.
+
+    The executor is created on first use and dropped in forked children,
+    so it works with gunicorn ``preload_app`` (threads do not survive a fork).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+
+    def _get(self):
+        with self._lock:
+            if self._executor is None:
+                workers = settings.PASSWORD_HASH_WORKERS
+                self._slots = threading.BoundedSemaphore(workers + settings.PASSWORD_HASH_BACKLOG)
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+            return self._executor, self._slots
+
+    def run(self, fn, *args):
+        """Run ``fn(*args)`` on the pool and wait for the result."""
+        executor, slots = self._get()
+        if not slots.acquire(blocking=False):
+            raise PasswordHashingBusy()
+        try:
+            return executor.submit(fn, *args).result()
+        finally:
+            slots.release()
+
+    def reset(self):
+        """Shut the executor down; the next call builds one from current settings."""
+        with self._lock:
+            executor, self._executor, self._slots = self._executor, None, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+pool = HashingPool()
+
+if hasattr(os, 'register_at_fork'):
+    # The parent's worker threads do not exist in the child; start clean
+    os.register_at_fork(after_in_child=pool.__init__)
+
+
+def make_password(raw_password):
+    """Hash ``raw_password`` with the preferred hasher, on the pool."""
+    return pool.run(hashers.make_password, raw_password)
+
+
+def check_password(raw_password, encoded):
+    """
+    Verify ``raw_password`` against ``encoded`` on the pool.
+    Returns ``(is_correct, must_update)``.
+    """
+    def verify():
+        upgrade = []
+        correct = hashers.check_password(raw_password, encoded, setter=upgrade.append)
+        return correct, bool(upgrade)
+    return pool.run(verify)
@@ -0,0 +1,196 @@
+"""
+Per-request performance instrumentation.
+
+PerformanceMiddleware records database query count and time (through
+``connection.execute_wrapper``), time spent in serializers and total
+request time. Each response gets a ``Server-Timing`` header, each request
+a structured log line, and per-endpoint histograms are kept in-process
+for the ``/api/metrics`` endpoint (Prometheus text format).
+
+Enabled with ``PERF_INSTRUMENTATION=True``.
+"""
+import logging
+import threading
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.db import connections
+
+logger = logging.getLogger('tasks.performance')
+
+_current_metrics = ContextVar('request_metrics', default=None)
+
+# Seconds; roughly the Prometheus client defaults
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestMetrics:
+    """Counters collected while a single request is handled."""
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.db_queries += 1
+
+
+def current_metrics():
+    """Return the metrics of the request being handled, if instrumented."""
+    return _current_metrics.get()
+
+
+class SerializerTimingMixin:
+    """
+    Serializer mixin that adds the time spent in ``to_representation``
+    to the current request's metrics. A no-op outside instrumented requests.
+    """
+
+    def to_representation(self, instance):
+        metrics = _current_metrics.get()
+        if metrics is None:
+            return super().to_representation(instance)
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.serializer_time += time.perf_counter() - started
+
+
+class Histogram:
+    """A cumulative histogram with fixed buckets."""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Thread-safe per-endpoint histograms and counters."""
+
+    HISTOGRAMS = {
+        'http_request_duration_seconds': 'Total request handling time',
+        'http_request_db_seconds': 'Time spent executing database queries',
+        'http_request_serializer_seconds': 'Time spent in serializers',
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {name: {} for name in self.HISTOGRAMS}
+            self._requests = {}
+            self._queries = {}
+
+    def observe(self, endpoint, method, status_code, total, metrics):
+        key = (endpoint, method)
+        with self._lock:
+            for name, value in (
+                ('http_request_duration_seconds', total),
+                ('http_request_db_seconds', metrics.db_time),
+                ('http_request_serializer_seconds', metrics.serializer_time),
+            ):
+                self._histograms[name].setdefault(key, Histogram()).observe(value)
+            status_key = (endpoint, method, str(status_code))
+            self._requests[status_key] = self._requests.get(status_key, 0) + 1
+            self._queries[key] = self._queries.get(key, 0) + metrics.db_queries
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            lines.append('# HELP http_requests_total Requests handled')
+            lines.append('# TYPE http_requests_total counter')
+            for (endpoint, method, code), value in sorted(self._requests.items()):
+                lines.append(
+                    f'http_requests_total{{endpoint="{endpoint}",method="{method}",status="{code}"}} {value}'
+                )
+            lines.append('# HELP http_request_db_queries_total Database queries executed')
+            lines.append('# TYPE http_request_db_queries_total counter')
+            for (endpoint, method), value in sorted(self._queries.items()):
+                lines.append(f'http_request_db_queries_total{{endpoint="{endpoint}",method="{method}"}} {value}')
+            for name, help_text in self.HISTOGRAMS.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (endpoint, method), histogram in sorted(self._histograms[name].items()):
+                    labels = f'endpoint="{endpoint}",method="{method}"'
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{{labels}}} {histogram.total:.6f}')
+                    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def _endpoint_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.route or 'unmatched'
+
+
+class PerformanceMiddleware:
+    """
+    Time each request and report the results.
+    Should be first in MIDDLEWARE so the total includes other middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current_metrics.set(metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics.execute_wrapper))
+                response = self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+        total = time.perf_counter() - started
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={metrics.db_time * 1000:.2f};desc="{metrics.db_queries} queries"',
+            f'ser;dur={metrics.serializer_time * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ])
+
+        endpoint = _endpoint_name(request)
+        registry.observe(endpoint, request.method, response.status_code, total, metrics)
+        logger.info(
+            'request endpoint=%s method=%s path=%s status=%s total_ms=%.2f db_ms=%.2f db_queries=%d serializer_ms=%.2f',
+            endpoint, request.method, request.path, response.status_code,
+            total * 1000, metrics.db_time * 1000, metrics.db_queries, metrics.serializer_time * 1000,
+            extra={
+                'endpoint': endpoint,
+                'status_code': response.status_code,
+                'total_ms': round(total * 1000, 2),
+                'db_ms': round(metrics.db_time * 1000, 2),
+                'db_queries': metrics.db_queries,
+                'serializer_ms': round(metrics.serializer_time * 1000, 2),
+            },
+        )
+        return response
@@ -0,0 +1,250 @@
+"""
+Background jobs for long API operations.
+
+Sync, multi-date apply and cleanup normally run in the request worker.
+A client that sends ``Prefer: respond-async`` (or ``?async=1``) gets
+``202 Accepted`` at once instead. The work is queued as a Job row, and
+``GET /api/jobs/<id>/`` reports its status, progress and result.
+
+``manage.py run_workers --concurrency N`` runs N threads that claim and
+run queued jobs. On PostgreSQL a claim is SELECT ... FOR UPDATE SKIP
+LOCKED. SQLite has no row locks, so there a claim is a conditional UPDATE
+of one queued row: SQLite serializes writes, and only one worker's UPDATE
+still matches.
+
+A job that raises is retried up to JOB_MAX_ATTEMPTS times, waiting
+JOB_RETRY_DELAY seconds, doubled after each attempt. Workers report
+progress as they go. If a running job reports nothing for JOB_LEASE
+seconds, its worker is taken to be gone and the job is claimed again. A
+handler can therefore run more than once and must be safe to repeat.
+Sync replaces all tasks, apply skips tasks that exist and cleanup deletes
+by date, so all three are.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connections, models, router, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import sharding
+from .models import CompletionHistory, DefaultTask, Job, Task
+from .serializers import JobSerializer, TaskSerializer
+
+logger = logging.getLogger('tasks.jobs')
+
+# Queued rows a SQLite worker tries before giving up a poll
+CLAIM_CANDIDATES = 5
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register ``fn(user, payload, progress)`` as the handler of ``kind`` jobs."""
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def wants_async(request):
+    return (
+        'respond-async' in request.headers.get('Prefer', '')
+        or request.query_params.get('async') in ('1', 'true')
+    )
+
+
+def enqueue(user, kind, payload):
+    return Job.objects.create(
+        user=user,
+        kind=kind,
+        payload=payload,
+        max_attempts=settings.JOB_MAX_ATTEMPTS,
+        run_after=timezone.now(),
+    )
+
+
+def accepted(job):
+    """202 response pointing at ``job``'s status endpoint."""
+    return Response(
+        JobSerializer(job).data,
+        status=status.HTTP_202_ACCEPTED,
+        headers={'Location': f'/api/jobs/{job.pk}/'},
+    )
+
+
+def run_inline(kind, user, payload):
+    """Run a handler in the current request and return its result."""
+    return HANDLERS[kind](user, payload, lambda done, total: None)
+
+
+def _claimable(now):
+    lease_expired = now - timedelta(seconds=settings.JOB_LEASE)
+    return Job.objects.filter(
+        models.Q(status=Job.QUEUED, run_after__lte=now)
+        | models.Q(status=Job.RUNNING, locked_at__lt=lease_expired, attempts__lt=models.F('max_attempts'))
+    )
+
+
+def claim(worker):
+    """Claim the oldest runnable job for ``worker``, or return None."""
+    now = timezone.now()
+    claimed = {
+        'status': Job.RUNNING,
+        'locked_by': worker,
+        'locked_at': now,
+        'attempts': models.F('attempts') + 1,
+    }
+    db = router.db_for_write(Job)
+    if connections[db].features.has_select_for_update_skip_locked:
+        with transaction.atomic(using=db):
+            pk = (
+                _claimable(now).select_for_update(skip_locked=True)
+                .order_by('run_after', 'pk').values_list('pk', flat=True).first()
+            )
+            if pk is None:
+                return None
+            Job.objects.filter(pk=pk).update(**claimed)
+    else:
+        candidates = _claimable(now).order_by('run_after', 'pk').values_list('pk', flat=True)
+        for pk in candidates[:CLAIM_CANDIDATES]:
+            # Still claimable only if no other worker got there first
+            if _claimable(now).filter(pk=pk).update(**claimed):
+                break
+        else:
+            return None
+    return Job.objects.select_related('user').get(pk=pk)
+
+
+def _reporter(job):
+    def progress(done, total):
+        # Also renews the lease, so long jobs are not claimed again
+        Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+            progress_done=done, progress_total=total, locked_at=timezone.now()
+        )
+    return progress
+
+
+def execute(job):
+    """Run a claimed job and record its result, a retry or the failure."""
+    now = timezone.now
+    try:
+        with sharding.use_user(job.user):
+            result = HANDLERS[job.kind](job.user, job.payload, _reporter(job))
+    except Exception as exc:
+        logger.exception('job %s (%s) failed, attempt %s of %s', job.pk, job.kind, job.attempts, job.max_attempts)
+        fields = {'error': f'{type(exc).__name__}: {exc}', 'locked_by': ''}
+        if job.attempts < job.max_attempts:
+            delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+            fields.update(status=Job.QUEUED, run_after=now() + timedelta(seconds=delay))
+        else:
+            fields.update(status=Job.FAILED, finished_at=now())
+    else:
+        fields = {'status': Job.DONE, 'result': result, 'error': '', 'locked_by': '', 'finished_at': now()}
+    # A job claimed again after its lease ran out belongs to the new worker
+    Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(**fields)
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def work(stop=None, once=False):
+    """
+    Claim and run jobs until ``stop`` is set, or until none is runnable
+    when ``once``. Returns the number of jobs run.
+    """
+    stop = stop or threading.Event()
+    worker = worker_name()
+    count = 0
+    while not stop.is_set():
+        job = claim(worker)
+        if job is None:
+            if once:
+                break
+            _maintain_when_due()
+            stop.wait(settings.JOB_POLL_INTERVAL)
+            continue
+        execute(job)
+        count += 1
+    return count
+
+
+_maintenance = {'lock': threading.Lock(), 'last': 0.0}
+
+
+def _maintain_when_due():
+    # Once per lease in each process, by whichever idle worker gets here first
+    with _maintenance['lock']:
+        if time.monotonic() - _maintenance['last'] < settings.JOB_LEASE:
+            return
+        _maintenance['last'] = time.monotonic()
+    maintain()
+
+
+def maintain():
+    """Fail jobs whose last attempt lost its worker and drop old finished jobs."""
+    now = timezone.now()
+    Job.objects.filter(
+        status=Job.RUNNING,
+        locked_at__lt=now - timedelta(seconds=settings.JOB_LEASE),
+        attempts__gte=models.F('max_attempts'),
+    ).update(status=Job.FAILED, error='worker lost', locked_by='', finished_at=now)
+    Job.objects.filter(
+        status__in=[Job.DONE, Job.FAILED],
+        finished_at__lt=now - timedelta(days=settings.JOB_KEEP_DAYS),
+    ).delete()
+
+
+@handler('sync')
+def sync_tasks(user, payload, progress):
+    """Replace all of ``user``'s tasks with the valid ones of ``payload['tasks']``."""
+    tasks_data = payload['tasks']
+    progress(0, len(tasks_data))
+
+    # Validate everything first, then replace in a single transaction
+    new_tasks = []
+    for task_data in tasks_data:
+        if not isinstance(task_data, dict):
+            continue
+        # Remove 'id' if present (we'll generate new ones)
+        task_data.pop('id', None)
+        serializer = TaskSerializer(data=task_data)
+        if serializer.is_valid():
+            new_tasks.append(Task(user=user, **serializer.validated_data))
+
+    with transaction.atomic(using=router.db_for_write(Task)):
+        # Delete existing tasks for this user
+        Task.objects.filter(user=user).delete()
+        created_tasks = Task.objects.bulk_create(new_tasks)
+        CompletionHistory.rebuild([user.pk], tasks=created_tasks)
+    progress(len(tasks_data), len(tasks_data))
+    return {'ok': True, 'count': len(created_tasks)}
+
+
+@handler('apply')
+def apply_defaults(user, payload, progress):
+    """Apply default tasks to ``payload['dates']`` (YYYY-MM-DD) of ``payload['tab']``."""
+    target_dates = []
+    for date_item in payload['dates']:
+        try:
+            target_dates.append(datetime.strptime(date_item, '%Y-%m-%d').date())
+        except (TypeError, ValueError):
+            continue  # Skip invalid dates
+    created = DefaultTask.apply_defaults_for_dates(user, target_dates, payload['tab'])
+    progress(len(target_dates), len(target_dates))
+    return {'created': created}
+
+
+@handler('cleanup')
+def cleanup(user, payload, progress):
+    """Delete ``user``'s tasks older than ``payload['days']`` days."""
+    deleted = Task.cleanup_old_tasks(user, payload['days'])
+    progress(1, 1)
+    return {'deleted': deleted}
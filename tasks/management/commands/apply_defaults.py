@@ -1,4 +1,5 @@
 from django.core.management.base import BaseCommand
+from tasks import sharding
 from tasks.models import DefaultTask
 from django.contrib.auth import get_user_model
 from datetime import date, timedelta
@@ -29,14 +30,15 @@ class Command(BaseCommand):
         start_date = date.today()
         total_created = 0
         
-        for i in range(days):
-            current_date = start_date + timedelta(days=i)
-            created_personal = DefaultTask.apply_defaults_for_date(user, current_date, 'personal')
-            created_work = DefaultTask.apply_defaults_for_date(user, current_date, 'work')
-            day_total = created_personal + created_work
-            total_created += day_total
-            
-            if day_total > 0:
-                self.stdout.write(f'  {current_date}: {day_total} tasks')
+        with sharding.use_user(user):
+            for i in range(days):
+                current_date = start_date + timedelta(days=i)
+                created_personal = DefaultTask.apply_defaults_for_date(user, current_date, 'personal')
+                created_work = DefaultTask.apply_defaults_for_date(user, current_date, 'work')
+                day_total = created_personal + created_work
+                total_created += day_total
+                
+                if day_total > 0:
+                    self.stdout.write(f'  {current_date}: {day_total} tasks')
         
         self.stdout.write(self.style.SUCCESS(f'\nTotal tasks created: {total_created}'))
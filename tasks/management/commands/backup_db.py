@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from tasks import backup
+
+
+def sqlite_aliases():
+    """Aliases of the file-backed SQLite databases (default and shards)."""
+    return [
+        alias for alias in connections
+        if connections[alias].vendor == 'sqlite' and not connections[alias].is_in_memory_db()
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Write compressed, checksummed online snapshots of the SQLite databases'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', action='append', dest='aliases',
+                            help='Database alias to back up (repeatable; default: all SQLite databases)')
+        parser.add_argument('--dir', default=settings.BACKUP_DIR, help='Snapshot directory')
+        parser.add_argument('--keep', type=int, default=settings.BACKUP_KEEP,
+                            help='Snapshots kept per database (0 keeps all)')
+        parser.add_argument('--pages', type=int, default=settings.BACKUP_PAGES, help='Pages copied per step')
+        parser.add_argument('--pause-ms', type=float, default=settings.BACKUP_PAUSE_MS,
+                            help='Pause between steps, letting writers in')
+
+    def handle(self, *args, **options):
+        aliases = options['aliases'] or sqlite_aliases()
+        for alias in aliases:
+            if alias not in sqlite_aliases():
+                raise CommandError(f'{alias} is not a file-backed SQLite database')
+            try:
+                stats = backup.snapshot(
+                    connections[alias].settings_dict['NAME'],
+                    options['dir'],
+                    alias,
+                    pages=options['pages'],
+                    pause=options['pause_ms'] / 1000,
+                    keep=options['keep'],
+                )
+            except backup.BackupError as exc:
+                raise CommandError(f'{alias}: {exc}')
+            mb = stats['size'] / 1e6
+            self.stdout.write(self.style.SUCCESS(f"{alias}: {stats['path']}"))
+            self.stdout.write(
+                f"  {mb:.1f} MB in {stats['seconds']:.2f}s "
+                f"({mb / stats['copy_seconds']:.1f} MB/s copying), "
+                f"{stats['compressed'] / 1e6:.1f} MB compressed"
+            )
+            self.stdout.write(
+                f"  {stats['steps']} steps ({stats['busy']} waited for writers), "
+                f"lock held {stats['max_hold'] * 1000:.1f} ms at most, {stats['hold'] * 1000:.0f} ms in total"
+            )
+            if stats['restarts']:
+                finish = ', then copied in a single step' if stats['single_step'] else ''
+                self.stdout.write(f"  restarted {stats['restarts']} times by writes{finish}")
+            for path in stats['removed']:
+                self.stdout.write(f'  removed {path.name}')
@@ -0,0 +1,28 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from tasks.benchmarks import generate_dataset
+
+
+class Command(BaseCommand):
+    help = 'Generate synthetic benchmark users, tasks and default task templates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Number of benchmark users')
+        parser.add_argument('--days', type=int, default=365, help='Days of task history per user')
+        parser.add_argument('--tasks-per-day', type=int, default=5, help='Tasks per user per day')
+        parser.add_argument('--templates', type=int, default=10, help='Default task templates per user')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for reproducible data')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            summary = generate_dataset(
+                users=options['users'],
+                days=options['days'],
+                tasks_per_day=options['tasks_per_day'],
+                templates=options['templates'],
+                seed=options['seed'],
+            )
+        self.stdout.write(json.dumps(summary, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Generated {summary['tasks']} tasks for {summary['users']} users"))
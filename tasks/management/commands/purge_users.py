@@ -0,0 +1,35 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from tasks.purge import purge_user
+
+
+class Command(BaseCommand):
+    help = 'Delete users and all their data with chunked deletes (much faster than the ORM cascade)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('users', nargs='+', help='User ids or usernames')
+        parser.add_argument('--chunk-size', type=int, help='Rows per DELETE (default PURGE_CHUNK_SIZE)')
+        parser.add_argument('--pause-ms', type=float, help='Pause after each DELETE (default PURGE_PAUSE_MS)')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='Do not ask for confirmation')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        ids = [value for value in options['users'] if value.isdigit()]
+        users = list(User.objects.filter(Q(pk__in=ids) | Q(username__in=options['users'])))
+        missing = set(options['users']) - {str(user.pk) for user in users} - {user.username for user in users}
+        if missing:
+            raise CommandError(f"No such user: {', '.join(sorted(missing))}")
+        if options['interactive']:
+            names = ', '.join(user.username for user in users)
+            if input(f"Delete {names} and all their data? Type 'yes' to continue: ") != 'yes':
+                raise CommandError('Purge cancelled.')
+
+        for user in users:
+            username = user.username
+            pause = options['pause_ms'] / 1000 if options['pause_ms'] is not None else None
+            counts, seconds = purge_user(user, options['chunk_size'], pause)
+            rows = ', '.join(f'{count} {label}' for label, count in counts.items())
+            self.stdout.write(self.style.SUCCESS(f'Deleted {username} in {seconds:.2f}s: {rows}'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from tasks import sharding
+
+
+class Command(BaseCommand):
+    help = "Move users' task rows onto their shard (run after changing DB_SHARDS)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--by-rows', action='store_true',
+                            help='Pin users to shards so every shard holds a similar number of rows')
+        parser.add_argument('--dry-run', action='store_true', help='Show the moves without making them')
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError('Sharding is off; set DB_SHARDS first.')
+        moves = sharding.rebalance(by_rows=options['by_rows'], dry_run=options['dry_run'])
+        for username, source, target, rows in moves:
+            self.stdout.write(f'  {username}: {rows} rows {source} -> {target}')
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        total = sum(rows for *_, rows in moves)
+        self.stdout.write(self.style.SUCCESS(f'{verb} {total} rows for {len({m[0] for m in moves})} users'))
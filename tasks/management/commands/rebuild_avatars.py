@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from tasks import avatars
+
+
+class Command(BaseCommand):
+    help = 'Clean profile pictures stored as uploaded and make missing avatar thumbnails'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, action='append', dest='user_ids',
+                            help='Only rebuild this user (repeatable)')
+
+    def _complete(self, user, digest):
+        return user.avatar_hash == digest and all(
+            default_storage.exists(avatars.thumbnail_name(user.pk, digest, size, ext))
+            for size in settings.AVATAR_SIZES for ext in avatars.THUMBNAIL_FORMATS
+        )
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        users = User.objects.exclude(profile_picture='').exclude(profile_picture__isnull=True)
+        if options['user_ids']:
+            users = users.filter(pk__in=options['user_ids'])
+        users = list(users)
+        for user in users:
+            name = user.profile_picture.name
+            if not avatars.SOURCE_NAME.match(name):
+                # Uploaded before pictures were cleaned: clean it, drop the original
+                try:
+                    with default_storage.open(name) as f:
+                        avatars.store(user, f)
+                except (OSError, avatars.InvalidImage) as exc:
+                    self.stderr.write(f'{user.username}: {name}: {exc}')
+                    continue
+                default_storage.delete(name)
+            elif not self._complete(user, avatars.SOURCE_NAME.match(name).group('hash')):
+                avatars.pool.submit(user.pk, name)
+        # Waits for the thumbnails
+        avatars.pool.reset()
+
+        missing = [
+            username for username, name, avatar_hash in
+            User.objects.filter(pk__in=[user.pk for user in users]).values_list('username', 'profile_picture', 'avatar_hash')
+            if not avatar_hash or avatar_hash not in name
+        ]
+        if missing:
+            self.stdout.write(self.style.WARNING(f"No thumbnails for {', '.join(missing)} (see the log)"))
+        self.stdout.write(self.style.SUCCESS(f'Checked {len(users)} users'))
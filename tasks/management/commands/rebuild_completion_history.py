@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from tasks.models import CompletionHistory
+
+
+class Command(BaseCommand):
+    help = 'Regenerate the completion history bitsets (streaks, year grids) from tasks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to rebuild')
+        parser.add_argument('--user-id', type=int, action='append', dest='user_ids',
+                            help='Only rebuild this user (repeatable)')
+
+    def handle(self, *args, **options):
+        count = CompletionHistory.rebuild(options['user_ids'], using=options['database'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {count} history rows'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import connections, DEFAULT_DB_ALIAS
+from tasks import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index over task titles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to rebuild')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor == 'postgresql':
+            self.stdout.write('PostgreSQL uses expression indexes on the task tables; nothing to rebuild.')
+            search.install(connection)
+            return
+        if connection.vendor != 'sqlite':
+            self.stdout.write(self.style.WARNING(f'No search index for {connection.vendor}; search uses icontains.'))
+            return
+        count = search.rebuild(connection)
+        if not search.has_fts(connection):
+            self.stdout.write(self.style.WARNING('This SQLite build has no FTS5; search uses icontains.'))
+            return
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} titles'))
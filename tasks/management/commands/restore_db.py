@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from tasks import backup
+from tasks.management.commands.backup_db import sqlite_aliases
+
+
+class Command(BaseCommand):
+    help = 'Restore a SQLite database from a backup_db snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('snapshot', help='Path of a .sqlite3.gz snapshot')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to overwrite')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='Do not ask for confirmation')
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        if alias not in sqlite_aliases():
+            raise CommandError(f'{alias} is not a file-backed SQLite database')
+        name = connections[alias].settings_dict['NAME']
+        if options['interactive']:
+            answer = input(f'This replaces all data in {name}. Stop the web server and workers first.\n'
+                           "Type 'yes' to continue: ")
+            if answer != 'yes':
+                raise CommandError('Restore cancelled.')
+        connections[alias].close()
+        try:
+            size = backup.restore(options['snapshot'], name)
+        except backup.BackupError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(f'Restored {alias} ({size / 1e6:.1f} MB) from {options["snapshot"]}'))
@@ -0,0 +1,82 @@
+import json
+import subprocess
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from tasks import throttling
+from tasks.benchmarks import build_scenarios, login_contention, query_plans, run_scenarios, write_contention
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Run timed API scenarios against the benchmark dataset and report JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help='Iterations per scenario')
+        parser.add_argument('--sync-size', type=int, default=5000, help='Tasks sent to the sync scenario')
+        parser.add_argument('--only', nargs='*', help='Run only the named scenarios')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--compare', help='Previous JSON report to print p50 deltas against')
+        parser.add_argument('--plans', action='store_true', help='Include the query plans of the hot queries')
+        parser.add_argument('--login-load', type=float, metavar='SECONDS',
+                            help='Also measure logins/s against concurrent task-read latency')
+        parser.add_argument('--login-threads', type=int, default=4, help='Concurrent login threads for --login-load')
+        parser.add_argument('--write-load', type=float, metavar='SECONDS',
+                            help='Also measure task creates/s with several users writing at once')
+        parser.add_argument('--writer-threads', type=int, default=4, help='Concurrent writing users for --write-load')
+
+    def handle(self, *args, **options):
+        # Scenarios repeat logins and syncs far faster than the rate limits allow
+        with throttling.disabled():
+            self.run(options)
+
+    def run(self, options):
+        try:
+            scenarios = build_scenarios(sync_size=options['sync_size'])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        report = {
+            'revision': _git_revision(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'scenarios': run_scenarios(scenarios, options['iterations'], options['only']),
+        }
+        if options['plans']:
+            report['plans'] = query_plans()
+        if options['login_load']:
+            report['login_contention'] = login_contention(options['login_load'], options['login_threads'])
+        if options['write_load']:
+            try:
+                report['write_contention'] = write_contention(options['write_load'], options['writer_threads'])
+            except RuntimeError as e:
+                raise CommandError(str(e))
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                previous = json.load(f)['scenarios']
+            for name, stats in report['scenarios'].items():
+                if name not in previous:
+                    continue
+                before = previous[name]['p50_ms']
+                change = (stats['p50_ms'] - before) / before * 100 if before else 0
+                self.stdout.write(
+                    f"{name}: p50 {before}ms -> {stats['p50_ms']}ms ({change:+.1f}%), "
+                    f"queries {previous[name]['queries']} -> {stats['queries']}"
+                )
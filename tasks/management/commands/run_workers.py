@@ -0,0 +1,43 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from tasks import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (sync, apply, cleanup handed off by the API)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help='Worker threads')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is runnable')
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            # Finish the jobs in progress, then exit
+            signal.signal(signum, lambda *_: stop.set())
+        jobs.maintain()
+
+        if options['concurrency'] == 1:
+            count = jobs.work(stop, once=options['once'])
+        else:
+            counts = []
+
+            def run():
+                try:
+                    counts.append(jobs.work(stop, once=options['once']))
+                finally:
+                    connections.close_all()
+
+            threads = [threading.Thread(target=run, name=f'job-worker-{n}') for n in range(options['concurrency'])]
+            for thread in threads:
+                thread.start()
+            # Joining with a timeout keeps the main thread able to take signals
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1)
+            count = sum(counts)
+        self.stdout.write(self.style.SUCCESS(f'Ran {count} jobs'))
@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from tasks.slow_queries import read_log
+
+
+class Command(BaseCommand):
+    help = 'Summarize the slow-query log, worst offenders first'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', default=None, help='Log file (default: SLOW_QUERY_LOG)')
+        parser.add_argument('--limit', type=int, default=10, help='Number of query shapes to show')
+        parser.add_argument('--hours', type=float, default=None, help='Only include entries from the last N hours')
+        parser.add_argument('--order', choices=['total', 'max', 'count'], default='total',
+                            help='Rank by total time, worst single run or number of runs')
+        parser.add_argument('--clear', action='store_true', help='Truncate the log after summarizing')
+
+    def handle(self, *args, **options):
+        log_path = options['log'] or settings.SLOW_QUERY_LOG
+        since = None
+        if options['hours'] is not None:
+            since = datetime.now(timezone.utc) - timedelta(hours=options['hours'])
+
+        groups = {}
+        for entry in read_log(log_path):
+            if since and datetime.fromisoformat(entry['timestamp']) < since:
+                continue
+            group = groups.setdefault(entry['fingerprint'], {
+                'count': 0, 'total': 0.0, 'max': 0.0, 'views': {}, 'worst': entry,
+            })
+            group['count'] += 1
+            group['total'] += entry['duration_ms']
+            view = entry.get('view') or '-'
+            group['views'][view] = group['views'].get(view, 0) + 1
+            if entry['duration_ms'] >= group['max']:
+                group['max'] = entry['duration_ms']
+                group['worst'] = entry
+
+        if not groups:
+            self.stdout.write('No slow queries recorded.')
+            return
+
+        ranked = sorted(groups.items(), key=lambda item: item[1][options['order']], reverse=True)
+        for fp, group in ranked[:options['limit']]:
+            worst = group['worst']
+            views = ', '.join(f'{name} ({count})' for name, count in
+                              sorted(group['views'].items(), key=lambda v: -v[1]))
+            self.stdout.write(self.style.WARNING(
+                f"[{fp}] {group['count']} runs, total {group['total']:.1f}ms, "
+                f"avg {group['total'] / group['count']:.1f}ms, max {group['max']:.1f}ms"
+            ))
+            self.stdout.write(f'  views: {views}')
+            self.stdout.write(f"  sql:   {worst['sql'][:300]}")
+            for line in worst.get('plan') or []:
+                self.stdout.write(f'  plan:  {line}')
+            self.stdout.write('')
+
+        if options['clear']:
+            open(log_path, 'w').close()
+            self.stdout.write(self.style.SUCCESS(f'Cleared {log_path}'))
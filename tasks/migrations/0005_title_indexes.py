@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0004_requestprofile'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='monthlytask',
+            index=models.Index(fields=['title'], name='tasks_month_title_72168c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['title'], name='tasks_task_title_6b13c2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='weeklytask',
+            index=models.Index(fields=['title'], name='tasks_weekl_title_dcfb60_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='yearlytask',
+            index=models.Index(fields=['title'], name='tasks_yearl_title_940bc7_idx'),
+        ),
+    ]
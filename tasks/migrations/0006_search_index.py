@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+def install_search_index(apps, schema_editor):
+    # Triggers for the tables as they are at this migration (no title_ref yet)
+    from tasks import search
+    search.install(schema_editor.connection, apps)
+    # Populated by 0010, which rebuilds the index against the current schema
+
+
+def uninstall_search_index(apps, schema_editor):
+    from tasks import search
+    search.uninstall(schema_editor.connection, apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0005_title_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0006_search_index'),
+    ]
+
+    operations = [
+        # Build the replacement indexes before dropping the old ones
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', 'date', 'tab', 'completed'], name='task_user_date_tab_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('completed', False)), fields=['user', 'date'], name='task_incomplete_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='tasks_task_user_id_5c9260_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='tasks_task_user_id_27cbfb_idx',
+        ),
+        migrations.AlterUniqueTogether(
+            name='defaulttask',
+            unique_together={('user', 'tab', 'weekday', 'title')},
+        ),
+    ]
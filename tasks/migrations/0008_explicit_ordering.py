@@ -0,0 +1,53 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:39
+
+from django.db import migrations, models
+
+
+def analyze(apps, schema_editor):
+    # Without sqlite_stat1 the planner prefers the (user, -created_at) index
+    # for filtered lists just to skip a small sort
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute('ANALYZE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0007_access_pattern_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='customuser',
+            options={'verbose_name': 'User', 'verbose_name_plural': 'Users'},
+        ),
+        migrations.AlterModelOptions(
+            name='defaulttask',
+            options={},
+        ),
+        migrations.AlterModelOptions(
+            name='monthlytask',
+            options={},
+        ),
+        migrations.AlterModelOptions(
+            name='requestprofile',
+            options={},
+        ),
+        migrations.AlterModelOptions(
+            name='task',
+            options={},
+        ),
+        migrations.AlterModelOptions(
+            name='weeklytask',
+            options={},
+        ),
+        migrations.AlterModelOptions(
+            name='yearlytask',
+            options={},
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', '-created_at'], name='task_user_created_idx'),
+        ),
+        migrations.RunPython(analyze, migrations.RunPython.noop),
+    ]
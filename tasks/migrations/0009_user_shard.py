@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 05:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0008_explicit_ordering'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='shard',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Task database shard when DB_SHARDS is set (empty: by user id)', null=True),
+        ),
+    ]
@@ -0,0 +1,100 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def intern_template_titles(apps, schema_editor):
+    """Point tasks that repeat one of their user's default-task titles at an interned copy."""
+    db = schema_editor.connection.alias
+    DefaultTask = apps.get_model('tasks', 'DefaultTask')
+    Task = apps.get_model('tasks', 'Task')
+    TaskTitle = apps.get_model('tasks', 'TaskTitle')
+    pairs = DefaultTask.objects.using(db).order_by().values_list('user_id', 'title').distinct()
+    for user_id, title in pairs:
+        tasks = Task.objects.using(db).filter(user_id=user_id, custom_title=title, title_ref__isnull=True)
+        if tasks.exists():
+            ref, _ = TaskTitle.objects.using(db).get_or_create(user_id=user_id, title=title)
+            tasks.update(custom_title='', title_ref=ref)
+
+
+def restore_titles(apps, schema_editor):
+    db = schema_editor.connection.alias
+    Task = apps.get_model('tasks', 'Task')
+    TaskTitle = apps.get_model('tasks', 'TaskTitle')
+    for ref in TaskTitle.objects.using(db).all():
+        Task.objects.using(db).filter(title_ref=ref).update(custom_title=ref.title, title_ref=None)
+
+
+def reinstall_search_index(apps, schema_editor):
+    # The task triggers now index the interned title
+    from tasks import search
+    search.uninstall(schema_editor.connection, apps)
+    search.install(schema_editor.connection, apps)
+
+
+def uninstall_search_index(apps, schema_editor):
+    # Search falls back to icontains until rebuild_search_index is run
+    from tasks import search
+    search.uninstall(schema_editor.connection, apps)
+
+
+def rebuild_search_index(apps, schema_editor):
+    from tasks import search
+    search.rebuild(schema_editor.connection, apps)
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute('ANALYZE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0009_user_shard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskTitle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=500)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='task_titles', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'title')},
+            },
+        ),
+        # Same column, new attribute name: `title` is now a property that
+        # also reads interned titles
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RenameField(
+                    model_name='task',
+                    old_name='title',
+                    new_name='custom_title',
+                ),
+                migrations.AlterField(
+                    model_name='task',
+                    name='custom_title',
+                    field=models.CharField(blank=True, db_column='title', help_text='Title of this task; empty when it uses the interned title', max_length=500),
+                ),
+                # RenameField leaves Meta.indexes naming the old field; the
+                # database indexes are on the same column and stay as they are
+                migrations.RemoveIndex(
+                    model_name='task',
+                    name='tasks_task_title_6b13c2_idx',
+                ),
+                migrations.AddIndex(
+                    model_name='task',
+                    index=models.Index(fields=['custom_title'], name='tasks_task_title_6b13c2_idx'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='title_ref',
+            field=models.ForeignKey(blank=True, help_text='Interned title of an unmodified default-task copy', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='tasks.tasktitle'),
+        ),
+        migrations.RunPython(reinstall_search_index, uninstall_search_index),
+        migrations.RunPython(intern_template_titles, restore_titles),
+        migrations.RunPython(rebuild_search_index, migrations.RunPython.noop),
+    ]
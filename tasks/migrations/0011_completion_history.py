@@ -0,0 +1,56 @@
+# Generated by Django 4.2.7 on 2026-10-19 05:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_history(apps, schema_editor):
+    """Fill the history from existing tasks (rebuild_completion_history does the same)."""
+    db = schema_editor.connection.alias
+    Task = apps.get_model('tasks', 'Task')
+    CompletionHistory = apps.get_model('tasks', 'CompletionHistory')
+    days = Task.objects.using(db).order_by().values('user_id', 'tab', 'date').annotate(
+        total=models.Count('id'),
+        done=models.Count('id', filter=models.Q(completed=True)),
+    ).values_list('user_id', 'tab', 'date', 'total', 'done')
+    bits = {}
+    for user_id, tab, day, total, done in days.iterator():
+        row = bits.setdefault((user_id, tab, day.year), [0, 0])
+        bit = 1 << (day.timetuple().tm_yday - 1)
+        row[0] |= bit
+        if done == total:
+            row[1] |= bit
+    CompletionHistory.objects.using(db).bulk_create([
+        CompletionHistory(
+            user_id=user_id, tab=tab, year=year,
+            active=active.to_bytes(46, 'little'), done=done.to_bytes(46, 'little'),
+        )
+        for (user_id, tab, year), (active, done) in bits.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0010_interned_task_titles'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompletionHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tab', models.CharField(choices=[('personal', 'Personal'), ('work', 'Work')], max_length=20)),
+                ('year', models.PositiveSmallIntegerField()),
+                ('active', models.BinaryField(default=bytes, help_text='Days with tasks', max_length=46)),
+                ('done', models.BinaryField(default=bytes, help_text='Days with all tasks completed', max_length=46)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='completion_history', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'completion history',
+                'unique_together': {('user', 'tab', 'year')},
+            },
+        ),
+        migrations.RunPython(build_history, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.7 on 2026-10-19 05:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0011_completion_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='defaulttask',
+            name='count',
+            field=models.PositiveIntegerField(blank=True, help_text='Number of occurrences', null=True),
+        ),
+        migrations.AddField(
+            model_name='defaulttask',
+            name='frequency',
+            field=models.CharField(choices=[('daily', 'Daily'), ('weekly', 'Weekly'), ('monthly', 'Monthly')], default='weekly', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='defaulttask',
+            name='interval',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Repeat every n days, weeks or months'),
+        ),
+        migrations.AddField(
+            model_name='defaulttask',
+            name='last_date',
+            field=models.DateField(blank=True, editable=False, help_text='Last occurrence when count is set', null=True),
+        ),
+        migrations.AddField(
+            model_name='defaulttask',
+            name='month_day',
+            field=models.SmallIntegerField(blank=True, help_text='Monthly: day of the month, -1 for the last', null=True),
+        ),
+        migrations.AddField(
+            model_name='defaulttask',
+            name='nth_weekday',
+            field=models.SmallIntegerField(blank=True, help_text='Monthly: nth of each weekday in the month (1-5, -1 for the last)', null=True),
+        ),
+        migrations.AddField(
+            model_name='defaulttask',
+            name='start_date',
+            field=models.DateField(blank=True, help_text='First day of the rule; anchors the interval', null=True),
+        ),
+        migrations.AddField(
+            model_name='defaulttask',
+            name='until',
+            field=models.DateField(blank=True, help_text='Last day of the rule', null=True),
+        ),
+        migrations.AddField(
+            model_name='defaulttask',
+            name='weekdays',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Bit set of weekdays (bit 0 = Sunday); empty: weekday only, or every day'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-19 05:39
+
+from django.db import migrations, models
+import tasks.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0012_default_task_recurrence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='templates_version',
+            field=models.PositiveIntegerField(default=tasks.models.new_templates_version, editable=False),
+        ),
+    ]
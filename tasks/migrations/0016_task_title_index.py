@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0015_user_avatar_hash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tasktitle',
+            index=models.Index(fields=['title'], name='tasks_taskt_title_7a7394_idx'),
+        ),
+    ]
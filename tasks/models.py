@@ -1,7 +1,17 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
-from datetime import datetime, timedelta
+from django.core.exceptions import ValidationError
+from datetime import date, datetime, timedelta
+import secrets
+
+from . import recurrence
+
+
+def new_templates_version():
+    # Random, so neither a reused user id nor a rolled back change can
+    # match an old cache entry
+    return secrets.randbits(30)
 
 
 class CustomUser(AbstractUser):
@@ -18,17 +28,24 @@ class CustomUser(AbstractUser):
     phone = models.CharField(max_length=20, blank=True, help_text='Phone number')
     date_of_birth = models.DateField(null=True, blank=True, help_text='Date of birth')
     profile_picture = models.ImageField(upload_to='profiles/', blank=True, null=True)
+    # Content hash of the thumbnails being served (tasks.avatars)
+    avatar_hash = models.CharField(max_length=16, blank=True, editable=False)
     bio = models.TextField(max_length=500, blank=True, help_text='Short bio')
     
     # Account settings
     email_verified = models.BooleanField(default=False)
+    shard = models.PositiveSmallIntegerField(
+        null=True, blank=True,
+        help_text='Task database shard when DB_SHARDS is set (empty: by user id)'
+    )
+    # Replaced whenever the user's default tasks change (tasks.template_cache)
+    templates_version = models.PositiveIntegerField(default=new_templates_version, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name = 'User'
         verbose_name_plural = 'Users'
-        ordering = ['-created_at']
     
     def __str__(self):
         return self.username
@@ -43,9 +60,46 @@ class CustomUser(AbstractUser):
         return self.first_name or self.username
 
 
+class TaskTitle(models.Model):
+    """
+    Interned task title: one row per distinct default-task title of a user.
+    Tasks generated from a default task point here instead of each storing
+    their own copy of the text.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='task_titles')
+    title = models.CharField(max_length=500)
+    
+    class Meta:
+        unique_together = ['user', 'title']
+        indexes = [
+            # Admin title prefix search across users
+            models.Index(fields=['title']),
+        ]
+    
+    def __str__(self):
+        return self.title
+    
+    @classmethod
+    def intern(cls, user, titles):
+        """
+        Return a {title: id} mapping for ``titles``, creating missing rows.
+        """
+        titles = set(titles)
+        found = dict(cls.objects.filter(user=user, title__in=titles).values_list('title', 'id'))
+        missing = titles - found.keys()
+        if missing:
+            cls.objects.bulk_create([cls(user=user, title=t) for t in missing], ignore_conflicts=True)
+            found.update(cls.objects.filter(user=user, title__in=missing).values_list('title', 'id'))
+        return found
+
+
 class Task(models.Model):
     """
     Task model - represents a todo item for a specific date.
+    
+    Tasks created from a default task store no text of their own: they
+    reference an interned TaskTitle until the title is edited. Read and
+    assign ``title`` either way.
     """
     TAB_CHOICES = [
         ('personal', 'Personal'),
@@ -53,7 +107,14 @@ class Task(models.Model):
     ]
     
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='tasks')
-    title = models.CharField(max_length=500)
+    custom_title = models.CharField(
+        max_length=500, blank=True, db_column='title',
+        help_text='Title of this task; empty when it uses the interned title'
+    )
+    title_ref = models.ForeignKey(
+        TaskTitle, on_delete=models.PROTECT, null=True, blank=True, related_name='+',
+        help_text='Interned title of an unmodified default-task copy'
+    )
     completed = models.BooleanField(default=False)
     date = models.DateField(help_text='The date this task is scheduled for')
     tab = models.CharField(max_length=20, choices=TAB_CHOICES, default='personal')
@@ -61,15 +122,34 @@ class Task(models.Model):
     last_modified = models.DateTimeField(auto_now=True)
     
     class Meta:
-        ordering = ['-created_at']
         indexes = [
-            models.Index(fields=['user', 'date', 'tab']),
-            models.Index(fields=['user', 'date']),
+            # Default list order of the API
+            models.Index(fields=['user', '-created_at'], name='task_user_created_idx'),
+            # Date/tab lists, heatmap counts (covering) and the defaults
+            # existence check
+            models.Index(fields=['user', 'date', 'tab', 'completed'], name='task_user_date_tab_idx'),
+            # Open tasks only; stays small as history gets completed
+            models.Index(fields=['user', 'date'], condition=models.Q(completed=False), name='task_incomplete_idx'),
+            models.Index(fields=['custom_title']),
         ]
     
     def __str__(self):
         return f"{self.title} ({self.date})"
     
+    @property
+    def title(self):
+        if self.custom_title or self.title_ref_id is None:
+            return self.custom_title
+        return self.title_ref.title
+    
+    @title.setter
+    def title(self, value):
+        # Editing the title detaches the task from the interned copy
+        if self.title_ref_id is not None and value == self.title:
+            return
+        self.custom_title = value
+        self.title_ref = None
+    
     @classmethod
     def cleanup_old_tasks(cls, user, days=365):
         """
@@ -81,12 +161,254 @@ class Task(models.Model):
             user=user,
             date__lt=cutoff_date
         ).delete()
+        if deleted_count:
+            CompletionHistory.trim(user.pk, cutoff_date)
         return deleted_count
 
 
+def _bits(value):
+    return int.from_bytes(value or b'', 'little')
+
+
+def _day_bit(day):
+    return 1 << (day.timetuple().tm_yday - 1)
+
+
+class CompletionHistory(models.Model):
+    """
+    Per-day completion bitsets of one user's tab for one year.
+    
+    Bit n of each set is day n + 1 of the year. ``active`` marks days with
+    at least one task, ``done`` days whose tasks are all completed. The
+    task write paths keep the sets up to date, so streaks and year grids
+    are a few integer operations on a handful of rows instead of a scan
+    of Task. ``rebuild_completion_history`` regenerates them from Task.
+    """
+    YEAR_BYTES = 46  # 366 bits
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='completion_history')
+    tab = models.CharField(max_length=20, choices=Task.TAB_CHOICES)
+    year = models.PositiveSmallIntegerField()
+    active = models.BinaryField(max_length=YEAR_BYTES, default=bytes, help_text='Days with tasks')
+    done = models.BinaryField(max_length=YEAR_BYTES, default=bytes, help_text='Days with all tasks completed')
+    
+    class Meta:
+        unique_together = ['user', 'tab', 'year']
+        verbose_name_plural = 'completion history'
+    
+    def __str__(self):
+        return f"{self.user_id} {self.tab} {self.year}"
+    
+    @classmethod
+    def _store(cls, user_id, tab, changes, using=None):
+        """
+        Apply ``changes``, a {year: (clear, active, done)} mapping of bit
+        masks: the ``clear`` bits are cleared from both sets before the
+        ``active`` and ``done`` bits are set. Only rows that change are
+        written.
+        """
+        if not changes:
+            return
+        rows = cls.objects.using(using)
+        with transaction.atomic(using=rows.db, savepoint=False):
+            found = {
+                row.year: row
+                for row in rows.select_for_update().filter(user_id=user_id, tab=tab, year__in=changes)
+            }
+            new_rows, changed = [], []
+            for year, (clear, active, done) in changes.items():
+                row = found.get(year)
+                if row is None:
+                    row = cls(user_id=user_id, tab=tab, year=year)
+                    new_rows.append(row)
+                old = (bytes(row.active), bytes(row.done))
+                row.active = ((_bits(row.active) & ~clear) | active).to_bytes(cls.YEAR_BYTES, 'little')
+                row.done = ((_bits(row.done) & ~clear) | done).to_bytes(cls.YEAR_BYTES, 'little')
+                if row.pk is not None and (row.active, row.done) != old:
+                    changed.append(row)
+            rows.bulk_create(new_rows)
+            rows.bulk_update(changed, ['active', 'done'])
+    
+    @classmethod
+    def refresh_days(cls, user_id, tab, dates, using=None):
+        """Recompute the bits of ``dates`` from the user's tasks on those days."""
+        dates = set(dates)
+        if not dates:
+            return
+        days = (
+            Task.objects.using(using).filter(user_id=user_id, tab=tab, date__in=dates)
+            .order_by().values('date').annotate(
+                total=models.Count('id'),
+                done=models.Count('id', filter=models.Q(completed=True)),
+            ).values_list('date', 'total', 'done')
+        )
+        changes = {}
+        for day in dates:
+            changes.setdefault(day.year, [0, 0, 0])[0] |= _day_bit(day)
+        for day, total, done in days:
+            bit = _day_bit(day)
+            changes[day.year][1] |= bit
+            if done == total:
+                changes[day.year][2] |= bit
+        cls._store(user_id, tab, changes, using)
+    
+    @classmethod
+    def refresh_tasks(cls, tasks, using=None):
+        """Recompute the days of ``tasks``, (user_id, tab, date) tuples."""
+        by_tab = {}
+        for user_id, tab, day in tasks:
+            by_tab.setdefault((user_id, tab), set()).add(day)
+        for (user_id, tab), dates in by_tab.items():
+            cls.refresh_days(user_id, tab, dates, using)
+    
+    @classmethod
+    def mark_open(cls, user_id, tab, dates, using=None):
+        """Record that open tasks were added on ``dates``, without querying Task."""
+        changes = {}
+        for day in dates:
+            bit = _day_bit(day)
+            year = changes.setdefault(day.year, [0, 0, 0])
+            year[0] |= bit  # no longer all done
+            year[1] |= bit
+        cls._store(user_id, tab, changes, using)
+    
+    @classmethod
+    def trim(cls, user_id, before, using=None):
+        """Clear every day before ``before``, after older tasks were deleted."""
+        rows = cls.objects.using(using).filter(user_id=user_id)
+        rows.filter(year__lt=before.year).delete()
+        keep = ~(_day_bit(before) - 1)
+        changed = list(rows.filter(year=before.year))
+        for row in changed:
+            row.active = (_bits(row.active) & keep).to_bytes(cls.YEAR_BYTES, 'little')
+            row.done = (_bits(row.done) & keep).to_bytes(cls.YEAR_BYTES, 'little')
+        rows.bulk_update(changed, ['active', 'done'])
+    
+    @classmethod
+    def rebuild(cls, user_ids=None, using=None, tasks=None):
+        """
+        Regenerate the history of ``user_ids`` (default: everyone) from
+        Task, or from ``tasks`` when the caller holds all of those users'
+        tasks already (sync). Returns the number of history rows written.
+        """
+        history = cls.objects.using(using)
+        if user_ids is not None:
+            history = history.filter(user_id__in=user_ids)
+        if tasks is None:
+            rows = Task.objects.using(using).order_by()
+            if user_ids is not None:
+                rows = rows.filter(user_id__in=user_ids)
+            days = rows.values('user_id', 'tab', 'date').annotate(
+                total=models.Count('id'),
+                done=models.Count('id', filter=models.Q(completed=True)),
+            ).values_list('user_id', 'tab', 'date', 'total', 'done').iterator()
+        else:
+            counts = {}
+            for task in tasks:
+                day = counts.setdefault((task.user_id, task.tab, task.date), [0, 0])
+                day[0] += 1
+                day[1] += task.completed
+            days = (key + tuple(day) for key, day in counts.items())
+        bits = {}
+        for user_id, tab, day, total, done in days:
+            row = bits.setdefault((user_id, tab, day.year), [0, 0])
+            bit = _day_bit(day)
+            row[0] |= bit
+            if done == total:
+                row[1] |= bit
+        with transaction.atomic(using=history.db, savepoint=False):
+            history.delete()
+            cls.objects.using(using).bulk_create([
+                cls(
+                    user_id=user_id, tab=tab, year=year,
+                    active=active.to_bytes(cls.YEAR_BYTES, 'little'),
+                    done=done.to_bytes(cls.YEAR_BYTES, 'little'),
+                )
+                for (user_id, tab, year), (active, done) in bits.items()
+            ], batch_size=500)
+        return len(bits)
+    
+    @classmethod
+    def timeline(cls, user, tab=None):
+        """
+        Return ``(first_day, active, done)``: the history as two integers
+        whose bit n is ``first_day + n`` days. Without a tab, a day is done
+        when every tab with tasks that day is done.
+        """
+        rows = cls.objects.filter(user=user)
+        if tab:
+            rows = rows.filter(tab=tab)
+        rows = list(rows.values_list('year', 'active', 'done'))
+        if not rows:
+            return None, 0, 0
+        first_day = date(min(year for year, _, _ in rows), 1, 1)
+        active = done = undone = 0
+        for year, year_active, year_done in rows:
+            shift = date(year, 1, 1).toordinal() - first_day.toordinal()
+            year_active, year_done = _bits(year_active), _bits(year_done)
+            active |= year_active << shift
+            done |= year_done << shift
+            undone |= (year_active & ~year_done) << shift
+        return first_day, active, done & ~undone
+    
+    @classmethod
+    def streaks(cls, user, today, tab=None):
+        """
+        Current and longest runs of consecutive days that had tasks, all
+        completed. The current streak ends ``today``, or yesterday while
+        today is still open.
+        """
+        first_day, _, done = cls.timeline(user, tab)
+        result = {'current': 0, 'longest': 0, 'longest_start': None, 'longest_end': None}
+        if first_day is None:
+            return result
+        
+        end = today.toordinal() - first_day.toordinal()
+        if end >= 0 and not done >> end & 1:
+            end -= 1
+        if end >= 0:
+            # Distance from end back to the closest day that is not done
+            gaps = ~done & ((1 << end + 1) - 1)
+            result['current'] = end + 1 - gaps.bit_length()
+        
+        # runs keeps the days that start `length` done days in a row
+        runs, length = done, 0
+        while runs & (runs >> 1):
+            runs &= runs >> 1
+            length += 1
+        if runs:
+            start = runs.bit_length() - 1  # the latest of the longest runs
+            result['longest'] = length + 1
+            result['longest_start'] = first_day + timedelta(days=start)
+            result['longest_end'] = first_day + timedelta(days=start + length)
+        return result
+    
+    @classmethod
+    def calendar(cls, user, year, tab=None):
+        """
+        One character per day of ``year``: 0 no tasks, 1 open tasks,
+        2 all tasks completed.
+        """
+        first_day, active, done = cls.timeline(user, tab)
+        days = (date(year + 1, 1, 1) - date(year, 1, 1)).days
+        if first_day is None or year < first_day.year:
+            return '0' * days
+        shift = date(year, 1, 1).toordinal() - first_day.toordinal()
+        active, done = active >> shift, done >> shift
+        return ''.join(
+            '2' if done >> n & 1 else '1' if active >> n & 1 else '0'
+            for n in range(days)
+        )
+
+
 class DefaultTask(models.Model):
     """
     Default task template that gets created automatically for specific weekdays.
+    
+    By default a template repeats every week on ``weekday``. The recurrence
+    fields describe other rules (daily, every n weeks, several weekdays,
+    monthly by day or nth weekday, until a date or for a number of
+    occurrences); see tasks.recurrence.
     """
     WEEKDAY_CHOICES = [
         (0, 'Sunday'),
@@ -103,58 +425,105 @@ class DefaultTask(models.Model):
         ('work', 'Work'),
     ]
     
+    FREQUENCY_CHOICES = [
+        (recurrence.DAILY, 'Daily'),
+        (recurrence.WEEKLY, 'Weekly'),
+        (recurrence.MONTHLY, 'Monthly'),
+    ]
+    
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='default_tasks')
     weekday = models.IntegerField(choices=WEEKDAY_CHOICES)
     title = models.CharField(max_length=500)
     tab = models.CharField(max_length=20, choices=TAB_CHOICES, default='personal')
     created_at = models.DateTimeField(auto_now_add=True)
     
+    # Recurrence rule; the defaults repeat weekly on `weekday`
+    frequency = models.CharField(max_length=10, choices=FREQUENCY_CHOICES, default=recurrence.WEEKLY)
+    interval = models.PositiveSmallIntegerField(default=1, help_text='Repeat every n days, weeks or months')
+    weekdays = models.PositiveSmallIntegerField(
+        default=0, help_text='Bit set of weekdays (bit 0 = Sunday); empty: weekday only, or every day'
+    )
+    month_day = models.SmallIntegerField(null=True, blank=True, help_text='Monthly: day of the month, -1 for the last')
+    nth_weekday = models.SmallIntegerField(
+        null=True, blank=True, help_text='Monthly: nth of each weekday in the month (1-5, -1 for the last)'
+    )
+    start_date = models.DateField(null=True, blank=True, help_text='First day of the rule; anchors the interval')
+    until = models.DateField(null=True, blank=True, help_text='Last day of the rule')
+    count = models.PositiveIntegerField(null=True, blank=True, help_text='Number of occurrences')
+    last_date = models.DateField(null=True, blank=True, editable=False, help_text='Last occurrence when count is set')
+    
     class Meta:
-        unique_together = ['user', 'weekday', 'title', 'tab']
-        ordering = ['weekday', 'title']
+        # Column order matches the (user, tab, weekday) template lookups
+        unique_together = ['user', 'tab', 'weekday', 'title']
     
     def __str__(self):
         return f"{self.get_weekday_display()}: {self.title} ({self.tab})"
     
+    def clean(self):
+        error = recurrence.rule_error({name: getattr(self, name) for name in recurrence.RULE_FIELDS})
+        if error:
+            raise ValidationError(error)
+    
+    def save(self, *args, **kwargs):
+        self.last_date = recurrence.last_date(self)
+        super().save(*args, **kwargs)
+    
     @classmethod
     def apply_defaults_for_date(cls, user, target_date, tab='personal'):
         """
         Create default tasks for a specific date if they don't already exist.
         Returns the number of tasks created.
         """
-        weekday = target_date.weekday()
-        # Convert Python weekday (0=Monday) to our format (0=Sunday)
-        # Python: Mon=0, Tue=1, ..., Sun=6
-        # Ours: Sun=0, Mon=1, ..., Sat=6
-        weekday_adjusted = (weekday + 1) % 7
+        return cls.apply_defaults_for_dates(user, [target_date], tab)
+    
+    @classmethod
+    def apply_defaults_for_dates(cls, user, dates, tab='personal'):
+        """
+        Create default tasks for several dates at once.
+        Uses a fixed number of queries regardless of how many dates or
+        templates are involved. Returns the number of tasks created.
+        """
+        from . import template_cache
         
-        defaults = cls.objects.filter(
-            user=user,
-            weekday=weekday_adjusted,
-            tab=tab
+        dates = sorted(set(dates))
+        if not dates:
+            return 0
+        
+        # Cached templates come with the ids of their interned titles, if interned yet
+        templates = template_cache.templates(user, tab)
+        # {date: [template, ...]} in one pass over templates and dates
+        occurring = recurrence.expand(templates, dates)
+        if not occurring:
+            return 0
+        
+        title_ids = {t.title: t.title_id for t in templates if t.title_id is not None}
+        missing = {t.title for matches in occurring.values() for t in matches} - title_ids.keys()
+        if missing:
+            title_ids.update(TaskTitle.intern(user, missing))
+            template_cache.interned(user, title_ids)
+        titles_by_id = {pk: title for title, pk in title_ids.items()}
+        existing = set(
+            (day, titles_by_id.get(ref) if ref is not None else title)
+            for day, title, ref in Task.objects.filter(user=user, tab=tab, date__in=list(occurring))
+            .values_list('date', 'custom_title', 'title_ref_id')
         )
         
-        created_count = 0
-        for default in defaults:
-            # Check if task already exists
-            exists = Task.objects.filter(
-                user=user,
-                date=target_date,
-                title=default.title,
-                tab=default.tab
-            ).exists()
-            
-            if not exists:
-                Task.objects.create(
-                    user=user,
-                    title=default.title,
-                    date=target_date,
-                    tab=default.tab,
-                    completed=False
-                )
-                created_count += 1
+        new_tasks = []
+        for target_date, matches in occurring.items():
+            for template in matches:
+                if (target_date, template.title) not in existing:
+                    existing.add((target_date, template.title))
+                    new_tasks.append(Task(
+                        user=user,
+                        title_ref_id=title_ids[template.title],
+                        date=target_date,
+                        tab=tab,
+                        completed=False
+                    ))
         
-        return created_count
+        Task.objects.bulk_create(new_tasks)
+        CompletionHistory.mark_open(user.pk, tab, {task.date for task in new_tasks})
+        return len(new_tasks)
 
 
 class WeeklyTask(models.Model):
@@ -175,9 +544,9 @@ class WeeklyTask(models.Model):
     last_modified = models.DateTimeField(auto_now=True)
     
     class Meta:
-        ordering = ['-week_start_date', '-created_at']
         indexes = [
             models.Index(fields=['user', 'week_start_date', 'tab']),
+            models.Index(fields=['title']),
         ]
         unique_together = ['user', 'title', 'week_start_date', 'tab']
     
@@ -216,9 +585,9 @@ class MonthlyTask(models.Model):
     last_modified = models.DateTimeField(auto_now=True)
     
     class Meta:
-        ordering = ['-year', '-month', '-created_at']
         indexes = [
             models.Index(fields=['user', 'year', 'month', 'tab']),
+            models.Index(fields=['title']),
         ]
         unique_together = ['user', 'title', 'month', 'year', 'tab']
     
@@ -247,11 +616,98 @@ class YearlyTask(models.Model):
     last_modified = models.DateTimeField(auto_now=True)
     
     class Meta:
-        ordering = ['-year', '-created_at']
         indexes = [
             models.Index(fields=['user', 'year']),
+            models.Index(fields=['title']),
         ]
         unique_together = ['user', 'title', 'year']
     
     def __str__(self):
         return f"{self.title} ({self.year})"
+
+
+class RequestProfile(models.Model):
+    """
+    cProfile output captured for a single API request.
+    Created by the profiling middleware, downloadable from the admin.
+    """
+    TRIGGER_CHOICES = [
+        ('manual', 'Manual'),
+        ('sampled', 'Sampled'),
+    ]
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    status_code = models.IntegerField()
+    duration_ms = models.FloatField()
+    trigger = models.CharField(max_length=10, choices=TRIGGER_CHOICES)
+    stats = models.BinaryField(help_text='Marshalled pstats data')
+    summary = models.TextField(blank=True, help_text='Top functions by cumulative time')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f}ms)"
+
+
+
+class Job(models.Model):
+    """
+    Background job handed off by the API (see tasks.jobs).
+    Queued rows are claimed and run by ``manage.py run_workers``.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    
+    KIND_CHOICES = [
+        ('sync', 'Sync tasks'),
+        ('apply', 'Apply defaults'),
+        ('cleanup', 'Clean up old tasks'),
+    ]
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    payload = models.JSONField(default=dict)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    progress_done = models.PositiveIntegerField(default=0)
+    progress_total = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(help_text='Not claimed before this time (retry backoff)')
+    locked_by = models.CharField(max_length=100, blank=True, help_text='Worker running the job')
+    locked_at = models.DateTimeField(null=True, blank=True, help_text='Claim or last progress of the worker')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            # Workers look for the oldest runnable job
+            models.Index(fields=['status', 'run_after']),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+
+class RevokedToken(models.Model):
+    """
+    An access token revoked before its expiry, by ``jti``. Read by
+    tasks.authentication when revocations are kept in the database.
+    """
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField()
+    revoked_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    def __str__(self):
+        return self.jti
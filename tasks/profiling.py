@@ -0,0 +1,110 @@
+"""
+Opt-in request profiling.
+
+ProfilingMiddleware runs a request under cProfile when either
+- a staff user asks for it with ``?__profile=1`` or an ``X-Profile: 1``
+  header (session or JWT authenticated), or
+- the request is picked for background sampling (``PROFILE_SAMPLE_RATE``).
+
+Profiles are stored as RequestProfile rows; the admin offers the raw
+pstats file for download (snakeviz, flameprof and gprof2dot read it).
+The middleware is only installed when ``PROFILING_ENABLED=True``; with
+sampling at 0 its cost on unprofiled requests is a couple of lookups.
+"""
+import cProfile
+import io
+import logging
+import marshal
+import pstats
+import random
+import time
+
+from django.conf import settings
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import RevocationCheckingJWTAuthentication
+from .models import RequestProfile
+
+logger = logging.getLogger('tasks.profiling')
+
+SUMMARY_LINES = 40
+
+
+def _request_user(request):
+    """Return the session user, or the JWT user if a Bearer token is sent."""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user
+    try:
+        result = RevocationCheckingJWTAuthentication().authenticate(request)
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return None
+    return result[0] if result else None
+
+
+def profile_requested(request):
+    return request.GET.get('__profile') == '1' or request.headers.get('X-Profile') == '1'
+
+
+def summarize(profiler):
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(SUMMARY_LINES)
+    return stream.getvalue()
+
+
+class ProfilingMiddleware:
+    """Profile requests on demand (staff only) or by sampling."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        trigger = None
+        user = None
+        if profile_requested(request):
+            user = _request_user(request)
+            if user is not None and user.is_staff:
+                trigger = 'manual'
+        elif settings.PROFILE_SAMPLE_RATE and random.random() < settings.PROFILE_SAMPLE_RATE:
+            trigger = 'sampled'
+
+        if trigger is None:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        response = profiler.runcall(self.get_response, request)
+        duration = time.perf_counter() - started
+        profiler.create_stats()
+        if user is None:
+            # Set by AuthenticationMiddleware, or by DRF once it has
+            # authenticated a JWT request
+            user = getattr(request, 'user', None)
+
+        try:
+            profile = RequestProfile.objects.create(
+                user=user if user is not None and user.is_authenticated else None,
+                method=request.method,
+                path=request.get_full_path()[:500],
+                status_code=response.status_code,
+                duration_ms=duration * 1000,
+                trigger=trigger,
+                stats=marshal.dumps(profiler.stats),
+                summary=summarize(profiler),
+            )
+            self.prune()
+        except Exception:
+            logger.exception('failed to store request profile')
+            return response
+
+        if trigger == 'manual':
+            response['X-Profile-Id'] = str(profile.pk)
+        return response
+
+    def prune(self):
+        """Keep only the newest PROFILE_MAX_STORED profiles."""
+        keep = settings.PROFILE_MAX_STORED
+        cutoff = RequestProfile.objects.order_by('-id').values_list('id', flat=True)[keep:keep + 1]
+        if cutoff:
+            RequestProfile.objects.filter(id__lte=cutoff[0]).delete()
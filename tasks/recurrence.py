@@ -0,0 +1,194 @@
+"""
+Recurrence rules of default tasks.
+
+A DefaultTask repeats by a subset of an iCalendar RRULE:
+
+- FREQ and INTERVAL: ``frequency`` (daily, weekly or monthly) every
+  ``interval`` days, weeks or months, counted from ``start_date``. Weeks
+  start on Sunday, like the weekday numbers;
+- BYDAY: ``weekdays``, a bit set of weekdays (bit 0 is Sunday). A weekly
+  rule without one repeats on ``weekday``, as plain templates always did;
+- BYMONTHDAY: ``month_day`` of a monthly rule (1-31, -1 for the last day);
+- BYDAY with an ordinal: ``nth_weekday`` of a monthly rule (1-5, -1 for
+  the last), the nth of each of the rule's weekdays in the month;
+- UNTIL or COUNT: ``until`` or ``count``. ``last_date`` stores the date of
+  the last occurrence of a counted rule.
+
+``expand`` matches templates against any set of dates in one pass. Each
+template is indexed under the slots it occurs in: the phase within its
+interval plus its weekday, day of month or nth weekday. Each date then
+looks up the few slots it belongs to. The work grows with templates +
+dates + occurrences, not templates x dates.
+"""
+import calendar
+from datetime import date, timedelta
+
+DAILY, WEEKLY, MONTHLY = 'daily', 'weekly', 'monthly'
+
+# Periods in a row without an occurrence before a rule is taken to never
+# occur (say monthly on the 30th, every 12 months from February)
+MAX_MISSES = 400
+MAX_COUNT = 1000
+
+RULE_FIELDS = (
+    'frequency', 'interval', 'weekday', 'weekdays', 'month_day', 'nth_weekday',
+    'start_date', 'until', 'count',
+)
+
+
+def weekday_of(day):
+    """Weekday number of ``day`` in the templates' convention (0 = Sunday)."""
+    return (day.weekday() + 1) % 7
+
+
+def weekday_set(weekdays):
+    return [n for n in range(7) if weekdays >> n & 1]
+
+
+def _period(frequency, day):
+    """Index of the day, week or month containing ``day``."""
+    if frequency == DAILY:
+        return day.toordinal()
+    if frequency == WEEKLY:
+        return day.toordinal() // 7  # date.fromordinal(7) is a Sunday
+    return day.year * 12 + day.month - 1
+
+
+def _period_days(frequency, period):
+    if frequency == DAILY:
+        return [date.fromordinal(period)]
+    if frequency == WEEKLY:
+        first = date.fromordinal(period * 7)
+        return [first + timedelta(days=n) for n in range(7)]
+    year, month = divmod(period, 12)
+    return [date(year, month + 1, day) for day in range(1, calendar.monthrange(year, month + 1)[1] + 1)]
+
+
+def _days(template):
+    return template.weekdays or 1 << template.weekday
+
+
+def _phase(template):
+    if template.interval == 1 or template.start_date is None:
+        return 0
+    return _period(template.frequency, template.start_date) % template.interval
+
+
+def _template_slots(template):
+    """Slot keys ``template`` occurs in (see _date_slots)."""
+    shape = (template.frequency, template.interval, _phase(template))
+    if template.frequency == DAILY:
+        if not template.weekdays:
+            return [shape + (None,)]
+        return [shape + (weekday,) for weekday in weekday_set(template.weekdays)]
+    if template.frequency == WEEKLY:
+        return [shape + (weekday,) for weekday in weekday_set(_days(template))]
+    if template.month_day is not None:
+        return [shape + (('day', template.month_day),)]
+    return [shape + (('nth', weekday, template.nth_weekday),) for weekday in weekday_set(_days(template))]
+
+
+def _date_slots(day, shapes):
+    """Slot keys ``day`` belongs to, for each (frequency, interval) in ``shapes``."""
+    weekday = weekday_of(day)
+    for frequency, interval in shapes:
+        shape = (frequency, interval, _period(frequency, day) % interval)
+        if frequency == DAILY:
+            yield shape + (None,)
+            yield shape + (weekday,)
+        elif frequency == WEEKLY:
+            yield shape + (weekday,)
+        else:
+            month_days = calendar.monthrange(day.year, day.month)[1]
+            yield shape + (('day', day.day),)
+            yield shape + (('nth', weekday, (day.day - 1) // 7 + 1),)
+            if day.day == month_days:
+                yield shape + (('day', -1),)
+            if day.day + 7 > month_days:
+                yield shape + (('nth', weekday, -1),)
+
+
+def _in_range(template, day):
+    return (
+        (template.start_date is None or day >= template.start_date)
+        and (template.until is None or day <= template.until)
+        and (template.last_date is None or day <= template.last_date)
+    )
+
+
+def expand(templates, dates):
+    """Return ``{date: [template, ...]}`` for the templates occurring on each of ``dates``."""
+    index = {}
+    shapes = set()
+    for template in templates:
+        shapes.add((template.frequency, template.interval))
+        for slot in _template_slots(template):
+            index.setdefault(slot, []).append(template)
+    found = {}
+    for day in dates:
+        matches = [
+            template
+            for slot in _date_slots(day, shapes)
+            for template in index.get(slot, ())
+            if _in_range(template, day)
+        ]
+        if matches:
+            found[day] = matches
+    return found
+
+
+def occurrences(template):
+    """Yield the dates of ``template`` in order; endless without an end date or count."""
+    frequency, interval = template.frequency, template.interval
+    period = _period(frequency, template.start_date)
+    produced = misses = 0
+    while misses < MAX_MISSES and period <= _period(frequency, date.max) - interval:
+        days = _period_days(frequency, period)
+        found = sorted(expand([template], days))
+        misses = 0 if found else misses + 1
+        for day in found:
+            if template.count is not None and produced == template.count:
+                return
+            produced += 1
+            yield day
+        if template.until is not None and days[-1] >= template.until:
+            return
+        period += interval
+
+
+def last_date(template):
+    """Date of the last occurrence of a counted rule, else None."""
+    if template.count is None or template.start_date is None:
+        return None
+    last = None
+    # last_date must not limit the walk that computes it
+    template.last_date = None
+    for last in occurrences(template):
+        pass
+    return last
+
+
+def rule_error(rule):
+    """Return why the ``rule`` mapping of RULE_FIELDS is invalid, or None."""
+    frequency = rule.get('frequency', WEEKLY)
+    month_day, nth_weekday = rule.get('month_day'), rule.get('nth_weekday')
+    if rule.get('interval', 1) < 1:
+        return 'interval must be at least 1'
+    if rule.get('weekdays', 0) >= 1 << 7:
+        return 'weekdays must be between 0 (Sunday) and 6 (Saturday)'
+    if frequency == MONTHLY:
+        if (month_day is None) == (nth_weekday is None):
+            return 'monthly rules need month_day or nth_weekday'
+        if month_day is not None and not (1 <= month_day <= 31 or month_day == -1):
+            return 'month_day must be 1-31, or -1 for the last day'
+        if nth_weekday is not None and not (1 <= nth_weekday <= 5 or nth_weekday == -1):
+            return 'nth_weekday must be 1-5, or -1 for the last'
+    elif month_day is not None or nth_weekday is not None:
+        return 'month_day and nth_weekday need a monthly rule'
+    if rule.get('count') is not None and not 1 <= rule['count'] <= MAX_COUNT:
+        return f'count must be 1-{MAX_COUNT}'
+    if rule.get('until') is not None and rule.get('count') is not None:
+        return 'use until or count, not both'
+    if rule.get('start_date') is None and (rule.get('interval', 1) > 1 or rule.get('count') is not None):
+        return 'start_date is required with an interval or count'
+    return None
@@ -0,0 +1,268 @@
+"""
+Full-text search over task titles.
+
+SQLite: an FTS5 table ``tasks_search`` holds one row per Task, WeeklyTask,
+MonthlyTask and YearlyTask. Triggers on the four tables keep it in sync,
+so bulk inserts, queryset updates and deletes are covered too. The FTS
+rowid encodes the source row (``id * 4 + kind``) so trigger updates and
+deletes are rowid lookups, and the owner is an indexed ``u<id>`` token so
+a user's matches are found by intersecting posting lists rather than
+filtering everyone's hits.
+
+Tasks that use an interned title (``Task.title_ref``) are indexed under
+the interned text.
+
+PostgreSQL: GIN indexes on ``to_tsvector('simple', title)`` for each table
+and for the interned titles.
+
+Other backends (or SQLite builds without FTS5) fall back to ``icontains``.
+So does SQLite when any of the triggers is missing (a table rebuilt by a
+migration loses its triggers) until ``rebuild_search_index`` is run.
+
+Migrations pass their ``apps`` to ``install``, ``uninstall`` and
+``rebuild``, so the triggers match the schema of that migration rather
+than today's models.
+"""
+import re
+
+from django.db import connections, OperationalError
+from django.db.models import Q
+
+from .models import Task, TaskTitle, WeeklyTask, MonthlyTask, YearlyTask
+
+FTS_TABLE = 'tasks_search'
+
+# kind -> (code, model); the code is packed into the FTS rowid
+KINDS = {
+    'task': (0, Task),
+    'weekly': (1, WeeklyTask),
+    'monthly': (2, MonthlyTask),
+    'yearly': (3, YearlyTask),
+}
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def _interned(model):
+    return any(f.name == 'title_ref' for f in model._meta.get_fields())
+
+
+def _models(apps=None):
+    """``(kind, code, model)`` for KINDS, from migration state when ``apps`` is given."""
+    if apps is None:
+        return [(kind, code, model) for kind, (code, model) in KINDS.items()]
+    return [(kind, code, apps.get_model('tasks', model._meta.object_name)) for kind, (code, model) in KINDS.items()]
+
+
+def _title_table(model):
+    return model._meta.get_field('title_ref').related_model._meta.db_table
+
+
+def _trigger_names(apps=None):
+    return [
+        f'{model._meta.db_table}_search_{suffix}'
+        for kind, code, model in _models(apps) for suffix in ('ai', 'au', 'ad')
+    ]
+
+
+def _title_sql(model, row):
+    """SQL for the displayed title of ``row`` (a table name or NEW)."""
+    if not _interned(model):
+        return f'{row}.title'
+    return (
+        f"COALESCE(NULLIF({row}.title, ''), "
+        f"(SELECT title FROM {_title_table(model)} WHERE id = {row}.title_ref_id), '')"
+    )
+
+
+def _sqlite_triggers(kind, code, model):
+    table = model._meta.db_table
+    rowid = f'NEW.id * 4 + {code}'
+    title = _title_sql(model, 'NEW')
+    columns = 'title, title_ref_id, user_id' if _interned(model) else 'title, user_id'
+    return [
+        f"""CREATE TRIGGER {table}_search_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, title, owner) VALUES ({rowid}, {title}, 'u' || NEW.user_id);
+        END""",
+        f"""CREATE TRIGGER {table}_search_au AFTER UPDATE OF {columns} ON {table} BEGIN
+            DELETE FROM {FTS_TABLE} WHERE rowid = OLD.id * 4 + {code};
+            INSERT INTO {FTS_TABLE}(rowid, title, owner) VALUES ({rowid}, {title}, 'u' || NEW.user_id);
+        END""",
+        f"""CREATE TRIGGER {table}_search_ad AFTER DELETE ON {table} BEGIN
+            DELETE FROM {FTS_TABLE} WHERE rowid = OLD.id * 4 + {code};
+        END""",
+    ]
+
+
+def install(connection, apps=None):
+    """Create the search index and its triggers on ``connection``."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            try:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                    f"USING fts5(title, owner, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+                )
+            except OperationalError:
+                return  # No FTS5 in this SQLite build; search uses the fallback
+            for kind, code, model in _models(apps):
+                for sql in _sqlite_triggers(kind, code, model):
+                    cursor.execute(sql)
+        elif connection.vendor == 'postgresql':
+            tables = [model._meta.db_table for kind, code, model in _models(apps)]
+            tables += sorted({_title_table(model) for kind, code, model in _models(apps) if _interned(model)})
+            for table in tables:
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {table}_title_fts ON {table} "
+                    f"USING GIN (to_tsvector('simple', title))"
+                )
+
+
+def uninstall(connection, apps=None):
+    """Drop the search index and triggers from ``connection``."""
+    with connection.cursor() as cursor:
+        for kind, code, model in _models(apps):
+            table = model._meta.db_table
+            if connection.vendor == 'sqlite':
+                for suffix in ('ai', 'au', 'ad'):
+                    cursor.execute(f'DROP TRIGGER IF EXISTS {table}_search_{suffix}')
+            elif connection.vendor == 'postgresql':
+                cursor.execute(f'DROP INDEX IF EXISTS {table}_title_fts')
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'DROP INDEX IF EXISTS {TaskTitle._meta.db_table}_title_fts')
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def has_fts(connection):
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor != 'sqlite':
+        return False
+    # The index is only complete while every sync trigger exists
+    names = [FTS_TABLE] + _trigger_names()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT COUNT(*) FROM sqlite_master WHERE name IN ({', '.join(['%s'] * len(names))})", names
+        )
+        return cursor.fetchone()[0] == len(names)
+
+
+def rebuild(connection, apps=None):
+    """Repopulate the SQLite index from the task tables. Returns rows indexed."""
+    if connection.vendor != 'sqlite':
+        return 0
+    if not has_fts(connection):
+        # Recreate all triggers, also when only some were lost
+        uninstall(connection, apps)
+        install(connection, apps)
+        if not has_fts(connection):
+            return 0  # No FTS5 in this SQLite build
+    total = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        for kind, code, model in _models(apps):
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}(rowid, title, owner) "
+                f"SELECT id * 4 + {code}, {_title_sql(model, model._meta.db_table)}, 'u' || user_id "
+                f"FROM {model._meta.db_table}"
+            )
+            total += cursor.rowcount
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+    return total
+
+
+def tokenize(query):
+    return _TOKEN.findall(query or '')[:10]
+
+
+def _sqlite_search(connection, user_id, terms, kinds, limit, offset):
+    match = f'owner:u{user_id} AND title:(' + ' '.join('"{}"*'.format(t.replace('"', '""')) for t in terms) + ')'
+    sql = f'SELECT rowid, bm25({FTS_TABLE}, 1.0, 0.0) AS rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+    params = [match]
+    codes = [KINDS[k][0] for k in kinds]
+    if len(codes) < len(KINDS):
+        sql += ' AND (rowid %% 4) IN (' + ', '.join(str(c) for c in codes) + ')'
+    sql += ' ORDER BY rank LIMIT %s OFFSET %s'
+    params += [limit, offset]
+    by_code = {code: kind for kind, (code, model) in KINDS.items()}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        # bm25 is lower-is-better; flip it so higher scores rank first
+        return [(by_code[rowid % 4], rowid // 4, -rank) for rowid, rank in cursor.fetchall()]
+
+
+def _postgres_search(connection, user_id, terms, kinds, limit, offset):
+    tsquery = ' & '.join(re.sub(r'[^\w]', '', t) + ':*' for t in terms)
+    parts = []
+    params = []
+    for kind in kinds:
+        model = KINDS[kind][1]
+        table = model._meta.db_table
+        parts.append(
+            f"SELECT %s AS kind, id, ts_rank(to_tsvector('simple', title), to_tsquery('simple', %s)) AS rank "
+            f"FROM {table} WHERE user_id = %s AND to_tsvector('simple', title) @@ to_tsquery('simple', %s)"
+        )
+        params += [kind, tsquery, user_id, tsquery]
+        if _interned(model):
+            # Rows with an interned title match through the (indexed) title table
+            titles = TaskTitle._meta.db_table
+            parts.append(
+                f"SELECT %s AS kind, t.id, ts_rank(to_tsvector('simple', i.title), to_tsquery('simple', %s)) AS rank "
+                f"FROM {table} t JOIN {titles} i ON i.id = t.title_ref_id "
+                f"WHERE i.user_id = %s AND t.title = '' AND to_tsvector('simple', i.title) @@ to_tsquery('simple', %s)"
+            )
+            params += [kind, tsquery, user_id, tsquery]
+    sql = ' UNION ALL '.join(parts) + ' ORDER BY rank DESC, id DESC LIMIT %s OFFSET %s'
+    params += [limit, offset]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _fallback_search(user, terms, kinds, limit, offset):
+    hits = []
+    for kind in kinds:
+        model = KINDS[kind][1]
+        queryset = model.objects.filter(user=user)
+        for term in terms:
+            if _interned(model):
+                queryset = queryset.filter(
+                    Q(custom_title__icontains=term) | Q(custom_title='', title_ref__title__icontains=term)
+                )
+            else:
+                queryset = queryset.filter(title__icontains=term)
+        hits += [(kind, pk, 0.0) for pk in queryset.order_by('-id').values_list('id', flat=True)[:offset + limit]]
+    return hits[offset:offset + limit]
+
+
+def search(user, query, kinds=None, limit=20, offset=0):
+    """
+    Return ranked ``(kind, object, score)`` hits for ``user``.
+    ``kinds`` restricts results to a subset of KINDS.
+    """
+    terms = tokenize(query)
+    kinds = [k for k in (kinds or KINDS) if k in KINDS]
+    if not terms or not kinds:
+        return []
+
+    connection = connections[Task.objects.db]
+    if connection.vendor == 'postgresql':
+        hits = _postgres_search(connection, user.pk, terms, kinds, limit, offset)
+    elif has_fts(connection):
+        hits = _sqlite_search(connection, user.pk, terms, kinds, limit, offset)
+    else:
+        hits = _fallback_search(user, terms, kinds, limit, offset)
+
+    ids_by_kind = {}
+    for kind, pk, score in hits:
+        ids_by_kind.setdefault(kind, []).append(pk)
+    objects = {}
+    for kind, ids in ids_by_kind.items():
+        model = KINDS[kind][1]
+        queryset = model.objects.filter(user=user, id__in=ids)
+        if _interned(model):
+            queryset = queryset.prefetch_related('title_ref')
+        for obj in queryset:
+            objects[(kind, obj.pk)] = obj
+    return [(kind, objects[(kind, pk)], score) for kind, pk, score in hits if (kind, pk) in objects]
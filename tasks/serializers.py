@@ -1,7 +1,9 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from .models import Task, DefaultTask, WeeklyTask, MonthlyTask, YearlyTask
-from . import models
+from .models import Job, Task, DefaultTask, WeeklyTask, MonthlyTask, YearlyTask
+from . import avatars, models, recurrence
+from .backends import create_user
+from .instrumentation import SerializerTimingMixin
 
 User = get_user_model()
 
@@ -28,7 +30,7 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         return value
     
     def create(self, validated_data):
-        user = User.objects.create_user(
+        user = create_user(
             username=validated_data['username'],
             password=validated_data['password'],
             email=validated_data['email'],
@@ -40,23 +42,30 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         return user
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SerializerTimingMixin, serializers.ModelSerializer):
     """
     Serializer for user information.
     """
     full_name = serializers.CharField(source='get_full_name', read_only=True)
+    avatar = serializers.SerializerMethodField()
     
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'full_name', 'phone', 'date_of_birth', 'bio', 'created_at']
+        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'full_name', 'phone', 'date_of_birth', 'bio', 'avatar', 'created_at']
         read_only_fields = ['id', 'created_at']
+    
+    def get_avatar(self, obj):
+        return avatars.urls(obj)
 
 
-class TaskSerializer(serializers.ModelSerializer):
+class TaskSerializer(SerializerTimingMixin, serializers.ModelSerializer):
     """
     Serializer for Task model.
     Automatically sets the user from the request context.
     """
+    # A model property, so interned titles read and write like plain ones
+    title = serializers.CharField(max_length=500)
+    
     class Meta:
         model = Task
         fields = ['id', 'title', 'completed', 'date', 'tab', 'created_at', 'last_modified']
@@ -67,19 +76,45 @@ class TaskSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class DefaultTaskSerializer(serializers.ModelSerializer):
+class WeekdaySetField(serializers.ListField):
+    """A weekday bit set as a list of weekday numbers (0 = Sunday)."""
+    
+    child = serializers.IntegerField(min_value=0, max_value=6)
+    
+    def to_representation(self, value):
+        return recurrence.weekday_set(value)
+    
+    def to_internal_value(self, data):
+        return sum(1 << weekday for weekday in set(super().to_internal_value(data)))
+
+
+class DefaultTaskSerializer(SerializerTimingMixin, serializers.ModelSerializer):
     """
     Serializer for DefaultTask model.
     """
     weekday_display = serializers.CharField(source='get_weekday_display', read_only=True)
+    weekdays = WeekdaySetField(required=False)
     
     class Meta:
         model = DefaultTask
-        fields = ['id', 'weekday', 'weekday_display', 'title', 'tab', 'created_at']
+        fields = [
+            'id', 'weekday', 'weekday_display', 'title', 'tab',
+            'frequency', 'interval', 'weekdays', 'month_day', 'nth_weekday', 'start_date', 'until', 'count',
+            'created_at',
+        ]
         read_only_fields = ['id', 'created_at']
+    
+    def validate(self, attrs):
+        # Partial updates are checked against the rule they produce
+        rule = {name: getattr(self.instance, name) for name in recurrence.RULE_FIELDS} if self.instance else {}
+        rule.update((name, value) for name, value in attrs.items() if name in recurrence.RULE_FIELDS)
+        error = recurrence.rule_error(rule)
+        if error:
+            raise serializers.ValidationError(error)
+        return attrs
 
 
-class WeeklyTaskSerializer(serializers.ModelSerializer):
+class WeeklyTaskSerializer(SerializerTimingMixin, serializers.ModelSerializer):
     """
     Serializer for WeeklyTask model.
     """
@@ -91,7 +126,7 @@ class WeeklyTaskSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'last_modified']
 
 
-class MonthlyTaskSerializer(serializers.ModelSerializer):
+class MonthlyTaskSerializer(SerializerTimingMixin, serializers.ModelSerializer):
     """
     Serializer for MonthlyTask model.
     """
@@ -103,7 +138,7 @@ class MonthlyTaskSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'last_modified']
 
 
-class YearlyTaskSerializer(serializers.ModelSerializer):
+class YearlyTaskSerializer(SerializerTimingMixin, serializers.ModelSerializer):
     """
     Serializer for YearlyTask model.
     """
@@ -113,3 +148,40 @@ class YearlyTaskSerializer(serializers.ModelSerializer):
         model = models.YearlyTask
         fields = ['id', 'title', 'completed', 'year', 'quarter', 'quarter_display', 'created_at', 'last_modified']
         read_only_fields = ['id', 'created_at', 'last_modified']
+
+
+class SearchResultSerializer(SerializerTimingMixin, serializers.Serializer):
+    """
+    Serializer for a (kind, object, score) search hit.
+    """
+    
+    def to_representation(self, hit):
+        kind, obj, score = hit
+        data = {
+            'kind': kind,
+            'id': obj.pk,
+            'title': obj.title,
+            'completed': obj.completed,
+            'score': round(score, 4),
+        }
+        if kind == 'task':
+            data.update(date=obj.date, tab=obj.tab)
+        elif kind == 'weekly':
+            data.update(week_start_date=obj.week_start_date, tab=obj.tab)
+        elif kind == 'monthly':
+            data.update(month=obj.month, year=obj.year, tab=obj.tab)
+        elif kind == 'yearly':
+            data.update(year=obj.year, quarter=obj.quarter)
+        return data
+
+
+class JobSerializer(serializers.ModelSerializer):
+    """Status of a background job; the payload is not echoed back."""
+    
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'status', 'progress_done', 'progress_total', 'attempts',
+            'result', 'error', 'created_at', 'finished_at',
+        ]
+        read_only_fields = fields
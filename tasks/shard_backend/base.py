@@ -0,0 +1,23 @@
+"""
+SQLite backend for task shards (``DB_SHARDS``).
+
+The same as Django's SQLite backend, except that foreign keys are never
+enforced: the users table that task rows reference lives on the primary
+database, not in the shard file. Turning the pragma off once per
+connection is not enough, since migrations switch it back on.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        conn.execute('PRAGMA foreign_keys = OFF')
+        return conn
+
+    def enable_constraint_checking(self):
+        pass
+
+    def check_constraints(self, table_names=None):
+        pass
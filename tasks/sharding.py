@@ -0,0 +1,255 @@
+"""
+Per-user sharding of task data across several SQLite databases.
+
+With ``DB_SHARDS`` set to N > 0, settings add N databases ``shard_0`` ...
+``shard_<N-1>`` (``data/shard_<n>.sqlite3``) next to ``default``. Users,
+auth, sessions and token tables stay on ``default`` (the primary). A
+user's Task, TaskTitle, CompletionHistory, DefaultTask, WeeklyTask,
+MonthlyTask and YearlyTask rows live on that user's shard. Each shard is
+its own file with its own write lock, so users on different shards no
+longer wait for each other's writes.
+
+A user's shard is ``CustomUser.shard`` when it is set (pinned by
+``rebalance_shards --by-rows``), otherwise ``id % N``.
+
+ShardRouter routes queries on the sharded models:
+
+- to the database of the instance involved (saving or deleting a loaded
+  row, related managers such as ``user.tasks``), or
+- to the shard activated for the current request. The JWT authentication
+  class activates the authenticated user's shard, and ShardMiddleware
+  clears it between requests. Code outside a request wraps its queries
+  in ``use_user(user)``. The admin's task pages use the shard of the user
+  in their user filter (tasks.admin.ScalableAdminMixin).
+
+All other models go to ``default``, also when reached from a shard row
+(``task.user``).
+
+Queries with neither go to ``default``. It keeps empty copies of the task
+tables, so the cascade from deleting a user finds nothing there, and a
+signal handler deletes the user's rows on their shard.
+
+Shards use the ``tasks.shard_backend`` SQLite backend, which does not
+enforce foreign keys: the users table the task tables reference lives on
+the primary. Row ids are per shard, and rows get new ids when
+``rebalance_shards`` moves them.
+"""
+import contextlib
+from contextvars import ContextVar
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+SHARDED_MODELS = (
+    'tasktitle', 'task', 'completionhistory', 'defaulttask', 'weeklytask', 'monthlytask', 'yearlytask',
+)
+
+# Database alias of the shard activated for the current request or block
+_current = ContextVar('tasks_shard', default=None)
+
+
+def enabled():
+    return settings.DB_SHARDS > 0
+
+
+def aliases():
+    return [f'shard_{index}' for index in range(settings.DB_SHARDS)]
+
+
+def is_shard(db):
+    return db in aliases()
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'tasks' and model._meta.model_name in SHARDED_MODELS
+
+
+def sharded_models():
+    """The sharded models, referenced models (TaskTitle) before those referencing them."""
+    return [model for model in apps.get_app_config('tasks').get_models() if is_sharded(model)]
+
+
+def shard_index(user):
+    if user.shard is not None and user.shard < settings.DB_SHARDS:
+        return user.shard
+    return user.pk % settings.DB_SHARDS
+
+
+def db_for_user(user):
+    """Database alias holding ``user``'s task data."""
+    if not enabled():
+        return DEFAULT_DB_ALIAS
+    return f'shard_{shard_index(user)}'
+
+
+def activate(user):
+    """Route unhinted task queries to ``user``'s shard for the rest of this context."""
+    if enabled():
+        _current.set(db_for_user(user))
+
+
+@contextlib.contextmanager
+def use_user(user):
+    """Route unhinted task queries inside the block to ``user``'s shard."""
+    token = _current.set(db_for_user(user) if enabled() else None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+class ShardRouter:
+    """Database router sending the sharded models to their user's shard."""
+
+    def _db(self, model, hints):
+        if not is_sharded(model):
+            # Without this, Django would follow a shard row's relation
+            # (task.user) to the row's own database
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if isinstance(instance, get_user_model()):
+            return db_for_user(instance)
+        if instance is not None:
+            if instance._state.db is not None:
+                return instance._state.db
+            if instance._meta.get_field('user').is_cached(instance):
+                return db_for_user(instance.user)
+        return _current.get()
+
+    def db_for_read(self, model, **hints):
+        return self._db(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Task rows reference users across databases
+        if is_sharded(type(obj1)) or is_sharded(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not is_shard(db):
+            return None
+        if app_label != 'tasks':
+            return False
+        # model_name is None for RunPython steps (search index, ANALYZE)
+        return model_name is None or model_name in SHARDED_MODELS
+
+
+class ShardMiddleware:
+    """Clears the activated shard around each request (threads are reused)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _current.set(None)
+        try:
+            return self.get_response(request)
+        finally:
+            _current.reset(token)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def _delete_sharded_rows(sender, instance, **kwargs):
+    if enabled():
+        db = db_for_user(instance)
+        for model in reversed(sharded_models()):
+            model.objects.using(db).filter(user_id=instance.pk).delete()
+
+
+def locate():
+    """Return ``{user_id: {db: rows}}`` for every database holding task rows."""
+    found = {}
+    for db in [DEFAULT_DB_ALIAS] + aliases():
+        for model in sharded_models():
+            for row in model.objects.using(db).order_by().values('user_id').annotate(rows=Count('id')):
+                by_db = found.setdefault(row['user_id'], {})
+                by_db[db] = by_db.get(db, 0) + row['rows']
+    return found
+
+
+def pin_by_rows(found, users):
+    """
+    Pin users to shards so each shard holds a similar number of rows:
+    heaviest users first, each to the currently lightest shard. Updates
+    the ``users`` objects in place and returns those whose pin changed.
+    """
+    loads = [0] * settings.DB_SHARDS
+    changed = []
+    for rows, user_id in sorted(((sum(by_db.values()), user_id) for user_id, by_db in found.items()), reverse=True):
+        user = users.get(user_id)
+        if user is None:
+            continue
+        index = loads.index(min(loads))
+        loads[index] += rows
+        if user.shard != index:
+            user.shard = index
+            changed.append(user)
+    return changed
+
+
+def move_rows(user, source, target):
+    """
+    Copy ``user``'s rows from ``source`` to ``target``, then delete them
+    from ``source``. Timestamps are kept; ids are assigned by ``target``.
+    Returns the number of rows moved.
+    """
+    moved = 0
+    new_ids = {}  # model -> {source id: target id}, to repoint references
+    # target commits before source, so a crash in between duplicates rather than loses rows
+    with transaction.atomic(using=source), transaction.atomic(using=target):
+        for model in sharded_models():
+            references = [
+                f for f in model._meta.concrete_fields
+                if f.is_relation and is_sharded(f.related_model)
+            ]
+            ids = new_ids.setdefault(model, {})
+            for row in model.objects.using(source).filter(user_id=user.pk):
+                for field in references:
+                    value = getattr(row, field.attname)
+                    if value is not None:
+                        setattr(row, field.attname, new_ids[field.related_model][value])
+                source_id, row.pk = row.pk, None
+                # raw save keeps auto_now/auto_now_add values, as loaddata does
+                row.save_base(raw=True, using=target, force_insert=True)
+                ids[source_id] = row.pk
+            moved += len(ids)
+        for model in reversed(sharded_models()):
+            model.objects.using(source).filter(user_id=user.pk).delete()
+    return moved
+
+
+def rebalance(by_rows=False, dry_run=False):
+    """
+    Move every user's task rows onto the user's shard, optionally pinning
+    users by row count first. Rows left on ``default`` from before
+    sharding was turned on are moved too. Returns a list of
+    ``(username, source, target, rows)`` moves.
+    """
+    User = get_user_model()
+    found = locate()
+    users = User.objects.in_bulk(list(found))
+    if by_rows:
+        changed = pin_by_rows(found, users)
+        if not dry_run:
+            User.objects.bulk_update(changed, ['shard'])
+    moves = []
+    for user_id, by_db in sorted(found.items()):
+        user = users.get(user_id)
+        if user is None:
+            continue
+        target = db_for_user(user)
+        for source, rows in sorted(by_db.items()):
+            if source == target:
+                continue
+            if not dry_run:
+                rows = move_rows(user, source, target)
+            moves.append((user.username, source, target, rows))
+    return moves
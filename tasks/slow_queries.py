@@ -0,0 +1,160 @@
+"""
+Slow-query recorder.
+
+SlowQueryMiddleware wraps every database connection for the duration of a
+request. Queries slower than ``SLOW_QUERY_THRESHOLD_MS`` are appended as
+JSON lines to ``SLOW_QUERY_LOG`` with the SQL, a fingerprint of the
+statement shape, a hash of the parameters, the duration, the view that
+issued them and, when ``SLOW_QUERY_EXPLAIN`` is on, the query plan
+(``EXPLAIN QUERY PLAN`` on SQLite, ``EXPLAIN`` on PostgreSQL).
+
+Summarize the log with ``python manage.py slow_queries``.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('tasks.slow_queries')
+
+_current_view = ContextVar('slow_query_view', default=None)
+_explaining = ContextVar('slow_query_explaining', default=False)
+_write_lock = threading.Lock()
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SPACES = re.compile(r'\s+')
+
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def normalize_sql(sql):
+    """Reduce a statement to its shape: literals and IN-list lengths removed."""
+    sql = _SPACES.sub(' ', sql).strip()
+    sql = _IN_LIST.sub('IN (...)', sql)
+    sql = _STRING.sub('?', sql)
+    return _NUMBER.sub('?', sql)
+
+
+def fingerprint(text):
+    return hashlib.sha1(text.encode('utf-8', 'replace')).hexdigest()[:12]
+
+
+def explain(connection, sql, params):
+    """Return the query plan as a list of lines, or None if unsupported."""
+    if connection.vendor == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif connection.vendor == 'postgresql':
+        prefix = 'EXPLAIN '
+    else:
+        return None
+
+    token = _explaining.set(True)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+    except Exception as e:
+        return [f'explain failed: {e}']
+    finally:
+        _explaining.reset(token)
+
+    if connection.vendor == 'sqlite':
+        # (id, parent, notused, detail); indent children under their parent
+        depth = {0: -1}
+        lines = []
+        for node_id, parent, _, detail in rows:
+            depth[node_id] = depth.get(parent, -1) + 1
+            lines.append('  ' * depth[node_id] + detail)
+        return lines
+    return [row[0] for row in rows]
+
+
+class SlowQueryRecorder:
+    """``execute_wrapper`` that records statements over the threshold."""
+
+    def __init__(self, threshold_ms, log_path, explain_plans=False):
+        self.threshold = threshold_ms / 1000
+        self.log_path = log_path
+        self.explain_plans = explain_plans
+
+    def __call__(self, execute, sql, params, many, context):
+        if _explaining.get():
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = time.perf_counter() - started
+        if duration >= self.threshold:
+            self.record(context['connection'], sql, params, many, duration)
+        return result
+
+    def record(self, connection, sql, params, many, duration):
+        entry = {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'database': connection.alias,
+            'view': _current_view.get(),
+            'duration_ms': round(duration * 1000, 3),
+            'sql': sql,
+            'fingerprint': fingerprint(normalize_sql(sql)),
+            'params_fingerprint': fingerprint(repr(params)),
+            'many': many,
+        }
+        if self.explain_plans and not many and sql.lstrip().upper().startswith(EXPLAINABLE):
+            entry['plan'] = explain(connection, sql, params)
+
+        logger.warning('slow query %.1fms view=%s fingerprint=%s',
+                       entry['duration_ms'], entry['view'], entry['fingerprint'])
+        line = json.dumps(entry, default=str)
+        with _write_lock:
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+def read_log(log_path):
+    """Yield the entries of a slow-query log, skipping malformed lines."""
+    try:
+        with open(log_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        return
+
+
+class SlowQueryMiddleware:
+    """Record slow queries issued while handling a request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = SlowQueryRecorder(
+            settings.SLOW_QUERY_THRESHOLD_MS,
+            settings.SLOW_QUERY_LOG,
+            settings.SLOW_QUERY_EXPLAIN,
+        )
+        token = _current_view.set(None)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                return self.get_response(request)
+        finally:
+            _current_view.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        name = match.view_name if match else None
+        _current_view.set(name or f'{view_func.__module__}.{view_func.__name__}')
+        return None
@@ -0,0 +1,150 @@
+"""
+Per-user cache of default task templates.
+
+Applying defaults and listing them read the same few templates on every
+call, and they rarely change. ``templates(user)`` keeps each user's
+templates, ordered by weekday and title, with the ids of their interned
+titles. TEMPLATE_CACHE selects where:
+
+- 'local' (default): in process memory, least recently used users dropped
+  past MAX_USERS;
+- 'cache': in process memory and in the Django cache, so a worker can use
+  another worker's copy (shared between hosts with REDIS_URL);
+- 'off': no caching.
+
+Entries are keyed by the user's ``templates_version``, which the
+DefaultTask save and delete signals replace. Requests load the user anyway,
+so checking an entry is fresh costs no query, and no worker serves a
+stale copy once the change is committed, even with per-process caches.
+Bulk writes (bulk_create, QuerySet.update) send no signals; call
+``changed(user)`` after them.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import models, router, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import DefaultTask, TaskTitle, new_templates_version
+
+
+class LocalTemplateStore:
+    """Templates in process memory."""
+
+    MAX_USERS = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            templates = self._entries.get(key)
+            if templates is not None:
+                self._entries.move_to_end(key)
+            return templates
+
+    def set(self, key, templates):
+        with self._lock:
+            self._entries[key] = templates
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.MAX_USERS:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CacheTemplateStore(LocalTemplateStore):
+    """Templates in process memory, backed by the Django cache shared between workers."""
+
+    def get(self, key):
+        templates = super().get(key)
+        if templates is None:
+            templates = caches[settings.TEMPLATE_CACHE_ALIAS].get(key)
+            if templates is not None:
+                super().set(key, templates)
+        return templates
+
+    def set(self, key, templates):
+        super().set(key, templates)
+        caches[settings.TEMPLATE_CACHE_ALIAS].set(key, templates, settings.TEMPLATE_CACHE_TIMEOUT)
+
+
+_stores = {'local': LocalTemplateStore(), 'cache': CacheTemplateStore()}
+
+
+def get_store():
+    """The configured store, or None when TEMPLATE_CACHE is 'off'."""
+    return _stores.get(settings.TEMPLATE_CACHE)
+
+
+def _key(user):
+    return f'default-templates:{user.pk}:{user.templates_version}'
+
+
+def _load(user):
+    interned = TaskTitle.objects.filter(user=models.OuterRef('user'), title=models.OuterRef('title'))
+    return list(
+        DefaultTask.objects.filter(user=user)
+        .annotate(title_id=models.Subquery(interned.values('id')[:1]))
+        .order_by('weekday', 'title')
+    )
+
+
+def templates(user, tab=None):
+    """
+    The user's templates (of one tab, or all), ordered by weekday and
+    title, each with ``title_id`` set once its title is interned. The
+    instances are shared between requests: read them, do not change them.
+    """
+    store = get_store()
+    found = store.get(_key(user)) if store else None
+    if found is None:
+        found = _load(user)
+        if store:
+            store.set(_key(user), found)
+    if tab is None:
+        return found
+    return [template for template in found if template.tab == tab]
+
+
+def interned(user, title_ids):
+    """Record title ids interned since the user's templates were cached."""
+    found = templates(user)
+    for template in found:
+        if template.title_id is None and template.title in title_ids:
+            template.title_id = title_ids[template.title]
+    store = get_store()
+    if store:
+        store.set(_key(user), found)
+
+
+def changed(user):
+    """
+    Invalidate the cached templates of ``user`` (a user or a user id).
+    A user instance is given the new version, so it reads the change.
+    """
+    # A new random version rather than +1: a rolled back change must not
+    # leave behind an entry that a later change would make current again
+    User = get_user_model()
+    version = new_templates_version()
+    user_id = user.pk if isinstance(user, User) else user
+    User.objects.filter(pk=user_id).update(templates_version=version)
+    if isinstance(user, User):
+        user.templates_version = version
+
+
+@receiver(post_save, sender=DefaultTask)
+@receiver(post_delete, sender=DefaultTask)
+def _templates_changed(sender, instance, using, **kwargs):
+    changed(instance.user_id)
+    if using != router.db_for_write(get_user_model()):
+        # On a shard the version changes before the templates commit, so a
+        # read in between could cache the old templates as the new version
+        transaction.on_commit(lambda: changed(instance.user_id), using=using)
@@ -1,10 +1,28 @@
 # tasks/tests.py
-from django.test import TestCase
-from django.contrib.auth.models import User
+import os
+from unittest import skipUnless
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from rest_framework.test import APIClient
 from rest_framework import status
 from datetime import date
-from .models import Task, DefaultTask
+from .models import CompletionHistory, Job, RevokedToken, Task, DefaultTask
+from . import sharding, throttling
+
+User = get_user_model()
+
+
+def load_tests(loader, tests, pattern):
+    """
+    With DB_SHARDS set, ``manage.py test tasks`` runs only the sharding
+    tests: the other test cases, and their query counts, assume a single
+    database.
+    """
+    if sharding.enabled():
+        return loader.loadTestsFromTestCase(ShardingTestCase)
+    return tests
 
 
 class TaskAPITestCase(TestCase):
@@ -13,6 +31,7 @@ class TaskAPITestCase(TestCase):
     def setUp(self):
         """Set up test client and create test user"""
         self.client = APIClient()
+        throttling.get_store().clear()
         self.user = User.objects.create_user(
             username='testuser',
             password='testpass123'
@@ -89,12 +108,34 @@ class TaskAPITestCase(TestCase):
         )
         
         data = {'completed': True}
-        response = self.client.put(f'/api/tasks/{task.id}/', data)
+        response = self.client.patch(f'/api/tasks/{task.id}/', data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         
         task.refresh_from_db()
         self.assertTrue(task.completed)
     
+    def test_ordering(self):
+        """Test explicit default ordering and client ordering on indexed columns"""
+        Task.objects.create(user=self.user, title='Later', date='2025-11-23')
+        Task.objects.create(user=self.user, title='Earlier', date='2025-11-21')
+        response = self.client.get('/api/tasks/')
+        self.assertEqual([t['title'] for t in response.data], ['Earlier', 'Later'])
+        response = self.client.get('/api/tasks/?ordering=date')
+        self.assertEqual([t['title'] for t in response.data], ['Earlier', 'Later'])
+        response = self.client.get('/api/tasks/?ordering=-date')
+        self.assertEqual([t['title'] for t in response.data], ['Later', 'Earlier'])
+        # Unindexed columns are ignored and the default order is kept
+        response = self.client.get('/api/tasks/?ordering=title')
+        self.assertEqual([t['title'] for t in response.data], ['Earlier', 'Later'])
+    
+    def test_cleanup_validates_days(self):
+        """Test cleanup rejects a days value that is not a sane integer"""
+        Task.objects.create(user=self.user, title='Old', date='2000-01-01')
+        for days in ('x', -1, 10 ** 9, None):
+            response = self.client.post('/api/tasks/cleanup/', {'days': days}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post('/api/tasks/cleanup/', [], format='json').data, {'deleted': 1})
+    
     def test_delete_task(self):
         """Test deleting a task"""
         task = Task.objects.create(
@@ -115,12 +156,17 @@ class AuthAPITestCase(TestCase):
     def setUp(self):
         """Set up test client"""
         self.client = APIClient()
+        throttling.get_store().clear()
+        cache.clear()
     
     def test_register_user(self):
         """Test user registration"""
         data = {
             'username': 'newuser',
-            'password': 'newpass123'
+            'password': 'newpass123',
+            'email': 'newuser@example.com',
+            'first_name': 'New',
+            'last_name': 'User'
         }
         response = self.client.post('/api/auth/register', data)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
@@ -142,6 +188,121 @@ class AuthAPITestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('token', response.data)
     
+    def test_login_wrong_password(self):
+        """Test login with a wrong password or unknown user is rejected"""
+        User.objects.create_user(username='testuser', password='testpass123')
+        response = self.client.post('/api/auth/login', {'username': 'testuser', 'password': 'nope'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post('/api/auth/login', {'username': 'ghost', 'password': 'nope'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+    
+    def test_login_rehashes_to_current_profile(self):
+        """Test a hash from another profile or cost is upgraded on login"""
+        with override_settings(PBKDF2_ITERATIONS=1000):
+            user = User.objects.create_user(username='testuser', password='testpass123')
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+        response = self.client.post('/api/auth/login', {'username': 'testuser', 'password': 'testpass123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith(f'pbkdf2_sha256${settings.PBKDF2_ITERATIONS}$'))
+        
+        hashers = ['tasks.hashers.TunedScryptPasswordHasher', 'tasks.hashers.TunedPBKDF2PasswordHasher']
+        with override_settings(PASSWORD_HASHERS=hashers):
+            response = self.client.post('/api/auth/login', {'username': 'testuser', 'password': 'testpass123'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            user.refresh_from_db()
+            self.assertTrue(user.password.startswith('scrypt$'))
+            self.assertTrue(user.check_password('testpass123'))
+    
+    def test_hashing_pool_full(self):
+        """Test logins and registrations get 503 + Retry-After when the hashing pool is saturated"""
+        from django.test import Client
+        from .hashers import pool
+        User.objects.create_user(username='testuser', password='testpass123')
+        with override_settings(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_BACKLOG=0):
+            pool.reset()
+            executor, slots = pool._get()
+            slots.acquire()
+            try:
+                response = self.client.post('/api/auth/login', {'username': 'testuser', 'password': 'testpass123'})
+                self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+                self.assertEqual(response['Retry-After'], '1')
+                response = self.client.post('/api/auth/register', {
+                    'username': 'newuser', 'password': 'newpass123', 'email': 'new@example.com',
+                    'first_name': 'New', 'last_name': 'User',
+                })
+                self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+                response = Client().post('/login.html', {'username': 'testuser', 'password': 'testpass123'})
+                self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            finally:
+                slots.release()
+                pool.reset()
+        self.assertFalse(User.objects.filter(username='newuser').exists())
+        response = self.client.post('/api/auth/login', {'username': 'testuser', 'password': 'testpass123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_refresh_rotates_and_blacklists(self):
+        """Test refresh issues a new access token and rotates the refresh token"""
+        User.objects.create_user(username='testuser', password='testpass123')
+        login = self.client.post('/api/auth/login', {'username': 'testuser', 'password': 'testpass123'})
+        response = self.client.post('/api/auth/refresh', {'refresh': login.data['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('access', response.data)
+        self.assertNotEqual(response.data['refresh'], login.data['refresh'])
+        
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        self.assertEqual(self.client.get('/api/auth/me').status_code, status.HTTP_200_OK)
+        
+        # The rotated-out refresh token cannot be reused
+        response = self.client.post('/api/auth/refresh', {'refresh': login.data['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+    
+    def test_logout_revokes_tokens(self):
+        """Test logout blacklists the refresh token and revokes the access token without a query per request"""
+        User.objects.create_user(username='testuser', password='testpass123')
+        login = self.client.post('/api/auth/login', {'username': 'testuser', 'password': 'testpass123'})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {login.data['token']}")
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/auth/me').status_code, status.HTTP_200_OK)
+        
+        response = self.client.post('/api/auth/logout', {'refresh': login.data['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/auth/me').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials()
+        response = self.client.post('/api/auth/refresh', {'refresh': login.data['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+    
+    @override_settings(JWT_REVOCATION_STORE='db', JWT_REVOCATION_POLL=60)
+    def test_revocation_in_database(self):
+        """Test the production fallback mirrors revoked tokens in each worker without a query per request"""
+        from . import authentication
+        authentication.get_store().clear()
+        User.objects.create_user(username='testuser', password='testpass123')
+        login = self.client.post('/api/auth/login', {'username': 'testuser', 'password': 'testpass123'})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {login.data['token']}")
+        self.assertEqual(self.client.get('/api/auth/me').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.post('/api/auth/logout', {'refresh': login.data['refresh']}).status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/auth/me').status_code, status.HTTP_401_UNAUTHORIZED)
+        
+        # Another worker reads the revocation on its next poll, then serves from memory
+        jti = RevokedToken.objects.get().jti
+        other = authentication.DatabaseRevocationStore()
+        with self.assertNumQueries(1):
+            self.assertTrue(other.is_revoked(jti))
+        with self.assertNumQueries(0):
+            self.assertTrue(other.is_revoked(jti))
+            self.assertFalse(other.is_revoked('other'))
+        authentication.get_store().clear()
+    
+    def test_login_page_cookie_expires_with_token(self):
+        """Test the login page's token cookie lasts as long as the access token"""
+        User.objects.create_user(username='testuser', password='testpass123')
+        response = self.client.post('/login.html', {'username': 'testuser', 'password': 'testpass123'})
+        lifetime = settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'].total_seconds()
+        self.assertEqual(response.cookies['auth_token']['max-age'], int(lifetime))
+    
     def test_check_users_exist(self):
         """Test checking if users exist"""
         response = self.client.get('/api/auth/exists')
@@ -160,6 +321,7 @@ class DefaultTaskTestCase(TestCase):
     def setUp(self):
         """Set up test client and create test user"""
         self.client = APIClient()
+        throttling.get_store().clear()
         self.user = User.objects.create_user(
             username='testuser',
             password='testpass123'
@@ -207,3 +369,1648 @@ class DefaultTaskTestCase(TestCase):
         self.assertEqual(Task.objects.count(), 1)
         task = Task.objects.first()
         self.assertEqual(task.title, 'Monday Task')
+    
+    def test_recurrence_rules(self):
+        """Test recurrence rules expand over a range of dates in one apply"""
+        rules = [
+            {'title': 'Weekdays', 'weekday': 1, 'weekdays': [1, 2, 3, 4, 5]},
+            {'title': 'Fortnightly', 'weekday': 2, 'interval': 2, 'start_date': '2025-11-04'},
+            {'title': 'First Monday', 'weekday': 1, 'frequency': 'monthly', 'nth_weekday': 1},
+            {'title': 'Last Friday', 'weekday': 5, 'frequency': 'monthly', 'nth_weekday': -1},
+            {'title': 'Month end', 'weekday': 0, 'frequency': 'monthly', 'month_day': -1},
+            {'title': 'Three days', 'weekday': 0, 'frequency': 'daily', 'start_date': '2025-11-10', 'count': 3},
+        ]
+        for rule in rules:
+            response = self.client.post('/api/defaults/', rule, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(DefaultTask.objects.get(title='Three days').last_date, date(2025, 11, 12))
+        self.assertEqual(self.client.get('/api/defaults/').data[0]['weekdays'], [])
+        
+        dates = [f'2025-11-{day:02d}' for day in range(1, 31)]
+        self.client.post('/api/defaults/apply/', {'dates': dates}, format='json')
+        days = lambda title: sorted(d.day for d in Task.objects.filter(title_ref__title=title).values_list('date', flat=True))
+        self.assertEqual(len(days('Weekdays')), 20)
+        self.assertEqual(days('Fortnightly'), [4, 18])
+        self.assertEqual(days('First Monday'), [3])
+        self.assertEqual(days('Last Friday'), [28])
+        self.assertEqual(days('Month end'), [30])
+        self.assertEqual(days('Three days'), [10, 11, 12])
+    
+    def test_recurrence_validation(self):
+        """Test invalid rules are rejected, also on partial updates"""
+        invalid = [
+            {'frequency': 'monthly'},
+            {'frequency': 'monthly', 'month_day': 0},
+            {'month_day': 3},
+            {'interval': 2},
+            {'count': 3},
+            {'start_date': '2025-11-01', 'count': 3, 'until': '2025-12-01'},
+            {'weekdays': [7]},
+        ]
+        for rule in invalid:
+            response = self.client.post('/api/defaults/', {'title': 'Bad', 'weekday': 1, **rule}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, rule)
+        created = self.client.post('/api/defaults/', {'title': 'Good', 'weekday': 1}, format='json').data
+        response = self.client.patch(f"/api/defaults/{created['id']}/", {'frequency': 'monthly'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_applied_titles_are_interned(self):
+        """Test generated tasks share one stored title until edited, and the API is unchanged"""
+        from .models import TaskTitle
+        DefaultTask.objects.create(user=self.user, weekday=1, title='Standup', tab='personal')
+        dates = ['2025-11-03', '2025-11-10', '2025-11-17', '2025-11-24']
+        self.client.post('/api/defaults/apply/', {'dates': dates}, format='json')
+        self.assertEqual(TaskTitle.objects.count(), 1)
+        self.assertEqual(Task.objects.filter(custom_title='', title_ref__title='Standup').count(), 4)
+        
+        response = self.client.get('/api/tasks/?date=2025-11-24')
+        self.assertEqual(response.data[0]['title'], 'Standup')
+        results = self.client.get('/api/search', {'q': 'standup'}).data['results']
+        self.assertEqual(len(results), 4)
+        
+        # Re-applying sees the interned copies as existing
+        self.assertEqual(self.client.post('/api/defaults/apply/', {'dates': dates}, format='json').data['created'], 0)
+        
+        task_id = response.data[0]['id']
+        self.client.patch(f'/api/tasks/{task_id}/', {'title': 'Standup (moved)'}, format='json')
+        task = Task.objects.get(pk=task_id)
+        self.assertEqual((task.custom_title, task.title_ref_id), ('Standup (moved)', None))
+        self.assertEqual(self.client.get('/api/search', {'q': 'moved'}).data['results'][0]['id'], task_id)
+    
+    def test_migration_dedupes_existing_copies(self):
+        """Test the data migration interns existing copies of template titles only"""
+        from importlib import import_module
+        from types import SimpleNamespace
+        from django.apps import apps
+        from django.db import connection
+        migration = import_module('tasks.migrations.0010_interned_task_titles')
+        DefaultTask.objects.create(user=self.user, weekday=1, title='Standup', tab='personal')
+        for day in ('2025-11-17', '2025-11-24'):
+            Task.objects.create(user=self.user, title='Standup', date=day)
+        Task.objects.create(user=self.user, title='One-off', date='2025-11-24')
+        migration.intern_template_titles(apps, SimpleNamespace(connection=connection))
+        self.assertEqual(
+            sorted(Task.objects.values_list('custom_title', 'title_ref__title')),
+            [('', 'Standup'), ('', 'Standup'), ('One-off', None)]
+        )
+        self.assertEqual([t.title for t in Task.objects.order_by('pk')], ['Standup', 'Standup', 'One-off'])
+
+
+class BenchmarkCommandTestCase(TestCase):
+    """Smoke test for the benchmark data generator and scenarios"""
+    
+    def test_generate_and_run_benchmarks(self):
+        """Test that the benchmark commands produce a JSON report"""
+        import json
+        from io import StringIO
+        from django.core.management import call_command
+        
+        call_command('generate_bench_data', users=2, days=3, tasks_per_day=2, templates=3, stdout=StringIO())
+        self.assertEqual(Task.objects.count(), 12)
+        
+        out = StringIO()
+        call_command('run_benchmarks', iterations=1, sync_size=10, only=['list', 'sync_10'], stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['scenarios']), {'list', 'sync_10'})
+        for stats in report['scenarios'].values():
+            self.assertIn('p50_ms', stats)
+            self.assertIn('p99_ms', stats)
+            self.assertIn('queries', stats)
+            self.assertIn('rows_per_s', stats)
+
+
+class WriteContentionTestCase(TransactionTestCase):
+    """
+    Smoke test for run_benchmarks --write-load. The writer threads use
+    their own connections, so the data must be committed. One writer:
+    the shared-cache in-memory test database fails concurrent writes at
+    once ("table is locked") instead of waiting like a database file.
+    """
+
+    def setUp(self):
+        throttling.get_store().clear()
+
+    def test_write_load(self):
+        """Test run_benchmarks --write-load writes from every thread and deletes its rows"""
+        import json
+        from io import StringIO
+        from django.core.management import call_command
+
+        call_command('generate_bench_data', users=1, days=1, tasks_per_day=1, templates=1, stdout=StringIO())
+        before = Task.objects.count()
+        out = StringIO()
+        call_command('run_benchmarks', iterations=1, only=['list'], write_load=0.3, writer_threads=1, stdout=out)
+        report = json.loads(out.getvalue())['write_contention']
+        self.assertEqual(report['writer_threads'], 1)
+        self.assertEqual(report['errors'], 0)
+        self.assertGreater(report['writes_per_s'], 0)
+        self.assertEqual(Task.objects.count(), before)
+
+
+class QueryCountTestCase(TestCase):
+    """
+    Pin the number of queries each endpoint runs.
+    Every endpoint is exercised at several input sizes and must run the
+    same number of queries at each one, so a hot path that starts scaling
+    with rows or dates fails here. Sizes stay below the database bulk
+    insert batch size.
+    """
+    
+    SIZES = [1, 10, 40]
+    
+    def setUp(self):
+        """Set up an authenticated client"""
+        throttling.get_store().clear()
+        from rest_framework_simplejwt.tokens import RefreshToken
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123',
+            email='testuser@example.com'
+        )
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+    
+    def assertConstantQueries(self, expected, setup, request):
+        """Run setup(size) then request(size) for each size with a pinned query count"""
+        for size in self.SIZES:
+            with self.subTest(size=size):
+                setup(size)
+                with self.assertNumQueries(expected):
+                    response = request(size)
+                self.assertLess(response.status_code, 400, response.content[:200])
+    
+    def make_tasks(self, size, day='2025-11-22'):
+        Task.objects.all().delete()
+        CompletionHistory.objects.all().delete()
+        Task.objects.bulk_create([
+            Task(user=self.user, title=f'Task {i}', date=day, tab='personal')
+            for i in range(size)
+        ])
+        return list(Task.objects.values_list('id', flat=True))
+    
+    def test_task_list(self):
+        self.assertConstantQueries(2, self.make_tasks, lambda size: self.client.get('/api/tasks/'))
+    
+    def test_task_list_filtered(self):
+        self.assertConstantQueries(
+            2, self.make_tasks,
+            lambda size: self.client.get('/api/tasks/?date=2025-11-22&tab=personal')
+        )
+    
+    # Task writes also update the completion history in the same
+    # transaction: a savepoint pair, the day's counts, the history row
+    def test_task_create(self):
+        self.assertConstantQueries(
+            6, self.make_tasks,
+            lambda size: self.client.post('/api/tasks/', {'title': 'New', 'date': '2025-11-22'})
+        )
+    
+    def test_task_update(self):
+        ids = []
+        def setup(size):
+            ids[:] = self.make_tasks(size)
+        self.assertConstantQueries(
+            8, setup,
+            lambda size: self.client.patch(f'/api/tasks/{ids[0]}/', {'completed': True})
+        )
+    
+    def test_task_delete(self):
+        ids = []
+        def setup(size):
+            ids[:] = self.make_tasks(size)
+        self.assertConstantQueries(
+            8, setup,
+            lambda size: self.client.delete(f'/api/tasks/{ids[0]}/')
+        )
+    
+    def test_task_sync(self):
+        payload = lambda size: [
+            {'id': i, 'title': f'Synced {i}', 'date': '2025-11-22', 'tab': 'work'}
+            for i in range(size)
+        ]
+        self.assertConstantQueries(
+            7, self.make_tasks,
+            lambda size: self.client.post('/api/tasks/sync/', payload(size), format='json')
+        )
+    
+    def test_task_cleanup(self):
+        self.assertConstantQueries(
+            4, lambda size: self.make_tasks(size, day='2000-01-01'),
+            lambda size: self.client.post('/api/tasks/cleanup/', {'days': 365})
+        )
+    
+    def make_defaults(self, size):
+        from . import template_cache
+        from .models import TaskTitle
+        DefaultTask.objects.all().delete()
+        Task.objects.all().delete()
+        CompletionHistory.objects.all().delete()
+        DefaultTask.objects.bulk_create([
+            DefaultTask(user=self.user, weekday=weekday, title=f'Default {i}', tab='personal')
+            for i in range(size)
+            for weekday in range(7)
+        ])
+        # Titles are interned by the first apply; pin the steady state
+        TaskTitle.intern(self.user, [f'Default {i}' for i in range(size)])
+        template_cache.changed(self.user)
+    
+    def test_defaults_list(self):
+        self.assertConstantQueries(2, self.make_defaults, lambda size: self.client.get('/api/defaults/'))
+    
+    def test_defaults_apply_single_date(self):
+        self.assertConstantQueries(
+            6, self.make_defaults,
+            lambda size: self.client.post('/api/defaults/apply/', {'date': '2025-11-24'})
+        )
+    
+    def test_defaults_apply_many_dates(self):
+        dates = lambda size: [f'2025-11-{day:02d}' for day in range(1, min(size, 30) + 1)]
+        self.assertConstantQueries(
+            6, lambda size: self.make_defaults(1 + size // 20),
+            lambda size: self.client.post('/api/defaults/apply/', {'dates': dates(size)}, format='json')
+        )
+    
+    def test_period_task_lists(self):
+        from .models import WeeklyTask, MonthlyTask, YearlyTask
+        def setup(size):
+            WeeklyTask.objects.all().delete()
+            MonthlyTask.objects.all().delete()
+            YearlyTask.objects.all().delete()
+            WeeklyTask.objects.bulk_create([
+                WeeklyTask(user=self.user, title=f'Weekly {i}', week_start_date='2025-11-17')
+                for i in range(size)
+            ])
+            MonthlyTask.objects.bulk_create([
+                MonthlyTask(user=self.user, title=f'Monthly {i}', month=11, year=2025)
+                for i in range(size)
+            ])
+            YearlyTask.objects.bulk_create([
+                YearlyTask(user=self.user, title=f'Yearly {i}', year=2025)
+                for i in range(size)
+            ])
+        for url in ['/api/weekly-tasks/', '/api/monthly-tasks/?month=11&year=2025', '/api/yearly-tasks/?year=2025']:
+            with self.subTest(url=url):
+                self.assertConstantQueries(2, setup, lambda size: self.client.get(url))
+    
+    def test_auth_views(self):
+        anonymous = APIClient()
+        # Lookup plus the outstanding refresh token insert
+        self.assertConstantQueries(
+            2, self.make_tasks,
+            lambda size: anonymous.post('/api/auth/login', {'username': 'testuser', 'password': 'testpass123'})
+        )
+        self.assertConstantQueries(1, self.make_tasks, lambda size: anonymous.get('/api/auth/exists'))
+        self.assertConstantQueries(1, self.make_tasks, lambda size: self.client.get('/api/auth/me'))
+        self.assertConstantQueries(0, self.make_tasks, lambda size: anonymous.get('/api/ping'))
+        
+        def register(size):
+            return anonymous.post('/api/auth/register', {
+                'username': f'new{size}',
+                'password': 'newpass123',
+                'email': f'new{size}@example.com',
+                'first_name': 'New',
+                'last_name': 'User'
+            })
+        self.assertConstantQueries(5, self.make_tasks, register)
+    
+    def test_form_login(self):
+        from django.test import Client
+        self.assertConstantQueries(
+            2, self.make_tasks,
+            lambda size: Client().post('/login.html', {'username': 'testuser', 'password': 'testpass123'})
+        )
+    
+    def test_admin_changelist(self):
+        from django.test import Client
+        admin_user = User.objects.create_superuser(
+            username='admin', password='adminpass123', email='admin@example.com'
+        )
+        client = Client()
+        client.force_login(admin_user)
+        self.assertConstantQueries(
+            4, self.make_tasks,
+            lambda size: client.get('/admin/tasks/task/')
+        )
+
+
+@override_settings(
+    PERF_INSTRUMENTATION=True,
+    PERF_METRICS_TOKEN='',
+    MIDDLEWARE=['tasks.instrumentation.PerformanceMiddleware'] + settings.MIDDLEWARE,
+)
+class PerformanceMiddlewareTestCase(TestCase):
+    """Test cases for the performance instrumentation middleware"""
+    
+    def setUp(self):
+        """Set up an authenticated client and reset the metrics registry"""
+        from rest_framework_simplejwt.tokens import RefreshToken
+        from .instrumentation import registry
+        registry.reset()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+    
+    def test_server_timing_header(self):
+        """Test that responses carry db, serializer and total timings"""
+        Task.objects.create(user=self.user, title='Task', date='2025-11-22')
+        with self.assertLogs('tasks.performance', level='INFO') as logs:
+            response = self.client.get('/api/tasks/')
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="2 queries"', timing)
+        self.assertIn('ser;dur=', timing)
+        self.assertIn('total;dur=', timing)
+        self.assertIn('endpoint=task-list', logs.output[0])
+    
+    def test_metrics_endpoint(self):
+        """Test that per-endpoint histograms are exposed in Prometheus format"""
+        with self.settings(DEBUG=True), self.assertLogs('tasks.performance', level='INFO'):
+            self.client.get('/api/tasks/')
+            response = self.client.get('/api/metrics')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('http_requests_total{endpoint="task-list",method="GET",status="200"} 1', body)
+        self.assertIn('http_request_duration_seconds_count{endpoint="task-list",method="GET"} 1', body)
+        self.assertIn('http_request_db_queries_total{endpoint="task-list",method="GET"} 2', body)
+    
+    def test_metrics_token(self):
+        """Test that the metrics endpoint can require a scrape token"""
+        with self.settings(PERF_METRICS_TOKEN='secret'), self.assertLogs('tasks.performance', level='INFO'):
+            self.assertEqual(APIClient().get('/api/metrics').status_code, 401)
+            response = APIClient().get('/api/metrics', HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+    
+    def test_metrics_need_token_in_production(self):
+        """Test that without a scrape token the metrics are only served with DEBUG"""
+        with self.settings(PERF_METRICS_TOKEN='', DEBUG=False), self.assertLogs('tasks.performance', level='INFO'):
+            self.assertEqual(APIClient().get('/api/metrics').status_code, 403)
+    
+    def test_metrics_disabled(self):
+        """Test that the metrics endpoint is hidden when instrumentation is off"""
+        with self.settings(PERF_INSTRUMENTATION=False), self.assertLogs('tasks.performance', level='INFO'):
+            self.assertEqual(APIClient().get('/api/metrics').status_code, 404)
+
+
+class SlowQueryLogTestCase(TestCase):
+    """Test cases for the slow-query recorder"""
+    
+    def setUp(self):
+        """Point the slow-query log at a temporary file"""
+        import tempfile
+        from rest_framework_simplejwt.tokens import RefreshToken
+        handle, self.log_path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(handle)
+        self.addCleanup(os.remove, self.log_path)
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+    
+    def test_records_slow_queries_with_plan(self):
+        """Test that queries over the threshold are logged with view and plan"""
+        from io import StringIO
+        from django.core.management import call_command
+        from .slow_queries import read_log
+        
+        with self.settings(
+            SLOW_QUERY_THRESHOLD_MS=0.000001,
+            SLOW_QUERY_EXPLAIN=True,
+            SLOW_QUERY_LOG=self.log_path,
+            MIDDLEWARE=settings.MIDDLEWARE + ['tasks.slow_queries.SlowQueryMiddleware'],
+        ), self.assertLogs('tasks.slow_queries', level='WARNING'):
+            self.client.get('/api/tasks/?date=2025-11-22')
+        
+        entries = list(read_log(self.log_path))
+        task_query = [e for e in entries if 'FROM "tasks_task"' in e['sql']][0]
+        self.assertEqual(task_query['view'], 'task-list')
+        self.assertTrue(task_query['plan'])
+        self.assertIn('tasks_task', ' '.join(task_query['plan']))
+        
+        out = StringIO()
+        call_command('slow_queries', log=self.log_path, stdout=out)
+        self.assertIn(task_query['fingerprint'], out.getvalue())
+        self.assertIn('task-list', out.getvalue())
+
+
+@override_settings(
+    PROFILE_SAMPLE_RATE=0,
+    PROFILE_MAX_STORED=200,
+    MIDDLEWARE=settings.MIDDLEWARE + ['tasks.profiling.ProfilingMiddleware'],
+)
+class ProfilingMiddlewareTestCase(TestCase):
+    """Test cases for opt-in request profiling"""
+    
+    def setUp(self):
+        """Create a staff user and a regular user"""
+        self.staff = User.objects.create_user(
+            username='staff', password='staffpass123', email='staff@example.com', is_staff=True
+        )
+        self.user = User.objects.create_user(
+            username='testuser', password='testpass123', email='testuser@example.com'
+        )
+    
+    def client_for(self, user):
+        from rest_framework_simplejwt.tokens import RefreshToken
+        client = APIClient()
+        token = RefreshToken.for_user(user).access_token
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return client
+    
+    def test_staff_can_profile_request(self):
+        """Test that ?__profile=1 from a staff user stores a profile"""
+        import marshal
+        from .models import RequestProfile
+        response = self.client_for(self.staff).get('/api/tasks/?__profile=1')
+        self.assertEqual(response.status_code, 200)
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual(profile.trigger, 'manual')
+        self.assertEqual(profile.user, self.staff)
+        self.assertTrue(marshal.loads(bytes(profile.stats)))
+        self.assertIn('cumulative', profile.summary)
+    
+    def test_header_trigger(self):
+        """Test that the X-Profile header also triggers profiling"""
+        response = self.client_for(self.staff).get('/api/tasks/', HTTP_X_PROFILE='1')
+        self.assertIn('X-Profile-Id', response)
+    
+    def test_non_staff_ignored(self):
+        """Test that regular users cannot trigger profiling"""
+        from .models import RequestProfile
+        response = self.client_for(self.user).get('/api/tasks/?__profile=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(RequestProfile.objects.count(), 0)
+    
+    def test_sampling_and_retention(self):
+        """Test background sampling and that old profiles are pruned"""
+        from .models import RequestProfile
+        client = self.client_for(self.user)
+        with self.settings(PROFILE_SAMPLE_RATE=1.0, PROFILE_MAX_STORED=2):
+            for _ in range(3):
+                client.get('/api/ping')
+        self.assertEqual(RequestProfile.objects.count(), 2)
+        self.assertEqual(RequestProfile.objects.first().trigger, 'sampled')
+    
+    def test_sampled_profiles_record_user(self):
+        """Test sampled profiles are attributed to the authenticated user"""
+        from .models import RequestProfile
+        with self.settings(PROFILE_SAMPLE_RATE=1.0):
+            self.client_for(self.user).get('/api/tasks/')
+            APIClient().get('/api/ping')
+        self.assertEqual(
+            [(p.path, p.user) for p in RequestProfile.objects.order_by('id')],
+            [('/api/tasks/', self.user), ('/api/ping', None)],
+        )
+    
+    def test_admin_download(self):
+        """Test downloading the pstats file from the admin"""
+        from django.test import Client
+        response = self.client_for(self.staff).get('/api/ping?__profile=1')
+        admin_user = User.objects.create_superuser(
+            username='admin', password='adminpass123', email='admin@example.com'
+        )
+        client = Client()
+        client.force_login(admin_user)
+        download = client.get(f"/admin/tasks/requestprofile/{response['X-Profile-Id']}/download/")
+        self.assertEqual(download.status_code, 200)
+        self.assertIn('.prof', download['Content-Disposition'])
+        self.assertEqual(client.get('/admin/tasks/requestprofile/').status_code, 200)
+
+
+class ScalableAdminTestCase(TestCase):
+    """Test cases for the large-table admin changelists"""
+    
+    def setUp(self):
+        """Create a superuser, a second user and some tasks"""
+        from django.test import Client
+        self.admin_user = User.objects.create_superuser(
+            username='admin', password='adminpass123', email='admin@example.com'
+        )
+        self.other = User.objects.create_user(
+            username='other', password='otherpass123', email='other@example.com'
+        )
+        Task.objects.create(user=self.admin_user, title='Groceries', date='2025-11-22')
+        Task.objects.create(user=self.other, title='Gym', date='2025-11-22')
+        Task.objects.create(user=self.other, title='Read a book', date='2025-11-23')
+        self.client = Client()
+        self.client.force_login(self.admin_user)
+    
+    def test_changelists_render(self):
+        """Test that every task changelist renders with the autocomplete filter"""
+        for url in ['/admin/tasks/task/', '/admin/tasks/defaulttask/', '/admin/tasks/weeklytask/',
+                    '/admin/tasks/monthlytask/', '/admin/tasks/yearlytask/']:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, 'user-autocomplete-filter')
+    
+    def test_title_prefix_search(self):
+        """Test that admin search matches title prefixes"""
+        response = self.client.get('/admin/tasks/task/', {'q': 'G'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+        response = self.client.get('/admin/tasks/task/', {'q': 'Gy'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        
+        # Copies of default tasks keep their text in the interned title
+        DefaultTask.objects.create(user=self.other, weekday=1, title='Garden')
+        DefaultTask.apply_defaults_for_dates(self.other, [date(2025, 11, 24)])
+        self.assertTrue(Task.objects.filter(custom_title='', title_ref__title='Garden').exists())
+        response = self.client.get('/admin/tasks/task/', {'q': 'Gar'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        response = self.client.get('/admin/tasks/task/', {'q': 'G'})
+        self.assertEqual(response.context['cl'].result_count, 3)
+    
+    def test_user_filter(self):
+        """Test filtering by user id and that only the selected user is listed"""
+        response = self.client.get('/admin/tasks/task/', {'user': self.other.pk})
+        self.assertEqual(response.context['cl'].result_count, 2)
+        self.assertContains(response, '>other</a>')
+        self.assertNotContains(response, '>admin</a></li>')
+    
+    def test_user_autocomplete_endpoint(self):
+        """Test that the filter's autocomplete URL returns matching users"""
+        response = self.client.get('/admin/autocomplete/', {
+            'app_label': 'tasks', 'model_name': 'task', 'field_name': 'user', 'term': 'oth'
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['text'] for r in response.json()['results']], ['other'])
+    
+    def test_estimated_count_paginator(self):
+        """Test that the paginator stops counting at its limit"""
+        from unittest import mock
+        from .admin import EstimatedCountPaginator
+        with mock.patch.object(EstimatedCountPaginator, 'COUNT_LIMIT', 2):
+            paginator = EstimatedCountPaginator(Task.objects.order_by('-pk'), 1)
+            self.assertEqual(paginator.count, 3)
+        with mock.patch.object(EstimatedCountPaginator, 'COUNT_LIMIT', 1):
+            paginator = EstimatedCountPaginator(Task.objects.order_by('-pk'), 1)
+            self.assertEqual(paginator.count, 2)
+
+
+class SearchAPITestCase(TestCase):
+    """Test cases for full-text title search"""
+    
+    def setUp(self):
+        """Set up test client and tasks for two users"""
+        from rest_framework_simplejwt.tokens import RefreshToken
+        from .models import WeeklyTask, MonthlyTask, YearlyTask
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testuser', password='testpass123', email='testuser@example.com'
+        )
+        self.other = User.objects.create_user(
+            username='other', password='otherpass123', email='other@example.com'
+        )
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        
+        Task.objects.bulk_create([
+            Task(user=self.user, title='Buy groceries', date='2025-11-22'),
+            Task(user=self.user, title='Call the plumber', date='2025-11-23'),
+            Task(user=self.other, title='Buy groceries too', date='2025-11-22'),
+        ])
+        WeeklyTask.objects.create(user=self.user, title='Plan grocery budget', week_start_date='2025-11-17')
+        MonthlyTask.objects.create(user=self.user, title='Groceries review', month=11, year=2025)
+        YearlyTask.objects.create(user=self.user, title='Learn to cook', year=2025)
+    
+    def test_search_across_kinds(self):
+        """Test prefix search across all task kinds for the current user only"""
+        response = self.client.get('/api/search', {'q': 'grocer'})
+        self.assertEqual(response.status_code, 200)
+        found = {(r['kind'], r['title']) for r in response.data['results']}
+        self.assertEqual(found, {
+            ('task', 'Buy groceries'),
+            ('weekly', 'Plan grocery budget'),
+            ('monthly', 'Groceries review'),
+        })
+    
+    def test_search_kind_filter_and_paging(self):
+        """Test restricting kinds and paginating results"""
+        response = self.client.get('/api/search', {'q': 'grocer', 'kind': ['task', 'monthly'], 'page_size': 1})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertTrue(response.data['has_more'])
+        response = self.client.get('/api/search', {'q': 'grocer', 'kind': ['task', 'monthly'], 'page_size': 1, 'page': 2})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertFalse(response.data['has_more'])
+    
+    def test_index_follows_writes(self):
+        """Test that updates and deletes are reflected in the index"""
+        task = Task.objects.get(custom_title='Call the plumber')
+        task.title = 'Call the electrician'
+        task.save()
+        self.assertEqual(self.client.get('/api/search', {'q': 'plumber'}).data['results'], [])
+        self.assertEqual(len(self.client.get('/api/search', {'q': 'electrician'}).data['results']), 1)
+        Task.objects.filter(user=self.user).delete()
+        titles = [r['title'] for r in self.client.get('/api/search', {'q': 'grocer'}).data['results']]
+        self.assertNotIn('Buy groceries', titles)
+    
+    def test_rebuild_command(self):
+        """Test rebuilding the index from the task tables"""
+        from io import StringIO
+        from django.core.management import call_command
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 6 titles', out.getvalue())
+        self.assertEqual(len(self.client.get('/api/search', {'q': 'cook'}).data['results']), 1)
+    
+    def test_lost_trigger_falls_back_until_rebuilt(self):
+        """Test a missing sync trigger is detected and restored by a rebuild"""
+        from django.db import connection
+        from . import search
+        if not search.has_fts(connection):
+            self.skipTest('SQLite without FTS5')
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER tasks_weeklytask_search_ai')
+        self.assertFalse(search.has_fts(connection))
+        # The fallback still finds rows the index would have missed
+        from .models import WeeklyTask
+        WeeklyTask.objects.create(user=self.user, title='Pay rent', week_start_date='2025-11-24')
+        self.assertEqual(len(self.client.get('/api/search', {'q': 'rent'}).data['results']), 1)
+        search.rebuild(connection)
+        self.assertTrue(search.has_fts(connection))
+        self.assertEqual(len(self.client.get('/api/search', {'q': 'rent'}).data['results']), 1)
+    
+    def test_search_requires_query(self):
+        """Test that an empty query is rejected"""
+        self.assertEqual(self.client.get('/api/search').status_code, 400)
+
+
+class ThrottlingTestCase(TestCase):
+    """Test cases for token-bucket throttles, batch caps and load shedding"""
+    
+    def setUp(self):
+        """Set up two authenticated clients"""
+        from rest_framework_simplejwt.tokens import RefreshToken
+        throttling.get_store().clear()
+        throttling.monitor.reset()
+        self.user = User.objects.create_user(username='testuser', password='testpass123', email='t@example.com')
+        self.other = User.objects.create_user(username='other', password='testpass123', email='o@example.com')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.other_client = APIClient()
+        self.other_client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.other).access_token}')
+    
+    def assertBucket(self, store):
+        with override_settings(THROTTLE_STORE=store, THROTTLE_RATES={'sync': '2/min'}):
+            throttling.get_store().clear()
+            for _ in range(2):
+                self.assertEqual(self.client.post('/api/tasks/sync/', [], format='json').status_code, 200)
+            response = self.client.post('/api/tasks/sync/', [], format='json')
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            # One token refills in 30 seconds
+            self.assertIn(response['Retry-After'], ('29', '30'))
+            # Buckets are per user
+            self.assertEqual(self.other_client.post('/api/tasks/sync/', [], format='json').status_code, 200)
+    
+    def test_local_bucket(self):
+        """Test the in-process bucket store limits bursts per user"""
+        self.assertBucket('local')
+    
+    def test_cache_bucket(self):
+        """Test the shared cache bucket store limits bursts per user"""
+        self.assertBucket('cache')
+    
+    def test_bucket_refills(self):
+        """Test tokens refill at the configured rate"""
+        store = throttling.LocalBucketStore()
+        self.assertEqual(store.take('k', 2, 1.0, now=100.0), 0)
+        self.assertEqual(store.take('k', 2, 1.0, now=100.0), 0)
+        self.assertAlmostEqual(store.take('k', 2, 1.0, now=100.5), 0.5)
+        self.assertEqual(store.take('k', 2, 1.0, now=101.0), 0)
+    
+    def test_prune_keeps_slow_buckets(self):
+        """Test pruning keeps each bucket until its own scope would refill it"""
+        store = throttling.LocalBucketStore()
+        store.MAX_KEYS = 2
+        store.take('register', 1, 1 / 3600, now=0.0)
+        store.take('sync', 12, 12 / 60, now=0.0)
+        # Sync buckets are full again after a minute; register ones are not
+        store.take('login', 10, 10 / 60, now=120.0)
+        self.assertEqual(set(store._buckets), {'register', 'login'})
+        self.assertGreater(store.take('register', 1, 1 / 3600, now=120.0), 0)
+    
+    def test_form_login_and_register_throttled(self):
+        """Test the HTML login and register forms use the API's buckets"""
+        from django.test import Client
+        with override_settings(THROTTLE_RATES={'login': '1/min', 'register': '1/hour'}):
+            data = {'username': 'testuser', 'password': 'wrong'}
+            self.assertEqual(Client().post('/login.html', data).status_code, 200)
+            response = Client().post('/login.html', data)
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '60')
+            # One bucket per client, whichever way it signs in
+            self.assertEqual(APIClient().post('/api/auth/login', data).status_code, 429)
+            
+            self.assertEqual(Client().post('/register.html', {'username': 'new'}).status_code, 200)
+            response = Client().post('/register.html', {'username': 'new'})
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '3600')
+            self.assertEqual(Client().get('/register.html').status_code, 200)
+    
+    def test_disabled(self):
+        """Test throttles can be switched off in process, as run_benchmarks does"""
+        data = {'username': 'testuser', 'password': 'wrong'}
+        with override_settings(THROTTLE_RATES={'login': '1/min'}):
+            with throttling.disabled():
+                for _ in range(3):
+                    self.assertEqual(APIClient().post('/api/auth/login', data).status_code, 401)
+            self.assertEqual(APIClient().post('/api/auth/login', data).status_code, 401)
+            self.assertEqual(APIClient().post('/api/auth/login', data).status_code, 429)
+    
+    def test_anonymous_login_throttled_by_ip(self):
+        """Test anonymous logins share a bucket per client IP"""
+        with override_settings(THROTTLE_RATES={'login': '1/min'}):
+            data = {'username': 'testuser', 'password': 'wrong'}
+            self.assertEqual(APIClient().post('/api/auth/login', data).status_code, 401)
+            self.assertEqual(APIClient().post('/api/auth/login', data).status_code, 429)
+            response = APIClient().post('/api/auth/login', data, REMOTE_ADDR='10.0.0.2')
+            self.assertEqual(response.status_code, 401)
+    
+    def test_batch_caps(self):
+        """Test oversized apply and sync batches are rejected before any work"""
+        with override_settings(MAX_APPLY_DATES=3, MAX_SYNC_TASKS=2):
+            response = self.client.post('/api/defaults/apply/', {
+                'dates': ['2025-01-01', '2025-01-02', '2025-01-03', '2025-01-04'],
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            tasks = [{'title': f'T{i}', 'date': '2025-01-01'} for i in range(3)]
+            response = self.client.post('/api/tasks/sync/', tasks, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            response = self.client.post('/api/tasks/sync/', tasks[:2], format='json')
+            self.assertEqual(response.data['count'], 2)
+    
+    def test_load_shedding(self):
+        """Test API writes get 503 while write latency is over the threshold, reads do not"""
+        middleware = settings.MIDDLEWARE + ['tasks.throttling.LoadSheddingMiddleware']
+        with override_settings(MIDDLEWARE=middleware, LOAD_SHED_WRITE_LATENCY_MS=100):
+            response = self.client.post('/api/tasks/', {'title': 'Fast', 'date': '2025-01-01'})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            
+            throttling.monitor.observe(1.5)
+            response = self.client.post('/api/tasks/', {'title': 'Shed', 'date': '2025-01-01'})
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response['Retry-After'], '2')
+            self.assertEqual(self.client.get('/api/tasks/').status_code, status.HTTP_200_OK)
+            self.assertFalse(Task.objects.filter(custom_title='Shed').exists())
+        
+        # Samples age out of the window
+        import time
+        self.assertEqual(throttling.monitor.mean_latency(now=time.monotonic() + settings.LOAD_SHED_WINDOW + 1), 0.0)
+
+
+@override_settings(WRITE_BUFFER_WINDOW_MS=60000)
+class WriteBufferTestCase(TestCase):
+    """Test cases for the write-behind buffer for completed toggles"""
+    
+    def setUp(self):
+        """Set up two authenticated clients and a few tasks"""
+        from rest_framework_simplejwt.tokens import RefreshToken
+        from .write_buffer import buffer
+        self.buffer = buffer
+        self.user = User.objects.create_user(username='testuser', password='testpass123', email='t@example.com')
+        self.other = User.objects.create_user(username='other', password='testpass123', email='o@example.com')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.other_client = APIClient()
+        self.other_client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.other).access_token}')
+        self.tasks = [Task.objects.create(user=self.user, title=f'Task {i}', date='2025-11-22') for i in range(2)]
+    
+    def tearDown(self):
+        self.buffer.flush()
+    
+    def toggle(self, task, completed):
+        return self.client.patch(f'/api/tasks/{task.id}/', {'completed': completed}, format='json')
+    
+    def test_toggles_are_acknowledged_and_coalesced(self):
+        """Test toggles return the new state at once and flush as one write per row"""
+        # Authentication and the ownership lookup; no write
+        with self.assertNumQueries(2):
+            response = self.toggle(self.tasks[0], True)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['completed'])
+        self.toggle(self.tasks[0], False)
+        self.toggle(self.tasks[0], True)
+        self.toggle(self.tasks[1], True)
+        self.assertFalse(Task.objects.get(pk=self.tasks[0].pk).completed)
+        
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(Task.objects.filter(user=self.user, completed=True).count(), 2)
+        self.assertEqual(CompletionHistory.calendar(self.user, 2025)[325], '2')
+    
+    def test_read_your_writes(self):
+        """Test the same user's next read sees buffered toggles; other users do not flush them"""
+        self.toggle(self.tasks[0], True)
+        self.assertEqual(self.other_client.get('/api/tasks/').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.buffer.pending(), 1)
+        
+        response = self.client.get('/api/tasks/')
+        self.assertEqual([t['id'] for t in response.data if t['completed']], [self.tasks[0].id])
+        self.assertEqual(self.buffer.pending(), 0)
+    
+    def test_later_writes_keep_order(self):
+        """Test a full update after a buffered toggle is not overwritten by the flush"""
+        self.toggle(self.tasks[0], True)
+        response = self.client.put(f'/api/tasks/{self.tasks[0].id}/', {
+            'title': 'Renamed', 'date': '2025-11-22', 'completed': False,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.buffer.flush()
+        task = Task.objects.get(pk=self.tasks[0].pk)
+        self.assertEqual((task.title, task.completed), ('Renamed', False))
+    
+    def test_other_fields_are_not_buffered(self):
+        """Test PATCHes touching other fields are written immediately"""
+        response = self.client.patch(f'/api/tasks/{self.tasks[0].id}/', {'title': 'Now', 'completed': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.buffer.pending(), 0)
+        self.assertTrue(Task.objects.get(pk=self.tasks[0].pk).completed)
+    
+    def test_other_users_rows(self):
+        """Test toggling another user's task is still a 404"""
+        response = self.other_client.patch(f'/api/tasks/{self.tasks[0].id}/', {'completed': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.buffer.pending(), 0)
+    
+    def test_weekly_toggle(self):
+        """Test weekly task toggles are buffered too"""
+        from .models import WeeklyTask
+        weekly = WeeklyTask.objects.create(user=self.user, title='Plan', week_start_date=date(2025, 11, 17))
+        response = self.client.patch(f'/api/weekly-tasks/{weekly.id}/', {'completed': True}, format='json')
+        self.assertTrue(response.data['completed'])
+        self.assertEqual(self.buffer.pending(), 1)
+        self.assertTrue(self.client.get(f'/api/weekly-tasks/{weekly.id}/').data['completed'])
+
+
+class CompressionMiddlewareTestCase(TestCase):
+    """Test cases for API response compression"""
+    
+    def setUp(self):
+        """Set up an authenticated client with enough tasks for a large response"""
+        from rest_framework_simplejwt.tokens import RefreshToken
+        self.user = User.objects.create_user(username='testuser', password='testpass123', email='t@example.com')
+        Task.objects.bulk_create([
+            Task(user=self.user, title=f'Task number {i}', date='2025-11-22') for i in range(50)
+        ])
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+    
+    def test_gzip(self):
+        """Test large API responses are gzipped when accepted"""
+        import gzip
+        import json
+        response = self.client.get('/api/tasks/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))), 50)
+    
+    def test_brotli_preferred(self):
+        """Test brotli is used when accepted and available"""
+        from . import compression
+        if compression.brotli is None:
+            self.skipTest('brotli not installed')
+        response = self.client.get('/api/tasks/', HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        response = self.client.get('/api/tasks/', HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+    
+    def test_not_compressed(self):
+        """Test small responses, clients without gzip and auth endpoints are sent as is"""
+        self.assertFalse(self.client.get('/api/tasks/').has_header('Content-Encoding'))
+        response = self.client.get('/api/tasks/?date=2030-01-01', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        with override_settings(API_COMPRESSION_MIN_BYTES=1):
+            response = self.client.get('/api/auth/me', HTTP_ACCEPT_ENCODING='gzip')
+            self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class BatchAPITestCase(TestCase):
+    """Test cases for the batched request endpoint"""
+    
+    def setUp(self):
+        """Set up an authenticated client and some tasks"""
+        from rest_framework_simplejwt.tokens import RefreshToken
+        throttling.get_store().clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass123', email='t@example.com')
+        self.other = User.objects.create_user(username='other', password='testpass123', email='o@example.com')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.task = Task.objects.create(user=self.user, title='Mine', date='2025-11-22', completed=True)
+        self.foreign = Task.objects.create(user=self.other, title='Theirs', date='2025-11-22')
+    
+    def batch(self, requests, **extra):
+        return self.client.post('/api/batch', {'requests': requests, **extra}, format='json')
+    
+    def test_runs_calls_in_order(self):
+        """Test sub-requests run in order with the caller's identity"""
+        response = self.batch([
+            {'method': 'POST', 'path': '/api/tasks/', 'body': {'title': 'New', 'date': '2025-11-22'}},
+            {'method': 'DELETE', 'path': f'/api/tasks/{self.task.id}/'},
+            {'method': 'GET', 'path': '/api/tasks/?date=2025-11-22'},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['ok'])
+        self.assertEqual([r['status'] for r in response.data['responses']], [201, 204, 200])
+        self.assertEqual([t['title'] for t in response.data['responses'][2]['body']], ['New'])
+    
+    def test_failures_are_per_call(self):
+        """Test a failing call does not stop a non-atomic batch and ownership is enforced"""
+        response = self.batch([
+            {'method': 'DELETE', 'path': f'/api/tasks/{self.foreign.id}/'},
+            {'method': 'GET', 'path': '/api/nowhere/'},
+            {'method': 'GET', 'path': '/api/defaults/'},
+        ])
+        self.assertFalse(response.data['ok'])
+        self.assertEqual([r['status'] for r in response.data['responses']], [404, 404, 200])
+        self.assertTrue(Task.objects.filter(pk=self.foreign.pk).exists())
+    
+    def test_atomic_rolls_back(self):
+        """Test an atomic batch stops at the first failure and undoes earlier calls"""
+        response = self.batch([
+            {'method': 'DELETE', 'path': f'/api/tasks/{self.task.id}/'},
+            {'method': 'POST', 'path': '/api/tasks/', 'body': {'title': ''}},
+            {'method': 'GET', 'path': '/api/tasks/'},
+        ], atomic=True)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['rolled_back'])
+        self.assertEqual([r['status'] for r in response.data['responses']], [204, 400])
+        self.assertTrue(Task.objects.filter(pk=self.task.pk).exists())
+    
+    @override_settings(WRITE_BUFFER_WINDOW_MS=60000)
+    def test_atomic_skips_write_buffer(self):
+        """Test toggles in an atomic batch are written in its transaction, not buffered past it"""
+        from .write_buffer import buffer
+        response = self.batch([
+            {'method': 'PATCH', 'path': f'/api/tasks/{self.task.id}/', 'body': {'completed': False}},
+            {'method': 'GET', 'path': '/api/nowhere/'},
+        ], atomic=True)
+        self.assertTrue(response.data['rolled_back'])
+        self.assertEqual(buffer.pending(), 0)
+        self.assertEqual(buffer.flush(), 0)
+        self.assertTrue(Task.objects.get(pk=self.task.pk).completed)
+    
+    def test_atomic_rolls_back_jobs(self):
+        """Test jobs enqueued by an atomic batch are dropped with it"""
+        response = self.batch([
+            {'method': 'POST', 'path': '/api/tasks/sync/?async=1', 'body': []},
+            {'method': 'POST', 'path': '/api/tasks/', 'body': {'title': ''}},
+        ], atomic=True)
+        self.assertEqual([r['status'] for r in response.data['responses']], [202, 400])
+        self.assertFalse(Job.objects.exists())
+    
+    def test_call_errors_are_per_call(self):
+        """Test a call that raises gets a 500 entry; an atomic batch is rolled back"""
+        from unittest import mock
+        calls = [
+            {'method': 'DELETE', 'path': f'/api/tasks/{self.task.id}/'},
+            {'method': 'POST', 'path': '/api/tasks/cleanup/', 'body': {'days': 30}},
+            {'method': 'GET', 'path': '/api/defaults/'},
+        ]
+        with mock.patch('tasks.jobs.run_inline', side_effect=RuntimeError('disk full')), \
+                self.assertLogs('tasks.batch', level='ERROR'):
+            response = self.batch(calls, atomic=True)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.data['rolled_back'])
+            self.assertEqual([r['status'] for r in response.data['responses']], [204, 500])
+            self.assertTrue(Task.objects.filter(pk=self.task.pk).exists())
+            
+            response = self.batch(calls)
+            self.assertEqual([r['status'] for r in response.data['responses']], [204, 500, 200])
+            self.assertFalse(Task.objects.filter(pk=self.task.pk).exists())
+    
+    def test_rejected_requests(self):
+        """Test auth, nested batch, unsupported methods, oversized and anonymous batches are refused"""
+        response = self.batch([
+            {'method': 'POST', 'path': '/api/auth/login', 'body': {}},
+            {'method': 'POST', 'path': '/api/batch', 'body': {'requests': []}},
+            {'method': 'TRACE', 'path': '/api/tasks/'},
+            {'method': 'GET', 'path': '/admin/'},
+        ])
+        self.assertEqual([r['status'] for r in response.data['responses']], [400, 400, 400, 400])
+        self.assertEqual(self.batch([]).status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(MAX_BATCH_REQUESTS=1):
+            calls = [{'method': 'GET', 'path': '/api/tasks/'}] * 2
+            self.assertEqual(self.batch(calls).status_code, status.HTTP_400_BAD_REQUEST)
+        anonymous = APIClient().post('/api/batch', {'requests': [{'path': '/api/tasks/'}]}, format='json')
+        self.assertEqual(anonymous.status_code, status.HTTP_401_UNAUTHORIZED)
+    
+    def test_authenticates_once(self):
+        """Test sub-requests reuse the batch's authentication instead of loading the user again"""
+        calls = [
+            {'method': 'GET', 'path': '/api/tasks/'},
+            {'method': 'GET', 'path': '/api/defaults/'},
+            {'method': 'GET', 'path': '/api/weekly-tasks/'},
+        ]
+        with self.assertNumQueries(1 + len(calls)):
+            self.batch(calls)
+
+
+@skipUnless(settings.DB_SHARDS >= 2, 'run with DB_SHARDS=2 to test sharding')
+class ShardingTestCase(TestCase):
+    """Test cases for per-user sharding (DB_SHARDS=2 python manage.py test tasks.tests.ShardingTestCase)"""
+    
+    databases = '__all__'
+    
+    def setUp(self):
+        """Create two users pinned to different shards"""
+        from rest_framework_simplejwt.tokens import RefreshToken
+        throttling.get_store().clear()
+        self.alice = User.objects.create_user(username='alice', password='testpass123', email='a@example.com', shard=0)
+        self.bob = User.objects.create_user(username='bob', password='testpass123', email='b@example.com', shard=1)
+        self.clients = {}
+        for user in (self.alice, self.bob):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+            self.clients[user.username] = client
+    
+    def test_rows_live_on_user_shard(self):
+        """Test API writes land on the user's shard and reads only see that shard"""
+        for user in (self.alice, self.bob):
+            response = self.clients[user.username].post('/api/tasks/', {'title': f'{user.username} task', 'date': '2025-11-22'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Task.objects.using('shard_0').get().user_id, self.alice.pk)
+        self.assertEqual(Task.objects.using('shard_1').get().user_id, self.bob.pk)
+        self.assertFalse(Task.objects.using('default').exists())
+        
+        response = self.clients['bob'].get('/api/tasks/')
+        self.assertEqual([t['title'] for t in response.data], ['bob task'])
+        response = self.clients['bob'].get('/api/search?q=bob')
+        self.assertEqual(len(response.data['results']), 1)
+        
+        # Cached templates are invalidated by writes to the shard
+        self.assertEqual(self.clients['bob'].get('/api/defaults/').data, [])
+        self.clients['bob'].post('/api/defaults/', {'weekday': 1, 'title': 'Standup'})
+        self.assertEqual([t['title'] for t in self.clients['bob'].get('/api/defaults/').data], ['Standup'])
+    
+    def test_admin_uses_user_shard(self):
+        """Test admin pages read and write the filtered user's shard, history included"""
+        from django.test import Client
+        admin_user = User.objects.create_superuser(username='admin', password='adminpass123', email='ad@example.com', shard=0)
+        task = self.bob.tasks.create(title='Bob task', date='2025-11-22')
+        client = Client()
+        client.force_login(admin_user)
+        
+        response = client.get('/admin/tasks/task/', {'user': self.bob.pk})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        # Unfiltered: the signed-in user's shard
+        response = client.get('/admin/tasks/task/')
+        self.assertEqual(response.context['cl'].result_count, 0)
+        
+        filters = f'_changelist_filters=user%3D{self.bob.pk}'
+        response = client.post(f'/admin/tasks/task/{task.pk}/change/?{filters}', {
+            'user': self.bob.pk, 'custom_title': 'Bob task', 'completed': 'on', 'date': '2025-11-22', 'tab': 'personal',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Task.objects.using('shard_1').get(pk=task.pk).completed)
+        day = date(2025, 11, 22).timetuple().tm_yday - 1
+        with sharding.use_user(self.bob):
+            self.assertEqual(CompletionHistory.calendar(self.bob, 2025)[day], '2')
+        
+        client.post(f'/admin/tasks/task/?user={self.bob.pk}', {
+            'action': 'delete_selected', '_selected_action': [task.pk], 'post': 'yes',
+        })
+        self.assertFalse(Task.objects.using('shard_1').exists())
+        with sharding.use_user(self.bob):
+            self.assertEqual(CompletionHistory.calendar(self.bob, 2025)[day], '0')
+    
+    def test_sync_and_user_delete(self):
+        """Test sync replaces rows on the shard and deleting a user removes them there"""
+        response = self.clients['alice'].post('/api/tasks/sync/', [
+            {'title': 'One', 'date': '2025-11-22'},
+            {'title': 'Two', 'date': '2025-11-23'},
+        ], format='json')
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(self.alice.tasks.count(), 2)
+        self.alice.delete()
+        self.assertFalse(Task.objects.using('shard_0').exists())
+        
+        from .purge import purge_user
+        self.clients['bob'].post('/api/tasks/sync/', [{'title': 'Three', 'date': '2025-11-22'}], format='json')
+        counts, _ = purge_user(self.bob)
+        self.assertEqual(counts['tasks.Task'], 1)
+        self.assertFalse(Task.objects.using('shard_1').exists())
+    
+    def test_rebalance_moves_rows(self):
+        """Test rebalance_shards moves rows to the user's shard and keeps timestamps"""
+        from django.core.management import call_command
+        from .models import TaskTitle
+        ref = TaskTitle.objects.using('default').create(user=self.bob, title='Legacy')
+        legacy = Task.objects.using('default').create(user=self.bob, title_ref=ref, date='2025-11-22')
+        DefaultTask.objects.using('shard_0').create(user=self.bob, weekday=0, title='Stray')
+        call_command('rebalance_shards', stdout=open(os.devnull, 'w'))
+        moved = Task.objects.using('shard_1').get(user=self.bob)
+        self.assertEqual((moved.title, moved.created_at), ('Legacy', legacy.created_at))
+        self.assertEqual(moved.title_ref.user_id, self.bob.pk)
+        self.assertEqual(DefaultTask.objects.using('shard_1').get().title, 'Stray')
+        self.assertEqual(sharding.locate(), {self.bob.pk: {'shard_1': 3}})
+        
+        # Pinning by rows sends the heaviest user to the first shard
+        self.alice.tasks.create(title='Light', date='2025-11-22')
+        call_command('rebalance_shards', '--by-rows', stdout=open(os.devnull, 'w'))
+        self.bob.refresh_from_db()
+        self.alice.refresh_from_db()
+        self.assertEqual((self.bob.shard, self.alice.shard), (0, 1))
+        self.assertEqual(sharding.locate(), {self.bob.pk: {'shard_0': 3}, self.alice.pk: {'shard_1': 1}})
+    
+    def test_benchmark_counts_shard_queries(self):
+        """Test benchmark scenarios count queries on every database alias"""
+        from .benchmarks import Scenario
+        scenario = Scenario('shard', lambda: Task.objects.using('shard_1').count() + User.objects.count())
+        self.assertEqual(scenario.measure(1)['queries'], 2)
+    
+    def test_atomic_batch_spans_databases(self):
+        """Test an atomic batch rolls back the user's shard and the default database together"""
+        task = self.bob.tasks.create(title='Keep', date='2025-11-22')
+        response = self.clients['bob'].post('/api/batch', {'atomic': True, 'requests': [
+            {'method': 'DELETE', 'path': f'/api/tasks/{task.id}/'},
+            {'method': 'POST', 'path': '/api/tasks/sync/?async=1', 'body': []},
+            {'method': 'POST', 'path': '/api/tasks/', 'body': {'title': ''}},
+        ]}, format='json')
+        self.assertEqual([r['status'] for r in response.data['responses']], [204, 202, 400])
+        self.assertTrue(response.data['rolled_back'])
+        self.assertTrue(Task.objects.using('shard_1').filter(pk=task.pk).exists())
+        self.assertFalse(Job.objects.exists())
+    
+    @override_settings(WRITE_BUFFER_WINDOW_MS=60000)
+    def test_buffered_toggle_flushes_to_shard(self):
+        """Test buffered completed toggles are written to the row's shard"""
+        from .write_buffer import buffer
+        task = self.bob.tasks.create(title='Toggle', date='2025-11-22')
+        response = self.clients['bob'].patch(f'/api/tasks/{task.id}/', {'completed': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertTrue(Task.objects.using('shard_1').get(pk=task.pk).completed)
+        with sharding.use_user(self.bob):
+            days = CompletionHistory.calendar(self.bob, 2025)
+        self.assertEqual(days[date(2025, 11, 22).timetuple().tm_yday - 1], '2')
+
+
+class CompletionHistoryTestCase(TestCase):
+    """Test cases for the completion history bitsets, streaks and year grids"""
+    
+    def setUp(self):
+        """Set up an authenticated client"""
+        throttling.get_store().clear()
+        from rest_framework_simplejwt.tokens import RefreshToken
+        self.user = User.objects.create_user(username='testuser', password='testpass123', email='t@example.com')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+    
+    def create(self, day, completed=False, tab='personal'):
+        response = self.client.post('/api/tasks/', {'title': 'Task', 'date': day, 'completed': completed, 'tab': tab})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+    
+    def streak(self, day='2025-01-05', tab=''):
+        return self.client.get(f'/api/tasks/streak/?date={day}&tab={tab}').data
+    
+    def calendar(self, year=2025, tab=''):
+        return self.client.get(f'/api/tasks/calendar/?year={year}&tab={tab}').data['days']
+    
+    def test_writes_update_streaks(self):
+        """Test creates, toggles, moves and deletes keep the streak current"""
+        for day in ['2024-12-30', '2024-12-31', '2025-01-01', '2025-01-03', '2025-01-04']:
+            self.create(day, completed=True)
+        open_id = self.create('2025-01-05')
+        self.assertEqual(self.streak(), {
+            'current': 2, 'longest': 3,
+            'longest_start': date(2024, 12, 30), 'longest_end': date(2025, 1, 1),
+        })
+        
+        self.client.patch(f'/api/tasks/{open_id}/', {'completed': True})
+        self.assertEqual(self.streak()['current'], 3)
+        # Moving the task to the gap joins both runs; an empty today is skipped
+        self.client.patch(f'/api/tasks/{open_id}/', {'date': '2025-01-02'})
+        self.assertEqual(self.streak(), {
+            'current': 6, 'longest': 6,
+            'longest_start': date(2024, 12, 30), 'longest_end': date(2025, 1, 4),
+        })
+        self.client.delete(f'/api/tasks/{open_id}/')
+        self.assertEqual(self.streak()['current'], 2)
+        self.assertEqual(self.client.get('/api/tasks/streak/?date=bad').status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_calendar_and_tabs(self):
+        """Test the year grid, per tab and across tabs"""
+        self.create('2025-01-01', completed=True)
+        self.create('2025-01-02', completed=True)
+        self.create('2025-01-02', tab='work')
+        self.assertEqual(self.calendar()[:4], '2100')
+        self.assertEqual(len(self.calendar()), 365)
+        self.assertEqual(self.calendar(tab='personal')[:3], '220')
+        self.assertEqual(self.calendar(tab='work')[:3], '010')
+        self.assertEqual(self.calendar(year=2024), '0' * 366)
+        self.assertEqual(self.client.get('/api/tasks/calendar/?year=x').status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_bulk_paths_and_rebuild(self):
+        """Test sync, default tasks and cleanup update the history, and rebuild agrees"""
+        from django.core.management import call_command
+        today = date.today()
+        self.client.post('/api/tasks/sync/', [
+            {'title': 'Old', 'date': '2001-06-01', 'completed': True},
+            {'title': 'Done', 'date': today.isoformat(), 'completed': True},
+        ], format='json')
+        self.assertEqual(self.streak(today.isoformat())['current'], 1)
+        
+        DefaultTask.objects.create(user=self.user, weekday=(today.weekday() + 1) % 7, title='Daily')
+        self.client.post('/api/defaults/apply/', {'date': today.isoformat()})
+        self.assertEqual(self.streak(today.isoformat())['current'], 0)
+        
+        self.client.post('/api/tasks/cleanup/', {'days': 365})
+        self.assertEqual(self.calendar(year=2001), '0' * 365)
+        
+        before = list(CompletionHistory.objects.values_list('tab', 'year', 'active', 'done').order_by('tab', 'year'))
+        call_command('rebuild_completion_history', stdout=open(os.devnull, 'w'))
+        after = list(CompletionHistory.objects.values_list('tab', 'year', 'active', 'done').order_by('tab', 'year'))
+        self.assertEqual([(t, y, bytes(a), bytes(d)) for t, y, a, d in before if any(a)],
+                         [(t, y, bytes(a), bytes(d)) for t, y, a, d in after])
+    
+    def test_constant_queries(self):
+        """Test streaks read the history rows, not the tasks"""
+        for day in range(1, 29):
+            self.create(f'2025-02-{day:02d}', completed=True)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.streak('2025-02-28')['current'], 28)
+        with self.assertNumQueries(2):
+            self.calendar()
+
+
+class TemplateCacheTestCase(TestCase):
+    """Test cases for the per-user default task template cache"""
+    
+    def setUp(self):
+        """Set up an authenticated client and a template"""
+        throttling.get_store().clear()
+        from rest_framework_simplejwt.tokens import RefreshToken
+        self.user = User.objects.create_user(username='testuser', password='testpass123', email='t@example.com')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.template = DefaultTask.objects.create(user=self.user, weekday=1, title='Standup')
+    
+    def titles(self):
+        return [t['title'] for t in self.client.get('/api/defaults/').data]
+    
+    def test_repeat_reads_skip_templates_query(self):
+        """Test the list and apply read the templates once, until they change"""
+        self.client.get('/api/defaults/')
+        with self.assertNumQueries(1):  # the user
+            self.assertEqual(self.titles(), ['Standup'])
+        self.client.post('/api/defaults/apply/', {'date': '2025-11-24'})
+        with self.assertNumQueries(2):  # the user and the existing tasks
+            self.assertEqual(self.client.post('/api/defaults/apply/', {'date': '2025-11-24'}).data['created'], 0)
+        self.assertEqual(Task.objects.get().title, 'Standup')
+    
+    def test_writes_invalidate(self):
+        """Test creates, updates and deletes through the API, the ORM and bulk writes are seen"""
+        from . import template_cache
+        self.assertEqual(self.titles(), ['Standup'])
+        response = self.client.post('/api/defaults/', {'weekday': 2, 'title': 'Review'})
+        self.assertEqual(self.titles(), ['Standup', 'Review'])
+        self.client.patch(f"/api/defaults/{response.data['id']}/", {'title': 'Retro'})
+        self.assertEqual(self.titles(), ['Standup', 'Retro'])
+        self.template.delete()
+        self.assertEqual(self.titles(), ['Retro'])
+        
+        DefaultTask.objects.bulk_create([DefaultTask(user=self.user, weekday=3, title='Planning')])
+        template_cache.changed(self.user)
+        self.assertEqual(self.titles(), ['Retro', 'Planning'])
+        self.assertEqual(self.client.post('/api/defaults/apply/', {'date': '2025-11-26'}).data['created'], 1)
+        
+        # Calls later in the same batch see earlier changes
+        response = self.client.post('/api/batch', {'requests': [
+            {'method': 'GET', 'path': '/api/defaults/'},
+            {'method': 'POST', 'path': '/api/defaults/', 'body': {'weekday': 4, 'title': 'Demo'}},
+            {'method': 'GET', 'path': '/api/defaults/'},
+        ]}, format='json')
+        bodies = [r['body'] for r in response.data['responses']]
+        self.assertEqual(len(bodies[0]) + 1, len(bodies[2]))
+    
+    def test_conditional_list(self):
+        """Test the list ETag follows the templates and revalidates with 304"""
+        response = self.client.get('/api/defaults/')
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/api/defaults/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/api/defaults/', HTTP_IF_NONE_MATCH='W/' + etag).status_code, 304)
+        self.client.post('/api/defaults/', {'weekday': 2, 'title': 'Review'})
+        response = self.client.get('/api/defaults/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+    
+    @override_settings(TEMPLATE_CACHE='cache')
+    def test_shared_store(self):
+        """Test a worker with an empty local cache reads the shared copy"""
+        from . import template_cache
+        self.titles()
+        template_cache.get_store().__init__()  # another worker's empty local cache
+        with self.assertNumQueries(1):
+            self.assertEqual(self.titles(), ['Standup'])
+
+
+class JobTestCase(TestCase):
+    """Test cases for background jobs and the run_workers command"""
+    
+    def setUp(self):
+        """Set up an authenticated client"""
+        throttling.get_store().clear()
+        from rest_framework_simplejwt.tokens import RefreshToken
+        self.user = User.objects.create_user(username='testuser', password='testpass123', email='t@example.com')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+    
+    def job(self, job_id):
+        return self.client.get(f'/api/jobs/{job_id}/').data
+    
+    def test_async_request_returns_job(self):
+        """Test Prefer: respond-async queues the work and the job reports its result"""
+        from . import jobs
+        response = self.client.post('/api/tasks/sync/', [
+            {'title': 'A', 'date': '2025-11-22'},
+            {'title': 'B', 'date': '2025-11-23', 'completed': True},
+        ], format='json', HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response['Location'], f"/api/jobs/{response.data['id']}/")
+        self.assertEqual(response.data['status'], 'queued')
+        self.assertEqual(Task.objects.count(), 0)
+        
+        self.assertEqual(jobs.work(once=True), 1)
+        job = self.job(response.data['id'])
+        self.assertEqual((job['status'], job['result']), ('done', {'ok': True, 'count': 2}))
+        self.assertEqual((job['progress_done'], job['progress_total']), (2, 2))
+        self.assertEqual(Task.objects.count(), 2)
+        
+        response = self.client.post('/api/defaults/apply/?async=1', {'dates': ['2025-11-24']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        response = self.client.post('/api/tasks/cleanup/?async=1', {'days': 1})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        jobs.work(once=True)
+        self.assertEqual(self.job(response.data['id'])['result'], {'deleted': 2})
+        self.assertEqual([j['kind'] for j in self.client.get('/api/jobs/').data], ['cleanup', 'apply', 'sync'])
+    
+    def test_retries_then_fails(self):
+        """Test a failing job is retried with backoff until it runs out of attempts"""
+        from unittest import mock
+        from django.utils import timezone
+        from . import jobs
+        from .models import Job
+        job_id = self.client.post('/api/tasks/cleanup/?async=1', {'days': 30}).data['id']
+        failing = mock.Mock(side_effect=RuntimeError('disk full'))
+        with mock.patch.dict(jobs.HANDLERS, {'cleanup': failing}), self.assertLogs('tasks.jobs', 'ERROR'):
+            for attempt in range(1, 4):
+                self.assertEqual(jobs.work(once=True), 1)
+                job = Job.objects.get(pk=job_id)
+                self.assertEqual(job.attempts, attempt)
+                if attempt < 3:
+                    self.assertEqual(job.status, Job.QUEUED)
+                    self.assertGreater(job.run_after, timezone.now())
+                    self.assertEqual(jobs.work(once=True), 0)  # not due yet
+                    Job.objects.filter(pk=job_id).update(run_after=timezone.now())
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.error, 'RuntimeError: disk full')
+        self.assertEqual(failing.call_count, 3)
+    
+    def test_lost_worker(self):
+        """Test a running job whose lease ran out is claimed again, or failed after its last attempt"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from . import jobs
+        from .models import Job
+        long_ago = timezone.now() - timedelta(seconds=settings.JOB_LEASE + 1)
+        lost = Job.objects.create(user=self.user, kind='cleanup', payload={'days': 30}, status=Job.RUNNING,
+                                  attempts=1, locked_by='gone', locked_at=long_ago, run_after=long_ago)
+        last = Job.objects.create(user=self.user, kind='cleanup', payload={'days': 30}, status=Job.RUNNING,
+                                  attempts=3, locked_by='gone', locked_at=long_ago, run_after=long_ago)
+        self.assertEqual(jobs.claim('worker').pk, lost.pk)
+        self.assertIsNone(jobs.claim('worker'))
+        jobs.maintain()
+        last.refresh_from_db()
+        self.assertEqual((last.status, last.error), (Job.FAILED, 'worker lost'))
+    
+    def test_jobs_are_private_and_command_runs_them(self):
+        """Test users only see their own jobs and run_workers --once drains the queue"""
+        from io import StringIO
+        from django.core.management import call_command
+        from . import jobs
+        other = User.objects.create_user(username='other', password='testpass123', email='o@example.com')
+        theirs = jobs.enqueue(other, 'cleanup', {'days': 30})
+        self.assertEqual(self.client.get(f'/api/jobs/{theirs.pk}/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/api/jobs/').data, [])
+        
+        out = StringIO()
+        call_command('run_workers', '--once', stdout=out)
+        self.assertIn('Ran 1 jobs', out.getvalue())
+        theirs.refresh_from_db()
+        self.assertEqual(theirs.result, {'deleted': 0})
+
+
+class BackupTestCase(TestCase):
+    """Test cases for SQLite snapshots and restores"""
+    
+    def setUp(self):
+        """Create a small SQLite file outside the test database"""
+        import sqlite3
+        import tempfile
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.db = os.path.join(self.dir.name, 'live.sqlite3')
+        with sqlite3.connect(self.db) as db:
+            db.execute('CREATE TABLE t (n INTEGER)')
+            db.executemany('INSERT INTO t VALUES (?)', [(n,) for n in range(5000)])
+        self.snapshots = os.path.join(self.dir.name, 'backups')
+    
+    def rows(self):
+        import sqlite3
+        db = sqlite3.connect(self.db)
+        try:
+            return db.execute('SELECT count(*) FROM t').fetchone()[0]
+        finally:
+            db.close()
+    
+    def test_snapshot_rotate_and_restore(self):
+        """Test snapshots are stepwise, checksummed and rotated, and restore brings the data back"""
+        import sqlite3
+        from . import backup
+        paths = []
+        for _ in range(3):
+            stats = backup.snapshot(self.db, self.snapshots, 'default', pages=2, pause=0, keep=2)
+            self.assertGreater(stats['steps'], 1)
+            self.assertLess(stats['compressed'], stats['size'])
+            paths.append(stats['path'])
+        self.assertEqual(backup.snapshots(self.snapshots, 'default'), paths[1:])
+        self.assertEqual(stats['removed'], [paths[0]])
+        self.assertFalse(os.path.exists(f'{paths[0]}.sha256'))
+        backup.verify(paths[2])
+        
+        with sqlite3.connect(self.db) as db:
+            db.execute('DELETE FROM t')
+        self.assertEqual(self.rows(), 0)
+        backup.restore(paths[2], self.db)
+        self.assertEqual(self.rows(), 5000)
+    
+    def test_damaged_snapshot_is_refused(self):
+        """Test a snapshot that does not match its checksum is not restored"""
+        from . import backup
+        path = backup.snapshot(self.db, self.snapshots, 'default')['path']
+        data = bytearray(path.read_bytes())
+        data[len(data) // 2] ^= 0xFF
+        path.write_bytes(bytes(data))
+        with self.assertRaisesMessage(backup.BackupError, 'does not match its checksum'):
+            backup.restore(path, self.db)
+        with self.assertRaisesMessage(backup.BackupError, 'no database file'):
+            backup.snapshot(os.path.join(self.dir.name, 'missing.sqlite3'), self.snapshots, 'default')
+        self.assertEqual(self.rows(), 5000)
+
+
+class PurgeTestCase(TestCase):
+    """Test cases for fast user deletion"""
+    
+    def setUp(self):
+        """Create a user with data of every kind, and a bystander"""
+        from .models import Job, WeeklyTask, MonthlyTask, YearlyTask
+        self.user = User.objects.create_user(username='heavy', password='testpass123', email='h@example.com')
+        self.other = User.objects.create_user(username='other', password='testpass123', email='o@example.com')
+        for user in (self.user, self.other):
+            DefaultTask.objects.create(user=user, weekday=1, title='Standup')
+            DefaultTask.apply_defaults_for_dates(user, [date(2025, 11, 3), date(2025, 11, 10), date(2025, 11, 17)])
+            Task.objects.bulk_create([Task(user=user, title=f'Task {i}', date='2025-11-22') for i in range(7)])
+            WeeklyTask.objects.create(user=user, title='Weekly', week_start_date='2025-11-17')
+            MonthlyTask.objects.create(user=user, title='Monthly', month=11, year=2025)
+            YearlyTask.objects.create(user=user, title='Yearly', year=2025)
+            Job.objects.create(user=user, kind='cleanup', run_after='2025-11-22T00:00:00Z')
+    
+    def test_purge_user(self):
+        """Test every row of the user goes, in chunks, and nobody else's"""
+        from .purge import purge_user, PURGE_MODELS
+        counts, _ = purge_user(self.user, chunk_size=2, pause=0)
+        self.assertEqual(counts['tasks.Task'], 10)
+        self.assertEqual(counts['tasks.TaskTitle'], 1)
+        self.assertEqual(counts['tasks.CustomUser'], 1)
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        for model in PURGE_MODELS:
+            with self.subTest(model=model.__name__):
+                self.assertFalse(model.objects.filter(user_id=self.user.pk).exists())
+                self.assertTrue(model.objects.filter(user=self.other).exists())
+    
+    def test_command_and_admin_action(self):
+        """Test purge_users and the admin action delete users after confirmation"""
+        from io import StringIO
+        from django.core.management import call_command
+        from django.test import Client
+        out = StringIO()
+        call_command('purge_users', 'heavy', '--noinput', stdout=out)
+        self.assertIn('Deleted heavy', out.getvalue())
+        self.assertFalse(Task.objects.filter(user_id=self.user.pk).exists())
+        
+        admin_user = User.objects.create_superuser(username='admin', password='adminpass123', email='a@example.com')
+        client = Client()
+        client.force_login(admin_user)
+        data = {'action': 'purge_selected', '_selected_action': [self.other.pk]}
+        response = client.post('/admin/tasks/customuser/', data)
+        self.assertContains(response, 'Delete users and their data')
+        self.assertTrue(User.objects.filter(pk=self.other.pk).exists())
+        client.post('/admin/tasks/customuser/', {**data, 'post': 'yes'})
+        self.assertFalse(User.objects.filter(pk=self.other.pk).exists())
+        self.assertEqual(Task.objects.count(), 0)
+
+
+class AvatarTestCase(TestCase):
+    """Test cases for profile picture uploads and avatar thumbnails"""
+    
+    def setUp(self):
+        """Point media at a temporary directory and make thumbnails inline"""
+        import tempfile
+        throttling.get_store().clear()
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        media = override_settings(MEDIA_ROOT=self.dir.name, AVATAR_WORKERS=0, AVATAR_SIZES=[48, 96])
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = User.objects.create_user(username='testuser', password='testpass123', email='t@example.com')
+        self.client = APIClient()
+        from rest_framework_simplejwt.tokens import RefreshToken
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+    
+    def picture(self, size=(1200, 800), color=(200, 30, 30), **options):
+        from io import BytesIO
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from PIL import Image
+        out = BytesIO()
+        Image.new('RGB', size, color).save(out, 'JPEG', **options)
+        return SimpleUploadedFile('me.jpg', out.getvalue(), content_type='image/jpeg')
+    
+    def upload(self, picture):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/auth/me/avatar', {'picture': picture}, format='multipart')
+    
+    def files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.dir.name)
+            for root, _, names in os.walk(self.dir.name) for name in names
+        )
+    
+    def test_upload_cleans_and_serves_thumbnails(self):
+        """Test metadata is stripped, the picture turned upright and thumbnails cached for good"""
+        from PIL import Image
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotate 90
+        exif[0x010f] = 'Camera maker'
+        response = self.upload(self.picture(exif=exif.tobytes(), comment=b'secret'))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.avatar_hash)
+        
+        with Image.open(os.path.join(self.dir.name, self.user.profile_picture.name)) as stored:
+            self.assertEqual(stored.size, (683, 1024))
+            self.assertNotIn('exif', stored.info)
+            self.assertNotIn('comment', stored.info)
+        
+        me = self.client.get('/api/auth/me').json()
+        self.assertEqual(me['avatar'], response.json()['avatar'])
+        url = me['avatar']['96']['webp']
+        self.assertIn(self.user.avatar_hash, url)
+        served = self.client.get(url)
+        self.assertEqual(served.status_code, status.HTTP_200_OK)
+        self.assertEqual(served['Content-Type'], 'image/webp')
+        self.assertEqual(served['Cache-Control'], 'public, max-age=31536000, immutable')
+        content = b''.join(served.streaming_content)
+        self.assertLess(len(content), 4096)
+        from io import BytesIO
+        with Image.open(BytesIO(content)) as thumbnail:
+            self.assertEqual(thumbnail.size, (96, 96))
+        self.assertEqual(self.client.get(me['avatar']['48']['jpeg'])['Content-Type'], 'image/jpeg')
+        self.assertEqual(self.client.get(url.replace(self.user.avatar_hash, '0' * 16)).status_code, 404)
+    
+    def test_rejects_bad_uploads(self):
+        """Test non-pictures, oversized files and huge pictures are refused and nothing is stored"""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        response = self.upload(SimpleUploadedFile('me.jpg', b'not a picture', content_type='image/jpeg'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(AVATAR_MAX_BYTES=1000):
+            response = self.upload(self.picture())
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        with override_settings(AVATAR_MAX_PIXELS=1000):
+            response = self.upload(self.picture())
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.files(), [])
+        self.assertIsNone(self.client.get('/api/auth/me').json()['avatar'])
+    
+    def test_replace_and_delete(self):
+        """Test a new picture replaces the old files, and deleting the picture or the user removes them"""
+        self.upload(self.picture())
+        first = self.files()
+        self.assertEqual(len(first), 5)
+        self.upload(self.picture(color=(30, 30, 200)))
+        second = self.files()
+        self.assertEqual(len(second), 5)
+        self.assertFalse(set(first) & set(second))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete('/api/auth/me/avatar')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.files(), [])
+        self.assertIsNone(self.client.get('/api/auth/me').json()['avatar'])
+        
+        self.upload(self.picture())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertEqual(self.files(), [])
@@ -0,0 +1,223 @@
+"""
+Token-bucket rate limiting and write load shedding.
+
+Throttles
+---------
+Each expensive endpoint has a throttle scope (sync, apply, cleanup, login,
+register). For each user and scope there is a bucket. Authenticated users
+are identified by user id; anonymous clients by IP. A bucket holds up to N
+tokens and refills at N per period; ``THROTTLE_RATES`` sets both, e.g.
+``'sync': '12/min'``. A request that finds the bucket empty gets 429 with
+``Retry-After``.
+
+Without ``REDIS_URL`` buckets live in process memory, so each gunicorn
+worker enforces a limit on its own and a client can get up to
+workers x the rate (gunicorn.conf.py warns at startup). With
+``REDIS_URL``, ``THROTTLE_STORE`` defaults to ``'cache'``: buckets are kept
+in the Django cache and every worker shares them. Cache updates are
+read-modify-write, so concurrent requests can slightly overshoot a limit;
+they cannot starve it.
+
+Load shedding
+-------------
+LoadSheddingMiddleware times every write statement. SQLite waits for its
+write lock inside the first write of a transaction, so these timings show
+how long writers are queueing. If the mean over the last
+``LOAD_SHED_WINDOW`` seconds passes ``LOAD_SHED_WRITE_LATENCY_MS``, new API
+writes get 503 with ``Retry-After``. Reads are still served.
+"""
+import math
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.http import JsonResponse
+from rest_framework.throttling import BaseThrottle
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def parse_rate(rate):
+    """``'12/min'`` -> (capacity, seconds per full refill)."""
+    count, period = rate.split('/')
+    return int(count), {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[period[0]]
+
+
+class LocalBucketStore:
+    """Buckets in process memory."""
+
+    MAX_KEYS = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, key, capacity, refill_rate, now):
+        """Take a token. Returns seconds to wait, or 0 if one was available."""
+        with self._lock:
+            if len(self._buckets) >= self.MAX_KEYS and key not in self._buckets:
+                self._prune(now)
+            tokens, updated, _ = self._buckets.get(key, (capacity, now, None))
+            tokens, wait = _take(tokens, updated, capacity, refill_rate, now)
+            # Scopes refill at different rates, so each bucket keeps its own
+            self._buckets[key] = (tokens, now, capacity / refill_rate)
+            return wait
+
+    def _prune(self, now):
+        # A bucket that would be full again carries no state worth keeping
+        self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < v[2]}
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBucketStore:
+    """Buckets in the Django cache, shared between workers."""
+
+    def take(self, key, capacity, refill_rate, now):
+        cache = caches[settings.THROTTLE_CACHE]
+        tokens, updated = cache.get(key, (capacity, now))
+        tokens, wait = _take(tokens, updated, capacity, refill_rate, now)
+        cache.set(key, (tokens, now), timeout=math.ceil(capacity / refill_rate) + 1)
+        return wait
+
+    def clear(self):
+        caches[settings.THROTTLE_CACHE].clear()
+
+
+def _take(tokens, updated, capacity, refill_rate, now):
+    tokens = min(capacity, tokens + (now - updated) * refill_rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / refill_rate
+
+
+_stores = {'local': LocalBucketStore(), 'cache': CacheBucketStore()}
+_disabled = False
+
+
+def get_store():
+    return _stores[settings.THROTTLE_STORE]
+
+
+@contextmanager
+def disabled():
+    """Let every request through in this process, in all threads (benchmarks)."""
+    global _disabled
+    previous, _disabled = _disabled, True
+    try:
+        yield
+    finally:
+        _disabled = previous
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """DRF throttle backed by a token bucket; subclasses set ``scope``."""
+
+    scope = None
+
+    def allow_request(self, request, view):
+        self.wait_time = 0
+        rate = settings.THROTTLE_RATES.get(self.scope)
+        if _disabled or not settings.THROTTLE_ENABLED or not rate:
+            return True
+        capacity, period = parse_rate(rate)
+        if request.user and request.user.is_authenticated:
+            ident = f'user:{request.user.pk}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'
+        self.wait_time = get_store().take(f'throttle:{self.scope}:{ident}', capacity, capacity / period, time.time())
+        return self.wait_time == 0
+
+    def wait(self):
+        return self.wait_time
+
+
+class SyncThrottle(TokenBucketThrottle):
+    scope = 'sync'
+
+
+class ApplyThrottle(TokenBucketThrottle):
+    scope = 'apply'
+
+
+class CleanupThrottle(TokenBucketThrottle):
+    scope = 'cleanup'
+
+
+class LoginThrottle(TokenBucketThrottle):
+    scope = 'login'
+
+
+class RegisterThrottle(TokenBucketThrottle):
+    scope = 'register'
+
+
+class WriteLatencyMonitor:
+    """Sliding window of write-statement durations."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = deque()
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        if not sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def observe(self, duration, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._samples.append((now, duration))
+            self._expire(now)
+
+    def _expire(self, now):
+        cutoff = now - settings.LOAD_SHED_WINDOW
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+
+    def mean_latency(self, now=None):
+        """Mean write latency in seconds over the window (0 with no samples)."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._expire(now)
+            if not self._samples:
+                return 0.0
+            return sum(d for _, d in self._samples) / len(self._samples)
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+
+monitor = WriteLatencyMonitor()
+
+
+class LoadSheddingMiddleware:
+    """Reject API writes with 503 while database writes are queueing."""
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method not in self.SAFE_METHODS and request.path.startswith('/api/'):
+            latency = monitor.mean_latency()
+            if latency * 1000 > settings.LOAD_SHED_WRITE_LATENCY_MS:
+                response = JsonResponse({'error': 'server busy, retry later'}, status=503)
+                response['Retry-After'] = str(max(1, math.ceil(latency * 2)))
+                return response
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(monitor.execute_wrapper))
+            return self.get_response(request)
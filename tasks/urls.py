@@ -1,5 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from rest_framework_simplejwt.views import TokenRefreshView
 from . import views
 
 # Create router for ViewSets
@@ -9,6 +10,7 @@ router.register(r'defaults', views.DefaultTaskViewSet, basename='default-task')
 router.register(r'weekly-tasks', views.WeeklyTaskViewSet, basename='weekly-task')
 router.register(r'monthly-tasks', views.MonthlyTaskViewSet, basename='monthly-task')
 router.register(r'yearly-tasks', views.YearlyTaskViewSet, basename='yearly-task')
+router.register(r'jobs', views.JobViewSet, basename='job')
 
 urlpatterns = [
     # API endpoints
@@ -17,9 +19,19 @@ urlpatterns = [
     # Auth endpoints
     path('auth/register', views.register_user, name='register'),
     path('auth/login', views.login_user, name='login'),
+    path('auth/refresh', TokenRefreshView.as_view(), name='token-refresh'),
+    path('auth/logout', views.logout_user, name='logout'),
     path('auth/exists', views.check_users_exist, name='check-users'),
     path('auth/me', views.current_user, name='current-user'),
+    path('auth/me/avatar', views.current_user_avatar, name='current-user-avatar'),
+    
+    # Batched calls
+    path('batch', views.batch, name='batch'),
+    
+    # Search
+    path('search', views.search, name='search'),
     
     # Utility endpoints
     path('ping', views.ping, name='ping'),
+    path('metrics', views.metrics, name='metrics'),
 ]
@@ -1,41 +1,68 @@
 from rest_framework import viewsets, status, permissions
-from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.decorators import action, api_view, parser_classes, permission_classes, throttle_classes
+from rest_framework.exceptions import Throttled
+from rest_framework.filters import OrderingFilter
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate, get_user_model, login as auth_login
 from django.shortcuts import render, redirect
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse, Http404
+from django.conf import settings
+from django.core.files.storage import default_storage
 from django.views.decorators.http import require_http_methods
 from django.contrib import messages
+from django.db import router, transaction
+from django.utils.http import parse_etags
+from contextlib import ExitStack
 from datetime import datetime, timedelta
-from .models import Task, DefaultTask, WeeklyTask, MonthlyTask, YearlyTask
+from . import avatars
+from . import batch as batching
+from . import jobs
+from .instrumentation import registry as metrics_registry
+from . import search as task_search
+from . import template_cache
+from .authentication import revoke
+from .backends import create_user
+from .hashers import PasswordHashingBusy
+from .throttling import ApplyThrottle, CleanupThrottle, LoginThrottle, RegisterThrottle, SyncThrottle
+from .write_buffer import WriteBehindMixin, buffer as write_buffer
+from .models import CompletionHistory, Job, Task, DefaultTask, WeeklyTask, MonthlyTask, YearlyTask
 from .serializers import (
     TaskSerializer, 
     DefaultTaskSerializer,
+    JobSerializer,
     WeeklyTaskSerializer,
     MonthlyTaskSerializer,
     YearlyTaskSerializer,
     UserRegistrationSerializer,
-    UserSerializer
+    UserSerializer,
+    SearchResultSerializer
 )
 
 User = get_user_model()
 
 
-class TaskViewSet(viewsets.ModelViewSet):
+class TaskViewSet(WriteBehindMixin, viewsets.ModelViewSet):
     """
     ViewSet for Task CRUD operations.
     Automatically filters tasks by the authenticated user.
     """
     serializer_class = TaskSerializer
     permission_classes = [IsAuthenticated]
+    # Models have no Meta.ordering; list order is explicit and clients may
+    # only sort on columns an index can serve
+    filter_backends = [OrderingFilter]
+    ordering_fields = ['created_at', 'date']
+    ordering = ['-created_at']
     
     def get_queryset(self):
         """
         Filter tasks by authenticated user and optional date parameter.
         """
-        queryset = Task.objects.filter(user=self.request.user)
+        queryset = Task.objects.filter(user=self.request.user).prefetch_related('title_ref')
         
         # Optional date filter
         date_str = self.request.query_params.get('date')
@@ -57,9 +84,29 @@ class TaskViewSet(viewsets.ModelViewSet):
         """
         Set the user when creating a task.
         """
-        serializer.save(user=self.request.user)
+        with transaction.atomic(using=router.db_for_write(Task)):
+            task = serializer.save(user=self.request.user)
+            if task.completed:
+                CompletionHistory.refresh_days(task.user_id, task.tab, [task.date])
+            else:
+                CompletionHistory.mark_open(task.user_id, task.tab, [task.date])
+    
+    def perform_update(self, serializer):
+        task = serializer.instance
+        before = (task.user_id, task.tab, task.date, task.completed)
+        with transaction.atomic(using=router.db_for_write(Task)):
+            task = serializer.save()
+            after = (task.user_id, task.tab, task.date, task.completed)
+            # Title edits leave the history alone; a moved task updates both days
+            if after != before:
+                CompletionHistory.refresh_tasks({before[:3], after[:3]})
     
-    @action(detail=False, methods=['post'])
+    def perform_destroy(self, instance):
+        with transaction.atomic(using=router.db_for_write(Task)):
+            instance.delete()
+            CompletionHistory.refresh_days(instance.user_id, instance.tab, [instance.date])
+    
+    @action(detail=False, methods=['post'], throttle_classes=[SyncThrottle])
     def sync(self, request):
         """
         Sync endpoint: Replace all tasks with the provided list.
@@ -72,30 +119,74 @@ class TaskViewSet(viewsets.ModelViewSet):
                 {'error': 'expected array'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
+        if len(tasks_data) > settings.MAX_SYNC_TASKS:
+            return Response(
+                {'error': f'at most {settings.MAX_SYNC_TASKS} tasks per sync'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        # Delete existing tasks for this user
-        Task.objects.filter(user=request.user).delete()
-        
-        # Create new tasks
-        created_tasks = []
-        for task_data in tasks_data:
-            # Remove 'id' if present (we'll generate new ones)
-            task_data.pop('id', None)
-            serializer = self.get_serializer(data=task_data)
-            if serializer.is_valid():
-                serializer.save(user=request.user)
-                created_tasks.append(serializer.data)
-        
-        return Response({'ok': True, 'count': len(created_tasks)})
+        if jobs.wants_async(request):
+            return jobs.accepted(jobs.enqueue(request.user, 'sync', {'tasks': tasks_data}))
+        return Response(jobs.run_inline('sync', request.user, {'tasks': tasks_data}))
+    
+    @action(detail=False, methods=['get'])
+    def streak(self, request):
+        """
+        Current and longest streak of days with all tasks completed.
+        Optional: tab, and date (YYYY-MM-DD, default today) for the day
+        the current streak is counted back from.
+        """
+        try:
+            today = datetime.strptime(request.query_params['date'], '%Y-%m-%d').date()
+        except KeyError:
+            today = datetime.now().date()
+        except ValueError:
+            return Response(
+                {'error': 'invalid date format, use YYYY-MM-DD'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(CompletionHistory.streaks(request.user, today, request.query_params.get('tab')))
     
-    @action(detail=False, methods=['post'])
+    @action(detail=False, methods=['get'])
+    def calendar(self, request):
+        """
+        Completion grid of one year: one character per day, 0 no tasks,
+        1 open tasks, 2 all completed. Optional: year (default this year), tab.
+        """
+        try:
+            year = int(request.query_params.get('year', datetime.now().year))
+        except ValueError:
+            year = 0
+        if not 1 <= year <= 9998:
+            return Response(
+                {'error': 'invalid year'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({
+            'year': year,
+            'days': CompletionHistory.calendar(request.user, year, request.query_params.get('tab')),
+        })
+    
+    @action(detail=False, methods=['post'], throttle_classes=[CleanupThrottle])
     def cleanup(self, request):
         """
         Clean up old tasks (older than retention period).
         """
-        days = int(request.data.get('days', 365))
-        deleted_count = Task.cleanup_old_tasks(request.user, days)
-        return Response({'deleted': deleted_count})
+        data = request.data if isinstance(request.data, dict) else {}
+        try:
+            days = int(data.get('days', 365))
+        except (TypeError, ValueError):
+            days = -1
+        # Up to a century; far larger values overflow the cutoff date
+        if not 0 <= days <= 36500:
+            return Response(
+                {'error': 'days must be an integer from 0 to 36500'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        payload = {'days': days}
+        if jobs.wants_async(request):
+            return jobs.accepted(jobs.enqueue(request.user, 'cleanup', payload))
+        return Response(jobs.run_inline('cleanup', request.user, payload))
 
 
 class DefaultTaskViewSet(viewsets.ModelViewSet):
@@ -104,6 +195,9 @@ class DefaultTaskViewSet(viewsets.ModelViewSet):
     """
     serializer_class = DefaultTaskSerializer
     permission_classes = [IsAuthenticated]
+    filter_backends = [OrderingFilter]
+    ordering_fields = ['weekday']
+    ordering = ['weekday', 'title']
     
     def get_queryset(self):
         """
@@ -111,13 +205,41 @@ class DefaultTaskViewSet(viewsets.ModelViewSet):
         """
         return DefaultTask.objects.filter(user=self.request.user)
     
+    def list(self, request, *args, **kwargs):
+        """
+        List the cached templates. The ETag follows the user's templates
+        version, so a page load revalidating its copy gets a 304.
+        """
+        if request.query_params.get('ordering'):
+            return super().list(request, *args, **kwargs)
+        etag = f'"defaults-{request.user.pk}-{request.user.templates_version}"'
+        sent = [tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))]
+        if etag in sent:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(self.get_serializer(template_cache.templates(request.user), many=True).data)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+    
+    # The signals bump the stored templates version; the request's user is
+    # refreshed so later calls in the same request (/api/batch) see it
     def perform_create(self, serializer):
         """
         Set the user when creating a default task.
         """
         serializer.save(user=self.request.user)
+        self.request.user.refresh_from_db(fields=['templates_version'])
     
-    @action(detail=False, methods=['post'])
+    def perform_update(self, serializer):
+        serializer.save()
+        self.request.user.refresh_from_db(fields=['templates_version'])
+    
+    def perform_destroy(self, instance):
+        instance.delete()
+        self.request.user.refresh_from_db(fields=['templates_version'])
+    
+    @action(detail=False, methods=['post'], throttle_classes=[ApplyThrottle])
     def apply(self, request):
         """
         Apply default tasks for a specific date or batch of dates.
@@ -134,21 +256,16 @@ class DefaultTaskViewSet(viewsets.ModelViewSet):
                     {'error': 'dates must be an array'}, 
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            if len(dates) > settings.MAX_APPLY_DATES:
+                return Response(
+                    {'error': f'at most {settings.MAX_APPLY_DATES} dates per request'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
-            total_created = 0
-            for date_item in dates:
-                try:
-                    target_date = datetime.strptime(date_item, '%Y-%m-%d').date()
-                    created_count = DefaultTask.apply_defaults_for_date(
-                        request.user, 
-                        target_date, 
-                        tab
-                    )
-                    total_created += created_count
-                except ValueError:
-                    continue  # Skip invalid dates
-            
-            return Response({'created': total_created})
+            payload = {'dates': dates, 'tab': tab}
+            if jobs.wants_async(request):
+                return jobs.accepted(jobs.enqueue(request.user, 'apply', payload))
+            return Response(jobs.run_inline('apply', request.user, payload))
         
         # Single date processing (backward compatibility)
         if not date_str:
@@ -174,12 +291,31 @@ class DefaultTaskViewSet(viewsets.ModelViewSet):
         return Response({'created': created_count})
 
 
-class WeeklyTaskViewSet(viewsets.ModelViewSet):
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Status of the user's background jobs, newest first.
+    """
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+    list_limit = 50
+    
+    def get_queryset(self):
+        return Job.objects.filter(user=self.request.user).order_by('-pk')
+    
+    def list(self, request, *args, **kwargs):
+        jobs = self.get_queryset()[:self.list_limit]
+        return Response(self.get_serializer(jobs, many=True).data)
+
+
+class WeeklyTaskViewSet(WriteBehindMixin, viewsets.ModelViewSet):
     """
     ViewSet for WeeklyTask CRUD operations.
     """
     serializer_class = WeeklyTaskSerializer
     permission_classes = [IsAuthenticated]
+    filter_backends = [OrderingFilter]
+    ordering_fields = ['week_start_date']
+    ordering = ['-week_start_date', '-created_at']
     
     def get_queryset(self):
         """
@@ -210,12 +346,15 @@ class WeeklyTaskViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
 
-class MonthlyTaskViewSet(viewsets.ModelViewSet):
+class MonthlyTaskViewSet(WriteBehindMixin, viewsets.ModelViewSet):
     """
     ViewSet for MonthlyTask CRUD operations.
     """
     serializer_class = MonthlyTaskSerializer
     permission_classes = [IsAuthenticated]
+    filter_backends = [OrderingFilter]
+    ordering_fields = ['year', 'month']
+    ordering = ['-year', '-month', '-created_at']
     
     def get_queryset(self):
         """
@@ -253,12 +392,15 @@ class MonthlyTaskViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
 
-class YearlyTaskViewSet(viewsets.ModelViewSet):
+class YearlyTaskViewSet(WriteBehindMixin, viewsets.ModelViewSet):
     """
     ViewSet for YearlyTask CRUD operations.
     """
     serializer_class = YearlyTaskSerializer
     permission_classes = [IsAuthenticated]
+    filter_backends = [OrderingFilter]
+    ordering_fields = ['year']
+    ordering = ['-year', '-created_at']
     
     def get_queryset(self):
         """
@@ -291,6 +433,7 @@ class YearlyTaskViewSet(viewsets.ModelViewSet):
 # Authentication views
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([RegisterThrottle])
 def register_user(request):
     """
     Register a new user and return JWT tokens.
@@ -315,6 +458,7 @@ def register_user(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([LoginThrottle])
 def login_user(request):
     """
     Login user and return JWT tokens.
@@ -345,6 +489,24 @@ def login_user(request):
     )
 
 
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def logout_user(request):
+    """
+    Blacklist the given refresh token and revoke the access token
+    the request was authenticated with, if any.
+    """
+    refresh = request.data.get('refresh')
+    if refresh:
+        try:
+            RefreshToken(refresh).blacklist()
+        except TokenError:
+            pass  # Already expired or blacklisted
+    if request.auth is not None:
+        revoke(request.auth)
+    return Response({'ok': True})
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def check_users_exist(request):
@@ -365,6 +527,124 @@ def current_user(request):
     return Response(UserSerializer(request.user).data)
 
 
+@api_view(['POST', 'DELETE'])
+@permission_classes([IsAuthenticated])
+@parser_classes([MultiPartParser])
+def current_user_avatar(request):
+    """
+    Upload a profile picture (multipart field ``picture``), or remove it
+    with DELETE. The thumbnail URLs returned exist once they are made.
+    """
+    if request.method == 'DELETE':
+        avatars.remove(request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    # Streamed to a temporary file, never read into memory whole
+    handler = avatars.UploadHandler(request._request)
+    request.upload_handlers = [handler]
+    upload = request.FILES.get('picture')
+    if handler.too_large:
+        return Response(
+            {'error': f'picture larger than {settings.AVATAR_MAX_BYTES} bytes'},
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+    if upload is None:
+        return Response(
+            {'error': 'picture required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        digest = avatars.store(request.user, upload)
+    except avatars.InvalidImage as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(
+        {'ok': True, 'avatar': avatars.urls(request.user, digest)},
+        status=status.HTTP_202_ACCEPTED
+    )
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def search(request):
+    """
+    Full-text search over the user's task titles (daily, weekly, monthly
+    and yearly). Supports ?q=, ?kind= (repeatable), ?page= and ?page_size=.
+    """
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response(
+            {'error': 'q required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        page = max(1, int(request.query_params.get('page', 1)))
+        page_size = min(100, max(1, int(request.query_params.get('page_size', 20))))
+    except ValueError:
+        return Response(
+            {'error': 'page and page_size must be integers'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    kinds = request.query_params.getlist('kind') or None
+    # Results include completed; make buffered toggles visible first
+    write_buffer.flush(user_id=request.user.pk)
+    # Fetch one extra hit to know whether there is a next page without counting
+    hits = task_search.search(
+        request.user, query, kinds=kinds,
+        limit=page_size + 1, offset=(page - 1) * page_size
+    )
+    return Response({
+        'results': SearchResultSerializer(hits[:page_size], many=True).data,
+        'page': page,
+        'page_size': page_size,
+        'has_more': len(hits) > page_size,
+    })
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def batch(request):
+    """
+    Run several API calls in one round trip.
+    Body: {"requests": [{"method", "path", "body"}, ...], "atomic": false}.
+    Calls run in order and reuse this request's authentication. With atomic,
+    they share a transaction on each database they can write (the user's
+    task shard and the default database, which holds users and jobs), all
+    rolled back at the first failure. Toggles are then written at once
+    rather than through the write buffer, so none escape the rollback.
+    """
+    items = request.data.get('requests') if isinstance(request.data, dict) else None
+    if not isinstance(items, list) or not items:
+        return Response(
+            {'error': 'requests must be a non-empty array'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(items) > settings.MAX_BATCH_REQUESTS:
+        return Response(
+            {'error': f'at most {settings.MAX_BATCH_REQUESTS} requests per batch'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    atomic = bool(request.data.get('atomic'))
+    try:
+        with ExitStack() as stack:
+            if atomic:
+                for alias in sorted({router.db_for_write(model) for model in (Task, User, Job)}):
+                    stack.enter_context(transaction.atomic(using=alias))
+            responses = batching.execute_all(request, items, atomic=atomic)
+            if atomic and responses[-1]['status'] >= 400:
+                raise batching.BatchRolledBack(responses)
+    except batching.BatchRolledBack as e:
+        return Response({'ok': False, 'rolled_back': True, 'responses': e.responses})
+    
+    return Response({
+        'ok': all(r['status'] < 400 for r in responses),
+        'responses': responses,
+    })
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def ping(request):
@@ -374,20 +654,83 @@ def ping(request):
     return Response({'ok': True})
 
 
+def metrics(request):
+    """
+    Prometheus metrics collected by the performance middleware.
+    Returns 404 unless PERF_INSTRUMENTATION is enabled. Scrapers must send
+    PERF_METRICS_TOKEN as a Bearer token; without one set, the metrics
+    are only served with DEBUG.
+    """
+    if not settings.PERF_INSTRUMENTATION:
+        raise Http404
+    token = settings.PERF_METRICS_TOKEN
+    if not token and not settings.DEBUG:
+        return HttpResponse('PERF_METRICS_TOKEN is not set', status=403, content_type='text/plain')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse('unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4')
+
+
+@require_http_methods(["GET", "HEAD"])
+def avatar(request, user_id, name):
+    """
+    Serve an avatar thumbnail. Its name contains the hash of its content,
+    so browsers and proxies may keep it for good.
+    """
+    match = avatars.THUMBNAIL_NAME.match(name)
+    if not match:
+        raise Http404
+    try:
+        f = default_storage.open(avatars.thumbnail_name(user_id, match['hash'], match['size'], match['ext']))
+    except FileNotFoundError:
+        raise Http404
+    response = FileResponse(f, content_type=avatars.CONTENT_TYPES[match['ext']])
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
 # Server-side form handlers
+def _busy(request, template, exc):
+    """
+    Render ``template`` with the status and Retry-After of ``exc``: a 503
+    when the password hashing pool is full, a 429 when throttled.
+    """
+    response = render(request, template, {'error': str(exc.detail)}, status=exc.status_code)
+    response['Retry-After'] = str(exc.wait)
+    return response
+
+
+def _throttled(request, template, throttle_class):
+    """
+    The API's token bucket for the form views: a 429 response when this
+    client's ``throttle_class`` bucket is empty, else None.
+    """
+    throttle = throttle_class()
+    if throttle.allow_request(request, None):
+        return None
+    return _busy(request, template, Throttled(throttle.wait()))
+
+
 @require_http_methods(["GET", "POST"])
 def login_view(request):
     """
     Server-side login handler.
     """
     if request.method == 'POST':
+        throttled = _throttled(request, 'login.html', LoginThrottle)
+        if throttled:
+            return throttled
+        
         username = request.POST.get('username', '').strip()
         password = request.POST.get('password', '')
         
         if not username or not password:
             return render(request, 'login.html', {'error': 'Username and password are required'})
         
-        user = authenticate(request, username=username, password=password)
+        try:
+            user = authenticate(request, username=username, password=password)
+        except PasswordHashingBusy as e:
+            return _busy(request, 'login.html', e)
         
         if user is not None:
             # Create JWT token
@@ -408,6 +751,7 @@ def login_view(request):
             <body>
                 <script>
                     localStorage.setItem('todo.auth.token', '{token}');
+                    localStorage.setItem('todo.auth.refresh', '{refresh}');
                     window.location.href = '/';
                 </script>
                 <p>Redirecting...</p>
@@ -421,7 +765,7 @@ def login_view(request):
                 httponly=False,  # Changed to False so JavaScript can read it
                 secure=False,
                 samesite='Lax',
-                max_age=7*24*60*60
+                max_age=int(settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'].total_seconds())
             )
             return response
         else:
@@ -436,6 +780,10 @@ def register_view(request):
     Server-side registration handler.
     """
     if request.method == 'POST':
+        throttled = _throttled(request, 'register.html', RegisterThrottle)
+        if throttled:
+            return throttled
+        
         username = request.POST.get('username', '').strip()
         password = request.POST.get('password', '')
         email = request.POST.get('email', '').strip()
@@ -476,7 +824,7 @@ def register_view(request):
         
         # Create user
         try:
-            user = User.objects.create_user(
+            user = create_user(
                 username=username,
                 password=password,
                 email=email,
@@ -496,6 +844,7 @@ def register_view(request):
             <body>
                 <script>
                     localStorage.setItem('todo.auth.token', '{token}');
+                    localStorage.setItem('todo.auth.refresh', '{refresh}');
                     window.location.href = '/';
                 </script>
                 <p>Redirecting...</p>
@@ -509,9 +858,11 @@ def register_view(request):
                 httponly=False,  # Changed to False so JavaScript can read it
                 secure=False,
                 samesite='Lax',
-                max_age=7*24*60*60
+                max_age=int(settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'].total_seconds())
             )
             return response
+        except PasswordHashingBusy as e:
+            return _busy(request, 'register.html', e)
         except Exception as e:
             return render(request, 'register.html', {'error': f'Registration failed: {str(e)}'})
     
@@ -0,0 +1,181 @@
+"""
+Write-behind buffer for checkbox toggles.
+
+Checkbox toggles arrive as PATCH requests that change only ``completed``.
+With ``WRITE_BUFFER_WINDOW_MS`` set, these are acknowledged at once and
+held in memory, and a background thread flushes them every window. Each
+flush is one transaction with one ``bulk_update`` per model, plus the
+completion history of the days of flushed tasks. Repeated toggles of the
+same row between flushes are coalesced into a single write, so SQLite's
+write lock is taken once per window rather than once per click.
+
+Guarantees, within a worker process:
+
+- read-your-writes: any other request by the same user through
+  WriteBehindMixin views (lists, detail reads, PUT, DELETE, sync...) first
+  flushes that user's pending toggles and waits for a flush in progress;
+- durability on shutdown: pending writes are flushed at interpreter exit
+  (gunicorn workers exit normally on SIGTERM/SIGQUIT), and gunicorn's
+  ``worker_exit`` hook can call ``buffer.flush()`` too.
+
+A toggle is only held in the worker that received it. If the user's next
+request goes to a different worker, that worker can serve the old value
+for up to one window. A hard kill (SIGKILL, OOM) loses at most one
+window of toggles.
+"""
+import atexit
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from rest_framework.response import Response
+
+from .models import CompletionHistory, Task
+
+logger = logging.getLogger('tasks.write_buffer')
+
+
+class WriteBuffer:
+    """Pending field updates keyed by (model, pk), flushed in batches."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Held for the whole of a flush so readers can wait for in-flight writes
+        self._flush_lock = threading.Lock()
+        self._pending = {}  # (model, db, pk) -> (user_id, {field: value})
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def enabled(self):
+        return settings.WRITE_BUFFER_WINDOW_MS > 0
+
+    def add(self, model, db, pk, user_id, changes):
+        """Queue ``changes`` for a row of ``db``; later changes to the same fields win."""
+        with self._lock:
+            self._pending.setdefault((model, db, pk), (user_id, {}))[1].update(changes)
+            size = len(self._pending)
+            if self._thread is None:
+                self._start()
+        if size >= settings.WRITE_BUFFER_MAX_PENDING:
+            self._wakeup.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self, user_id=None):
+        """
+        Write pending changes (all of them, or one user's) in one
+        transaction per database and return the number of rows written.
+        """
+        if not self._pending and not self._flush_lock.locked():
+            return 0
+        with self._flush_lock:
+            with self._lock:
+                if user_id is None:
+                    taken, self._pending = self._pending, {}
+                else:
+                    taken = {key: entry for key, entry in self._pending.items() if entry[0] == user_id}
+                    for key in taken:
+                        del self._pending[key]
+            if not taken:
+                return 0
+
+            groups = {}
+            for (model, db, pk), (_, changes) in taken.items():
+                fields = tuple(sorted(changes))
+                groups.setdefault(db, {}).setdefault((model, fields), []).append(model(pk=pk, **changes))
+            committed = set()
+            try:
+                for db, by_fields in groups.items():
+                    with transaction.atomic(using=db):
+                        for (model, fields), objs in by_fields.items():
+                            model.objects.using(db).bulk_update(objs, fields)
+                            if model is Task:
+                                days = Task.objects.using(db).filter(pk__in=[obj.pk for obj in objs])
+                                CompletionHistory.refresh_tasks(days.values_list('user_id', 'tab', 'date'), using=db)
+                    committed.add(db)
+            except Exception:
+                # Only the databases that did not commit are retried
+                self._restore({key: entry for key, entry in taken.items() if key[1] not in committed})
+                raise
+            return len(taken)
+
+    def _restore(self, taken):
+        # Put failed writes back without overwriting anything newer
+        with self._lock:
+            for key, (user_id, changes) in taken.items():
+                newer = self._pending.get(key, (user_id, {}))[1]
+                self._pending[key] = (user_id, {**changes, **newer})
+
+    def _start(self):
+        # Started on first use so it is created in the worker, not a preloading parent
+        self._thread = threading.Thread(target=self._run, name='write-buffer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(settings.WRITE_BUFFER_WINDOW_MS / 1000)
+            self._wakeup.clear()
+            try:
+                if self.flush():
+                    connections.close_all()
+            except Exception:
+                logger.exception('write buffer flush failed, will retry')
+
+
+buffer = WriteBuffer()
+
+
+def _flush_at_exit():
+    try:
+        buffer.flush()
+    except Exception:
+        logger.exception('write buffer flush at exit failed')
+
+
+atexit.register(_flush_at_exit)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=buffer.__init__)
+
+
+class WriteBehindMixin:
+    """
+    ModelViewSet mixin that buffers PATCHes touching only ``buffered_fields``
+    and flushes the user's pending writes before any other request.
+    """
+
+    buffered_fields = ('completed',)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if not self.is_buffered(request):
+            buffer.flush(user_id=request.user.pk)
+
+    def is_buffered(self, request):
+        data = request.data
+        return (
+            request.method == 'PATCH'
+            and buffer.enabled()
+            # A buffered write would land after the batch's transaction
+            and not getattr(request, 'in_atomic_batch', False)
+            and hasattr(data, 'keys')
+            and bool(data)
+            and set(data.keys()) <= set(self.buffered_fields)
+        )
+
+    def partial_update(self, request, *args, **kwargs):
+        if not self.is_buffered(request):
+            return super().partial_update(request, *args, **kwargs)
+        instance = self.get_object()
+        serializer = self.get_serializer(instance, data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        changes = dict(serializer.validated_data, last_modified=timezone.now())
+        for field, value in changes.items():
+            setattr(instance, field, value)
+        buffer.add(type(instance), instance._state.db, instance.pk, request.user.pk, changes)
+        return Response(self.get_serializer(instance).data)
@@ -48,11 +48,14 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
+    # Let runserver serve static files through WhiteNoise too
+    'whitenoise.runserver_nostatic',
     'django.contrib.staticfiles',
     
     # Third party
     'rest_framework',
     'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',
     'corsheaders',
     
     # Local apps
@@ -61,6 +64,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'tasks.compression.CompressionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -70,6 +75,37 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Performance instrumentation: Server-Timing headers, request log lines
+# and per-endpoint histograms exposed at /api/metrics (to scrapers sending
+# PERF_METRICS_TOKEN as a Bearer token; without a token only with DEBUG)
+PERF_INSTRUMENTATION = os.environ.get('PERF_INSTRUMENTATION', 'False') == 'True'
+PERF_METRICS_TOKEN = os.environ.get('PERF_METRICS_TOKEN', '')
+if PERF_INSTRUMENTATION:
+    MIDDLEWARE.insert(0, 'tasks.instrumentation.PerformanceMiddleware')
+
+# Slow-query log: queries slower than the threshold are written to
+# SLOW_QUERY_LOG, optionally with their query plan (0 disables)
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', '0'))
+SLOW_QUERY_EXPLAIN = os.environ.get('SLOW_QUERY_EXPLAIN', 'False') == 'True'
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', str(BASE_DIR / 'data' / 'slow_queries.jsonl'))
+if SLOW_QUERY_THRESHOLD_MS > 0:
+    MIDDLEWARE.append('tasks.slow_queries.SlowQueryMiddleware')
+
+# Request profiling: staff can add ?__profile=1 (or X-Profile: 1) to a
+# request; PROFILE_SAMPLE_RATE profiles a fraction of all traffic
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'False') == 'True'
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_MAX_STORED = int(os.environ.get('PROFILE_MAX_STORED', '200'))
+if PROFILING_ENABLED:
+    MIDDLEWARE.append('tasks.profiling.ProfilingMiddleware')
+
+# Load shedding: while the mean database write latency over the last
+# LOAD_SHED_WINDOW seconds exceeds the threshold, API writes get 503 (0 disables)
+LOAD_SHED_WRITE_LATENCY_MS = float(os.environ.get('LOAD_SHED_WRITE_LATENCY_MS', '0'))
+LOAD_SHED_WINDOW = float(os.environ.get('LOAD_SHED_WINDOW', '10'))
+if LOAD_SHED_WRITE_LATENCY_MS > 0:
+    MIDDLEWARE.append('tasks.throttling.LoadSheddingMiddleware')
+
 ROOT_URLCONF = 'todo_project.urls'
 
 TEMPLATES = [
@@ -101,6 +137,20 @@ DATABASES = {
     }
 }
 
+# Sharding: with DB_SHARDS > 0 each user's tasks live in one of that many
+# SQLite files (data/shard_<n>.sqlite3); users and auth stay in default.
+# Migrate each shard with `migrate --database shard_<n>`, and run
+# rebalance_shards after changing the count.
+DB_SHARDS = int(os.environ.get('DB_SHARDS', '0'))
+for _index in range(DB_SHARDS):
+    DATABASES[f'shard_{_index}'] = {
+        'ENGINE': 'tasks.shard_backend',
+        'NAME': BASE_DIR / 'data' / f'shard_{_index}.sqlite3',
+    }
+if DB_SHARDS:
+    DATABASE_ROUTERS = ['tasks.sharding.ShardRouter']
+    MIDDLEWARE.append('tasks.sharding.ShardMiddleware')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -142,6 +192,27 @@ STATICFILES_DIRS = [
 ]
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# collectstatic writes content-hashed names plus .gz/.br copies; WhiteNoise
+# serves the precompressed file the client accepts, with a one-year
+# immutable Cache-Control for hashed names. Plain storage while developing.
+STATIC_MANIFEST = os.environ.get('STATIC_MANIFEST', str(not DEBUG)) == 'True'
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'whitenoise.storage.CompressedManifestStaticFilesStorage' if STATIC_MANIFEST
+            else 'django.contrib.staticfiles.storage.StaticFilesStorage'
+        ),
+    },
+}
+
+# API response compression (tasks/compression.py); brotli when installed
+API_COMPRESSION_MIN_BYTES = int(os.environ.get('API_COMPRESSION_MIN_BYTES', '1024'))
+API_COMPRESSION_GZIP_LEVEL = 6
+API_COMPRESSION_BROTLI_QUALITY = 4
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -150,10 +221,33 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Custom User Model
 AUTH_USER_MODEL = 'tasks.CustomUser'
 
+# Password hashing: passwords are checked and hashed on a bounded thread
+# pool (tasks/hashers.py). PASSWORD_HASHER picks the profile for new hashes;
+# hashes from the other profiles still verify and are upgraded on login.
+AUTHENTICATION_BACKENDS = ['tasks.backends.PooledModelBackend']
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'pbkdf2')  # pbkdf2, scrypt or argon2 (needs argon2-cffi)
+PBKDF2_ITERATIONS = int(os.environ.get('PBKDF2_ITERATIONS', '600000'))
+SCRYPT_WORK_FACTOR = int(os.environ.get('SCRYPT_WORK_FACTOR', str(2 ** 14)))
+SCRYPT_BLOCK_SIZE = int(os.environ.get('SCRYPT_BLOCK_SIZE', '8'))
+SCRYPT_PARALLELISM = int(os.environ.get('SCRYPT_PARALLELISM', '1'))
+ARGON2_TIME_COST = int(os.environ.get('ARGON2_TIME_COST', '2'))
+ARGON2_MEMORY_COST = int(os.environ.get('ARGON2_MEMORY_COST', '102400'))
+ARGON2_PARALLELISM = int(os.environ.get('ARGON2_PARALLELISM', '8'))
+_PASSWORD_HASHERS = {
+    'pbkdf2': 'tasks.hashers.TunedPBKDF2PasswordHasher',
+    'scrypt': 'tasks.hashers.TunedScryptPasswordHasher',
+    'argon2': 'tasks.hashers.TunedArgon2PasswordHasher',
+}
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    path for name, path in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER
+] + ['django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher']
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+PASSWORD_HASH_BACKLOG = int(os.environ.get('PASSWORD_HASH_BACKLOG', '8'))
+
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'tasks.authentication.RevocationCheckingJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -161,11 +255,13 @@ REST_FRAMEWORK = {
 }
 
 # JWT Settings
+# Short access tokens; clients renew them at /api/auth/refresh. Each refresh
+# rotates the refresh token and blacklists the old one.
 SIMPLE_JWT = {
-    'ACCESS_TOKEN_LIFETIME': timedelta(days=7),
-    'REFRESH_TOKEN_LIFETIME': timedelta(days=30),
-    'ROTATE_REFRESH_TOKENS': False,
-    'BLACKLIST_AFTER_ROTATION': False,
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=int(os.environ.get('JWT_ACCESS_MINUTES', '15'))),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=int(os.environ.get('JWT_REFRESH_DAYS', '30'))),
+    'ROTATE_REFRESH_TOKENS': True,
+    'BLACKLIST_AFTER_ROTATION': True,
     'UPDATE_LAST_LOGIN': True,
     'ALGORITHM': 'HS256',
     'SIGNING_KEY': SECRET_KEY,
@@ -175,6 +271,96 @@ SIMPLE_JWT = {
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
 }
 
+# Cache: per-process memory by default; set REDIS_URL to share it between
+# workers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+
+# Revoked access-token ids (tasks/authentication.py) must reach every
+# worker. 'cache' (the default with REDIS_URL or DEBUG) costs one lookup in
+# JWT_REVOCATION_CACHE per request. 'db' (the fallback in production
+# without REDIS_URL) mirrors a table in each worker: no query per request,
+# one indexed query per worker every JWT_REVOCATION_POLL seconds, and a
+# logout reaches the other workers only within that delay.
+JWT_REVOCATION_STORE = os.environ.get(
+    'JWT_REVOCATION_STORE', 'cache' if DEBUG or os.environ.get('REDIS_URL') else 'db'
+)
+JWT_REVOCATION_CACHE = 'default'
+JWT_REVOCATION_POLL = float(os.environ.get('JWT_REVOCATION_POLL', '2'))
+
+# Per-user cache of default task templates (tasks/template_cache.py):
+# 'local' (per process), 'cache' (also in the Django cache, shared) or 'off'
+TEMPLATE_CACHE = os.environ.get('TEMPLATE_CACHE', 'local')
+TEMPLATE_CACHE_ALIAS = 'default'
+TEMPLATE_CACHE_TIMEOUT = 24 * 3600
+
+# Background jobs (tasks/jobs.py) run by `manage.py run_workers`: failed
+# jobs are retried after JOB_RETRY_DELAY seconds, doubled per attempt; a
+# running job silent for JOB_LEASE seconds is taken from its worker
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', '5'))
+JOB_LEASE = float(os.environ.get('JOB_LEASE', '300'))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '1'))
+JOB_KEEP_DAYS = int(os.environ.get('JOB_KEEP_DAYS', '7'))
+
+# Profile pictures (tasks/avatars.py): uploads up to AVATAR_MAX_BYTES are
+# cleaned and kept at AVATAR_SOURCE_SIZE; square WebP/JPEG thumbnails of
+# AVATAR_SIZES are made on AVATAR_WORKERS threads (0 = in the request)
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', str(BASE_DIR / 'data' / 'media'))
+MEDIA_URL = '/media/'
+AVATAR_MAX_BYTES = int(os.environ.get('AVATAR_MAX_BYTES', str(10 * 1024 * 1024)))
+AVATAR_MAX_PIXELS = int(os.environ.get('AVATAR_MAX_PIXELS', '40000000'))
+AVATAR_SOURCE_SIZE = 1024
+AVATAR_SIZES = [int(size) for size in os.environ.get('AVATAR_SIZES', '48,96,192').split(',')]
+AVATAR_WORKERS = int(os.environ.get('AVATAR_WORKERS', '2'))
+
+# Purging users (tasks/purge.py): rows per DELETE, and the pause after
+# each one that lets waiting writers take the lock
+PURGE_CHUNK_SIZE = int(os.environ.get('PURGE_CHUNK_SIZE', '2000'))
+PURGE_PAUSE_MS = float(os.environ.get('PURGE_PAUSE_MS', '50'))
+
+# Online snapshots of the SQLite databases (`manage.py backup_db`): pages
+# copied per step, pause between steps for writers, snapshots kept
+BACKUP_DIR = os.environ.get('BACKUP_DIR', str(BASE_DIR / 'data' / 'backups'))
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', '7'))
+BACKUP_PAGES = int(os.environ.get('BACKUP_PAGES', '256'))
+BACKUP_PAUSE_MS = float(os.environ.get('BACKUP_PAUSE_MS', '5'))
+
+# Token-bucket throttles for the expensive endpoints (tasks/throttling.py):
+# a burst of N requests, refilled at N per period, per user (or IP when
+# anonymous). THROTTLE_STORE is 'cache' (shared, the default with REDIS_URL)
+# or 'local' (per process: with N gunicorn workers a client gets up to N x
+# each rate).
+THROTTLE_ENABLED = os.environ.get('THROTTLE_ENABLED', 'True') == 'True'
+THROTTLE_STORE = os.environ.get('THROTTLE_STORE', 'cache' if os.environ.get('REDIS_URL') else 'local')
+THROTTLE_CACHE = 'default'
+THROTTLE_RATES = {
+    'sync': os.environ.get('THROTTLE_SYNC', '12/min'),
+    'apply': os.environ.get('THROTTLE_APPLY', '60/min'),
+    'cleanup': os.environ.get('THROTTLE_CLEANUP', '6/min'),
+    'login': os.environ.get('THROTTLE_LOGIN', '10/min'),
+    'register': os.environ.get('THROTTLE_REGISTER', '10/hour'),
+}
+
+# Write-behind buffer for completed toggles (tasks/write_buffer.py): PATCHes
+# that only change `completed` are acknowledged at once and flushed together
+# every window (0 disables). MAX_PENDING rows force an early flush.
+WRITE_BUFFER_WINDOW_MS = float(os.environ.get('WRITE_BUFFER_WINDOW_MS', '0'))
+WRITE_BUFFER_MAX_PENDING = int(os.environ.get('WRITE_BUFFER_MAX_PENDING', '1000'))
+
+# Batch caps
+MAX_SYNC_TASKS = int(os.environ.get('MAX_SYNC_TASKS', '10000'))
+MAX_APPLY_DATES = int(os.environ.get('MAX_APPLY_DATES', '366'))
+MAX_BATCH_REQUESTS = int(os.environ.get('MAX_BATCH_REQUESTS', '50'))
+
 # CORS settings - Allow all origins for development
 if DEBUG:
     CORS_ALLOW_ALL_ORIGINS = True
@@ -206,3 +392,20 @@ if DEBUG:
     # Disable secure SSL redirect
     SECURE_SSL_REDIRECT = False
     SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+
+# Logging
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'tasks': {
+            'handlers': ['console'],
+            'level': os.environ.get('TASKS_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
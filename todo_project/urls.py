@@ -9,6 +9,7 @@ from tasks import views as task_views
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('tasks.urls')),
+    path('media/avatars/<int:user_id>/<str:name>', task_views.avatar, name='avatar'),
     
     # Server-side form handlers
     path('login.html', task_views.login_view, name='login'),